@@ -12,6 +12,8 @@ default = {
     'total_records_re2': '(\d+) +result',
     'generating_report_pattern': 'Your report is being generated',
     'public_login_data': {'guest': 'true', 'submit': 'Enter EagleWeb'},
+    # max number of parts downloaded at the same time from site (--use-thread)
+    'max_concurrency': 4,
 }
 
 conf = {
@@ -0,0 +1,83 @@
+import os
+import csv
+import json
+import locale
+
+
+class CheckpointCsvReader(object):
+    """
+    csv.DictReader over a binary file which knows the byte offset and line number of consumed rows,
+    so it can be started again from a saved (offset, line_num) position.
+    """
+
+    def __init__(self, path, delimiter=',', offset=0, line_num=0, encoding=None):
+        self.path = os.path.abspath(path)
+        self.encoding = encoding or locale.getpreferredencoding(False)
+        self.file = open(self.path, 'rb')
+        self.line_num = 0
+        fieldnames = next(csv.reader(self._lines(), delimiter=delimiter))
+        if offset:
+            self.file.seek(offset)
+            self.line_num = line_num
+        self.reader = csv.DictReader(self._lines(), fieldnames=fieldnames, delimiter=delimiter)
+
+    def _lines(self):
+        while True:
+            line = self.file.readline()
+            if not line:
+                return
+            self.line_num += 1
+            yield line.decode(self.encoding)
+
+    @property
+    def offset(self):
+        return self.file.tell()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.reader)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ImportCheckpoint(object):
+    """
+    json file which keeps last committed position of every imported csv file:
+    {"<csv path>": {"offset": <byte offset>, "line_num": <line number>}}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.positions = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.positions = json.load(f)
+
+    def get(self, csv_path):
+        position = self.positions.get(os.path.abspath(csv_path)) or {}
+        return position.get('offset', 0), position.get('line_num', 0)
+
+    def open(self, csv_path, delimiter=',', resume=False):
+        offset, line_num = self.get(csv_path) if resume else (0, 0)
+        if offset:
+            print('+++ Resuming [{}] from line #{} (offset={})'.format(csv_path, line_num, offset))
+        return CheckpointCsvReader(csv_path, delimiter=delimiter, offset=offset, line_num=line_num)
+
+    def save(self, reader):
+        """ save position of reader. should be called after consumed rows are committed. """
+        if not self.path:
+            return
+        self.positions[reader.path] = {'offset': reader.offset, 'line_num': reader.line_num}
+        tmp_path = '{}.tmp'.format(self.path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.positions, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,147 @@
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from apps.prop.models import County, Property, PropertyAddress, Owner, OwnerAddress, Account, AccountTaxTypeSummary, \
+    LienAuction, bulk_create_logged, bump_county_generation_on_commit
+
+
+class DirectImporter(object):
+    """
+    load import_co_data rows straight into the database (without rest api).
+    every chunk is written with bulk_create inside its own transaction, and rows which
+    the rest api would reject with 409/400 are skipped the same way.
+    bulk inserts do not send post_save signals, so every chunk bumps county generation itself
+    (and refreshes tax type summary of accounts). inserted objects are written to change log.
+    """
+
+    def __init__(self, county_name, batch_size=None):
+        self.county = County.objects.get(name=county_name)
+        self.batch_size = batch_size
+
+    @staticmethod
+    def is_valid(obj, label, data, exclude=('county', 'property', 'owner')):
+        """
+        validate and convert field values like rest api serializers do (null is allowed for nullable fields).
+        we dont use Model.clean_fields because it rejects None for nullable non-blank fields.
+        """
+        try:
+            for f in obj._meta.concrete_fields:
+                if f.primary_key or f.name in exclude:
+                    continue
+                value = getattr(obj, f.attname)
+                if value is None:
+                    if not f.null:
+                        raise ValidationError('{} cannot be null'.format(f.name))
+                    continue
+                setattr(obj, f.attname, f.clean(value, obj))
+        except ValidationError:
+            print('Skipped adding this invalid {}: {}'.format(label, str(data)))
+            return False
+        return True
+
+    def bulk_create(self, model, objs):
+        return bulk_create_logged(model, objs, batch_size=self.batch_size)
+
+    @staticmethod
+    def related_data(data):
+        """ convert rest api data (property=<id>) to model kwargs (property_id=<id>) """
+        data = data.copy()
+        data['property_id'] = data.pop('property')
+        return data
+
+    def get_property_parids(self, parids=None):
+        qs = Property.objects.filter(county=self.county)
+        if parids is not None:
+            qs = qs.filter(parid__in=parids)
+        return {parid: {'id': pk, 'parid': parid} for parid, pk in qs.values_list('parid', 'id')}
+
+    @transaction.atomic()
+    def import_properties(self, items):
+        """
+        items is a list of (property_data, owner_data) tuples.
+        returns (property_parids, new_props, new_owners) of this chunk.
+        """
+        bump_county_generation_on_commit(self.county.id)
+        property_parids = self.get_property_parids({p['parid'] for p, _ in items})
+        new_props = {}
+        for prop_data, _ in items:
+            parid = prop_data['parid']
+            if parid in property_parids or parid in new_props:
+                continue
+            prop = Property(county=self.county, parid=parid)
+            address = PropertyAddress(county=self.county, **prop_data['address'])
+            if not self.is_valid(prop, 'property', prop_data) or \
+                    not self.is_valid(address, 'property', prop_data):
+                continue
+            new_props[parid] = (prop, address)
+
+        self.bulk_create(Property, [p for p, _ in new_props.values()])
+        addresses = []
+        for parid, (prop, address) in new_props.items():
+            property_parids[parid] = {'id': prop.pk, 'parid': parid}
+            address.property_id = prop.pk
+            address.idhash = address.addresshasher()
+            addresses.append(address)
+        self.bulk_create(PropertyAddress, addresses)
+
+        owners = []
+        for prop_data, owner_data in items:
+            prop = property_parids.get(prop_data['parid'])
+            if not prop or not owner_data:
+                continue
+            owner_data = owner_data.copy()
+            addresses_data = owner_data.pop('addresses', None) or []
+            owner_data.pop('properties', None)
+            owner = Owner(county=self.county, **owner_data)
+            owner_addresses = [OwnerAddress(county=self.county, **a) for a in addresses_data]
+            if not self.is_valid(owner, 'owner', owner_data) or \
+                    not all(self.is_valid(a, 'owner', owner_data) for a in owner_addresses):
+                continue
+            owners.append((owner, owner_addresses, prop['id']))
+
+        self.bulk_create(Owner, [o for o, _, _ in owners])
+        owner_addresses = []
+        owner_properties = []
+        OwnerProperty = Owner.properties.through
+        for owner, addresses, property_id in owners:
+            owner_properties.append(OwnerProperty(owner_id=owner.pk, property_id=property_id))
+            for address in addresses:
+                address.owner_id = owner.pk
+                address.idhash = address.addresshasher()
+                owner_addresses.append(address)
+        self.bulk_create(OwnerAddress, owner_addresses)
+        OwnerProperty.objects.bulk_create(owner_properties, batch_size=self.batch_size)
+        return property_parids, len(new_props), len(owners)
+
+    @transaction.atomic()
+    def import_accounts(self, items):
+        """ items is a list of account data dicts. returns number of new accounts. """
+        bump_county_generation_on_commit(self.county.id)
+        accounts = []
+        for data in items:
+            account = Account(county=self.county, **self.related_data(data))
+            if self.is_valid(account, 'account', data):
+                accounts.append(account)
+        self.bulk_create(Account, accounts)
+        AccountTaxTypeSummary.refresh_accounts(accounts)
+        return len(accounts)
+
+    @transaction.atomic()
+    def import_lien_auctions(self, items):
+        """ items is a list of lien_auction data dicts. returns number of new lien_auctions. """
+        bump_county_generation_on_commit(self.county.id)
+        existing = set(LienAuction.objects.filter(property__in={d['property'] for d in items})
+                       .values_list('property_id', 'tax_year'))
+        auctions = []
+        for data in items:
+            auction = LienAuction(county=self.county, **self.related_data(data))
+            if not self.is_valid(auction, 'lien_auction', data):
+                continue
+            key = (auction.property_id, auction.tax_year)
+            if key in existing:
+                print('Skipped adding this duplicated lien_auction: {}'.format(str(data)))
+                continue
+            existing.add(key)
+            auctions.append(auction)
+        self.bulk_create(LienAuction, auctions)
+        return len(auctions)
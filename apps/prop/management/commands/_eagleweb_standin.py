@@ -0,0 +1,244 @@
+"""
+local stand-in of an EagleWeb county site (assessor and treasurer).
+it serves login, results.jsp, report.jsp (generate/display), report download and account.jsp pages
+in the same shape as the recorded county pages, so download commands can run without live sites.
+"""
+import csv
+import time
+import uuid
+import random
+import bisect
+import threading
+from io import StringIO
+from collections import defaultdict
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qsl
+
+SESSION_COOKIE = 'JSESSIONID'
+
+SEARCH_RESULT_TEMPLATE = """<html><body><div id="middle">
+<p>Showing {first} - {last} of {total} on {pages} pages of results</p>
+<table>{rows}</table>
+</div></body></html>"""
+SEARCH_ROW_TEMPLATE = '<tr class="tableRow{n}"><td><a href="account.jsp?accountNum={account}">{account}</a></td></tr>'
+NO_RESULT_PAGE = '<html><body><div id="middle">No results found for query</div></body></html>'
+REPORT_GENERATING_PAGE = '<html><body>Your report is being generated. please wait ...</body></html>'
+REPORT_READY_TEMPLATE = '<html><body><a href="download.jsp?id={report_id}">Download Report</a></body></html>'
+ACCOUNT_TX_TEMPLATE = """<html><body><table class="account stripe">
+<tr><th>Tax Year</th><th>Type</th><th>Effective Date</th><th>Amount</th><th>Balance</th></tr>
+{rows}</table></body></html>"""
+ACCOUNT_TX_ROW_TEMPLATE = '<tr><td>{tax_year}</td><td>{tax_type}</td><td>{date}</td><td>{amount}</td>' \
+                          '<td>{balance}</td></tr>'
+NO_ACCOUNT_PAGE = '<html><body>The account could not be found.</body></html>'
+REPORT_COLUMNS = ['ACCOUNTNO', 'NAME', 'CAREOF', 'ADDRESS1', 'ADDRESS2', 'CITY', 'STATE', 'ZIPCODE', 'STREETNO',
+                  'DIRECTION', 'STREETNAME', 'DESIGNATION', 'UNITNUMBER', 'LOCCITY', 'PROPZIP']
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class EagleWebStandIn(object):
+    """
+    records: number of accounts. account value ids are spread randomly over [0, records * id_spread).
+    latency: seconds to wait before every response.
+    report_delay: seconds a generated report stays in "being generated" state.
+    """
+
+    def __init__(self, assessor_conf, treasurer_conf=None, records=1000, records_per_page=50, latency=0.0,
+                 report_delay=0.0, tx_per_account=5, id_spread=10, seed=0):
+        self.assessor_conf = assessor_conf
+        self.treasurer_conf = treasurer_conf
+        self.records_per_page = records_per_page
+        self.latency = latency
+        self.report_delay = report_delay
+        self.tx_per_account = tx_per_account
+        rnd = random.Random(seed)
+        self.account_values = sorted(rnd.sample(range(records * id_spread), records))
+        self.sessions = defaultdict(dict)
+        self.reports = {}
+        self.stats = defaultdict(lambda: {'requests': 0, 'bytes': 0})
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self.routes = self._make_routes()
+
+    def _make_routes(self):
+        conf = self.assessor_conf
+        routes = {
+            conf['init_url']: 'init',
+            conf['login_url']: 'login',
+            conf['submit_search_url']: 'search',
+            conf['report_url']: 'report',
+            conf['eagle_web_url'].rstrip('/') + '/download.jsp': 'download',
+        }
+        if self.treasurer_conf:
+            routes.update({
+                self.treasurer_conf['init_url']: 'init',
+                self.treasurer_conf['login_url']: 'login',
+                self.treasurer_conf['account_tx_url']: 'account',
+            })
+        return routes
+
+    @staticmethod
+    def account_number(value):
+        return 'R{:07d}'.format(value)
+
+    @property
+    def account_numbers(self):
+        return [self.account_number(v) for v in self.account_values]
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                standin.handle(self, 'GET')
+
+            def do_POST(self):
+                standin.handle(self, 'POST')
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats.clear()
+
+    def total_stats(self):
+        with self._lock:
+            return {'requests': sum(s['requests'] for s in self.stats.values()),
+                    'bytes': sum(s['bytes'] for s in self.stats.values())}
+
+    def handle(self, request, method):
+        if self.latency:
+            time.sleep(self.latency)
+        url = urlparse(request.path)
+        params = dict(parse_qsl(url.query))
+        if method == 'POST':
+            length = int(request.headers.get('Content-Length') or 0)
+            params.update(parse_qsl(request.rfile.read(length).decode()))
+        session_id = self._get_session_id(request)
+        headers = {}
+        if not session_id:
+            session_id = uuid.uuid4().hex
+            headers['Set-Cookie'] = '{}={}; Path=/'.format(SESSION_COOKIE, session_id)
+        route = self.routes.get(url.path)
+        if route is None:
+            return self._respond(request, 'unknown', 404, 'Not Found', headers)
+        status, body, extra_headers = getattr(self, 'do_{}'.format(route))(self.sessions[session_id], params)
+        headers.update(extra_headers or {})
+        return self._respond(request, route, status, body, headers)
+
+    @staticmethod
+    def _get_session_id(request):
+        for cookie in (request.headers.get('Cookie') or '').split(';'):
+            name, _, value = cookie.strip().partition('=')
+            if name == SESSION_COOKIE and value:
+                return value
+        return None
+
+    def _respond(self, request, route, status, body, headers=None):
+        content_type = 'text/html'
+        if isinstance(body, tuple):
+            content_type, body = body
+        data = body.encode('u8')
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(data)))
+        for k, v in (headers or {}).items():
+            request.send_header(k, v)
+        request.end_headers()
+        request.wfile.write(data)
+        with self._lock:
+            self.stats[route]['requests'] += 1
+            self.stats[route]['bytes'] += len(data)
+
+    def _search(self, start_value, end_value):
+        lo = bisect.bisect_left(self.account_values, int(start_value)) if start_value else 0
+        hi = bisect.bisect_right(self.account_values, int(end_value)) if end_value else len(self.account_values)
+        return self.account_values[lo:hi]
+
+    def do_init(self, session, params):
+        return 200, '<html><body>EagleWeb</body></html>', None
+
+    def do_login(self, session, params):
+        session['guest'] = True
+        return 302, '', {'Location': self.assessor_conf['init_url']}
+
+    def do_search(self, session, params):
+        values = self._search(params.get('accountValueIDStart'), params.get('accountValueIDEnd'))
+        session['search'] = values
+        if not values:
+            return 200, NO_RESULT_PAGE, None
+        first_page = values[:self.records_per_page]
+        rows = ''.join(SEARCH_ROW_TEMPLATE.format(n=i % 2 + 1, account=self.account_number(v))
+                       for i, v in enumerate(first_page))
+        pages = (len(values) + self.records_per_page - 1) // self.records_per_page
+        return 200, SEARCH_RESULT_TEMPLATE.format(first=1, last=len(first_page), total=len(values), pages=pages,
+                                                  rows=rows), None
+
+    def do_report(self, session, params):
+        if params.get('generate'):
+            report_id = uuid.uuid4().hex
+            self.reports[report_id] = session.get('search') or []
+            session['report'] = (report_id, time.time() + self.report_delay)
+            return 200, REPORT_GENERATING_PAGE, None
+        report_id, ready_at = session.get('report') or (None, None)
+        if report_id is None or time.time() < ready_at:
+            return 200, REPORT_GENERATING_PAGE, None
+        return 200, REPORT_READY_TEMPLATE.format(report_id=report_id), None
+
+    def do_download(self, session, params):
+        values = self.reports.get(params.get('id'))
+        if values is None:
+            return 404, 'Not Found', None
+        out = StringIO()
+        writer = csv.writer(out, delimiter='\t')
+        writer.writerow(REPORT_COLUMNS)
+        for v in values:
+            account = self.account_number(v)
+            writer.writerow([account, 'OWNER {}'.format(account), '', '{} MAIN ST'.format(v % 1000), '', 'GRANBY',
+                             'CO', '80446', str(v % 1000), '', 'MAIN', 'ST', '', 'GRANBY', '80446'])
+        return 200, ('text/csv', out.getvalue()), None
+
+    def do_account(self, session, params):
+        account = params.get('account') or ''
+        try:
+            value = int(account.lstrip('R'))
+        except ValueError:
+            value = None
+        idx = bisect.bisect_left(self.account_values, value) if value is not None else -1
+        if idx < 0 or idx >= len(self.account_values) or self.account_values[idx] != value:
+            return 200, NO_ACCOUNT_PAGE, None
+        rows = []
+        for i in range(self.tx_per_account):
+            amount = (value % 5000) + i * 10.5
+            rows.append(ACCOUNT_TX_ROW_TEMPLATE.format(tax_year=2016 - i, tax_type='Tax Charge',
+                                                       date='01/01/{:02d}'.format(17 - i),
+                                                       amount='${:,.2f}'.format(amount), balance='$0.00'))
+        return 200, ACCOUNT_TX_TEMPLATE.format(rows=''.join(rows)), None
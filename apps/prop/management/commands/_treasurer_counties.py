@@ -4,6 +4,7 @@ default = {
     'login_url': '/treasurer/web/loginPOST.jsp',
     'account_tx_url': '/treasurer/treasurerweb/account.jsp',
     'public_login_data': {'guest': 'true', 'submit': 'Enter EagleWeb'},
+    'max_concurrency': 8,
 }
 
 conf = {
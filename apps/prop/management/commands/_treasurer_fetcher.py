@@ -0,0 +1,136 @@
+import time
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+from bs4 import BeautifulSoup
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def parse_account_tx(html):
+    """
+    return td texts of transaction rows of an account.jsp page (None if account could not be found).
+    it is a module function so it can be run in a process pool.
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    table = soup.find('table', attrs={'class': 'account stripe'})
+    if not table:
+        return None
+    return [[td.text for td in tr.find_all('td')] for tr in table.find_all('tr')[1:]]
+
+
+class HostThrottle(object):
+    """
+    concurrency limit and adaptive delay of requests to one host.
+    delay is doubled on errors/slow responses (up to max_delay) and halved on fast responses.
+    """
+
+    def __init__(self, limit, slow_seconds, min_delay=0.25, max_delay=30.0):
+        self.semaphore = asyncio.Semaphore(limit)
+        self.slow_seconds = slow_seconds
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay = 0.0
+
+    def slow_down(self, retry_after=None):
+        self.delay = min(self.max_delay, max(self.min_delay, self.delay * 2, retry_after or 0))
+
+    def speed_up(self):
+        self.delay = self.delay / 2 if self.delay > self.min_delay else 0.0
+
+    def record(self, elapsed):
+        if elapsed > self.slow_seconds:
+            self.slow_down()
+        else:
+            self.speed_up()
+
+
+class AsyncAccountFetcher(object):
+    """
+    fetch urls with asyncio. blocking http requests run in a thread pool (limited per host) and
+    html is parsed in a separate thread/process pool, so the event loop only schedules work.
+    """
+
+    def __init__(self, session, concurrency=8, slow_seconds=5.0, max_retries=3, parse_processes=0, timeout=60):
+        self.session = session
+        self.concurrency = concurrency
+        self.slow_seconds = slow_seconds
+        self.max_retries = max_retries
+        self.parse_processes = parse_processes
+        self.timeout = timeout
+        self.throttles = {}
+
+    def throttle(self, url):
+        host = urlparse(url).netloc
+        if host not in self.throttles:
+            self.throttles[host] = HostThrottle(self.concurrency, self.slow_seconds)
+        return self.throttles[host]
+
+    @staticmethod
+    def _retry_after(response):
+        try:
+            return float(response.headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            return None
+
+    async def fetch(self, loop, url):
+        throttle = self.throttle(url)
+        for attempt in range(self.max_retries + 1):
+            async with throttle.semaphore:
+                if throttle.delay:
+                    await asyncio.sleep(throttle.delay)
+                start_time = time.time()
+                try:
+                    response = await loop.run_in_executor(
+                        self.io_executor, functools.partial(self.session.get, url, timeout=self.timeout))
+                except Exception as e:
+                    throttle.slow_down()
+                    error = e
+                    continue
+                if response.status_code in RETRY_STATUSES:
+                    throttle.slow_down(self._retry_after(response))
+                    error = Exception('status code {}'.format(response.status_code))
+                    continue
+                throttle.record(time.time() - start_time)
+                response.raise_for_status()
+                return response.text
+        raise error
+
+    async def fetch_item(self, loop, key, url, handle_result, handle_error):
+        try:
+            html = await self.fetch(loop, url)
+            rows = await loop.run_in_executor(self.parse_executor, parse_account_tx, html)
+            await loop.run_in_executor(self.io_executor, handle_result, key, rows)
+        except Exception as e:
+            handle_error(key, e)
+
+    async def _run(self, loop, items, handle_result, handle_error):
+        tasks = [self.fetch_item(loop, key, url, handle_result, handle_error) for key, url in items]
+        await asyncio.gather(*tasks)
+
+    def run(self, items, handle_result, handle_error):
+        """
+        items: iterable of (key, url).
+        handle_result(key, rows) is called in the io thread pool with parsed rows (None for not found pages).
+        handle_error(key, exception) is called for items failed after all retries.
+        """
+        self.throttles = {}
+        self.io_executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        if self.parse_processes:
+            self.parse_executor = ProcessPoolExecutor(max_workers=self.parse_processes)
+        else:
+            self.parse_executor = ThreadPoolExecutor(max_workers=1)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self._run(loop, items, handle_result, handle_error))
+        finally:
+            loop.close()
+            asyncio.set_event_loop(None)
+            self.io_executor.shutdown()
+            self.parse_executor.shutdown()
@@ -0,0 +1,124 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import functools
+from contextlib import redirect_stdout
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from . import _assessor_counties as assessor_counties
+from . import _treasurer_counties as treasurer_counties
+from ._eagleweb_standin import EagleWebStandIn
+from .download_assessor_data import Command as AssessorCommand
+
+print = functools.partial(print, flush=True)
+
+
+class Command(BaseCommand):
+
+    help = "benchmark download_assessor_data and download_treasurer_data against a local EagleWeb stand-in site"
+    RECORDS = 2000
+    RECORDS_PER_PAGE = 50
+    ACCOUNTS = 100
+    PARTS = 10
+    CHECK_REPORT_INTERVAL = 1
+
+    def add_arguments(self, parser):
+        parser.add_argument('--county', action='append', dest='counties',
+                            help='county config to benchmark (can be repeated). default is all assessor counties: '
+                                 '{}'.format(', '.join(assessor_counties.conf.keys())))
+        parser.add_argument('--records', action='store', type=int, default=self.RECORDS,
+                            help='number of accounts served by stand-in site')
+        parser.add_argument('--records-per-page', action='store', type=int, default=self.RECORDS_PER_PAGE)
+        parser.add_argument('--latency', action='store', type=float, default=0.0,
+                            help='seconds of latency for every stand-in response')
+        parser.add_argument('--report-delay', action='store', type=float, default=0.0,
+                            help='seconds a report stays in "being generated" state')
+        parser.add_argument('--accounts', action='store', type=int, default=self.ACCOUNTS,
+                            help='number of accounts downloaded by treasurer downloader')
+        parser.add_argument('--parts', action='store', type=int, default=self.PARTS)
+        parser.add_argument('--check-report-interval', action='store', type=int, default=self.CHECK_REPORT_INTERVAL)
+        parser.add_argument('--use-thread', action='store_true')
+        parser.add_argument('--discovery-strategy', action='store', choices=AssessorCommand.DISCOVERY_STRATEGIES)
+        parser.add_argument('--treasurer-concurrency', action='store', type=int, default=1,
+                            help='concurrent requests of treasurer downloader')
+        parser.add_argument('--skip-assessor', action='store_true')
+        parser.add_argument('--skip-treasurer', action='store_true')
+        parser.add_argument('--verbose', action='store_true', help='show output of downloaders')
+
+    def handle(self, *args, **options):
+        counties = options.get('counties') or list(assessor_counties.conf.keys())
+        invalid = [c for c in counties if c not in assessor_counties.conf]
+        if invalid:
+            print('!!! Invalid counties {}! valid counties are: [{}]'.format(
+                invalid, ', '.join(assessor_counties.conf.keys())))
+            sys.exit(1)
+        self.options = options
+        results = []
+        for county in counties:
+            print('+++ Benchmarking [{}] ...'.format(county))
+            results.append(self.benchmark_county(county))
+
+        print('########## Benchmark Results ##########')
+        print('{:<14} {:>10} {:>12} {:>10} {:>10} {:>12} {:>10}'.format(
+            'county', 'asr_reqs', 'asr_bytes', 'asr_secs', 'trs_reqs', 'trs_bytes', 'trs_secs'))
+        for county, assessor, treasurer in results:
+            print('{:<14} {:>10} {:>12} {:>10.1f} {:>10} {:>12} {:>10.1f}'.format(
+                county, assessor['requests'], assessor['bytes'], assessor['seconds'],
+                treasurer['requests'], treasurer['bytes'], treasurer['seconds']))
+
+    def _run(self, standin, command_name, county, **kwargs):
+        standin.reset_stats()
+        start_time = timezone.now()
+        out = sys.stdout if self.options.get('verbose') else io.StringIO()
+        with redirect_stdout(out):
+            # required options should be passed as args to call_command
+            call_command(command_name, '--county={}'.format(county), **kwargs)
+        stats = standin.total_stats()
+        stats['seconds'] = (timezone.now() - start_time).total_seconds()
+        return stats
+
+    def benchmark_county(self, county):
+        options = self.options
+        empty = {'requests': 0, 'bytes': 0, 'seconds': 0.0}
+        assessor_conf = assessor_counties.default.copy()
+        assessor_conf.update(assessor_counties.conf[county])
+        treasurer_conf = treasurer_counties.default.copy()
+        treasurer_conf.update(treasurer_counties.conf.get(county) or {})
+        standin = EagleWebStandIn(assessor_conf, treasurer_conf, records=options['records'],
+                                  records_per_page=options['records_per_page'], latency=options['latency'],
+                                  report_delay=options['report_delay'])
+        old_assessor_conf = assessor_counties.conf[county]
+        old_treasurer_conf = treasurer_counties.conf.get(county)
+        download_path = tempfile.mkdtemp(prefix='benchmark-{}-'.format(county))
+        try:
+            with standin:
+                assessor_counties.conf[county] = dict(old_assessor_conf, site=standin.url)
+                treasurer_counties.conf[county] = dict(old_treasurer_conf or {}, site=standin.url)
+                assessor = empty
+                if not options.get('skip_assessor'):
+                    kwargs = dict(download_path=download_path, parts=options['parts'],
+                                  round_wait_seconds=0, check_report_interval=options['check_report_interval'],
+                                  use_thread=options.get('use_thread'), noinput=True)
+                    if options.get('discovery_strategy'):
+                        kwargs['discovery_strategy'] = options['discovery_strategy']
+                    assessor = self._run(standin, 'download_assessor_data', county, **kwargs)
+                treasurer = empty
+                if not options.get('skip_treasurer'):
+                    account_ids_file = os.path.join(download_path, 'account_ids.txt')
+                    with open(account_ids_file, 'w') as f:
+                        f.write('\n'.join(standin.account_numbers[:options['accounts']]))
+                    treasurer = self._run(standin, 'download_treasurer_data', county,
+                                          download_path=download_path, account_ids_file=account_ids_file,
+                                          concurrency=options['treasurer_concurrency'], noinput=True)
+        finally:
+            assessor_counties.conf[county] = old_assessor_conf
+            if old_treasurer_conf is None:
+                treasurer_counties.conf.pop(county, None)
+            else:
+                treasurer_counties.conf[county] = old_treasurer_conf
+            shutil.rmtree(download_path, ignore_errors=True)
+        return county, assessor, treasurer
@@ -1,13 +1,16 @@
 import os
 import re
 import sys
+import json
 import time
 import glob
 import math
 import shutil
 import requests
+import threading
 import traceback
 import functools
+from concurrent.futures import ThreadPoolExecutor, wait
 from django.conf import settings
 from retrying import retry
 try:
@@ -30,6 +33,12 @@ class Command(BaseCommand):
     _general_session = None
     _finished_counter = 0
     records_per_page = None
+    total_records = None
+    plan = None
+    discovered_pages = None
+    discovery_probes = 0
+    record_density = None
+    _probe_counter = 0
     is_finished_parts = False
     start_value = 0
     next_value = None
@@ -39,12 +48,19 @@ class Command(BaseCommand):
     county = None
     DOWNLOAD_DIR = 'assessor-downloads'
     EXPORT_FILE = 'total.csv'
+    PLAN_FILE = 'plan.json'
+    PLAN_DRIFT_THRESHOLD = 0.01
     CHECK_REPORT_INTERVAL = 5
     PIVOT_INIT_VALUE = 1000
     PARTS_COUNT = 30
     SHOW_INFO_INTERVAL = 10
     ROUND_WAIT_SECONDS = 300
     PAGES_DELTA = 1
+    WORKERS = 4
+    DISCOVERY_BISECT = 'bisect'
+    DISCOVERY_INTERPOLATE = 'interpolate'
+    DISCOVERY_STRATEGIES = (DISCOVERY_BISECT, DISCOVERY_INTERPOLATE)
+    MAX_EXTRAPOLATION_FACTOR = 16
 
     @property
     def county_conf(self):
@@ -75,6 +91,10 @@ class Command(BaseCommand):
     def download_parts_dir(self):
         return os.path.join(self.download_path, self.county, 'parts')
 
+    @property
+    def plan_file_path(self):
+        return os.path.join(self.download_path, self.county, self.PLAN_FILE)
+
     @property
     def export_file_path(self):
         return os.path.join(self.download_path, self.county, self.export_file or self.EXPORT_FILE)
@@ -90,7 +110,17 @@ class Command(BaseCommand):
         parser.add_argument('--round-wait-seconds', action='store', type=int, default=self.ROUND_WAIT_SECONDS)
         parser.add_argument('--show-failed-parts', action='store_true')
         parser.add_argument('--pages-delta', action='store', type=int, default=self.PAGES_DELTA)
-        parser.add_argument('--use-thread', action='store_true')
+        parser.add_argument('--use-thread', action='store_true',
+                            help='download discovered parts concurrently in a thread pool')
+        parser.add_argument('--workers', action='store', type=int, default=self.WORKERS,
+                            help='number of download threads of --use-thread (limited by site max_concurrency)')
+        parser.add_argument('--plan-drift-threshold', action='store', type=float, default=self.PLAN_DRIFT_THRESHOLD,
+                            help='rediscover saved parts plan if total records changed more than this ratio')
+        parser.add_argument('--replan', action='store_true', help='ignore saved parts plan and rediscover parts')
+        parser.add_argument('--discovery-strategy', action='store', choices=self.DISCOVERY_STRATEGIES,
+                            default=self.DISCOVERY_BISECT,
+                            help='how to search end value of parts: "bisect" (doubling then bisecting pages) or '
+                                 '"interpolate" (estimate from record density, bisect only when estimate misses)')
         parser.add_argument('--noinput', action='store_true')
         parser.add_argument('--clean', action='store_true')
         parser.add_argument('--merge', action='store_true')
@@ -113,9 +143,16 @@ class Command(BaseCommand):
         self.parts = options.get('parts')
         self.noinput = options.get('noinput')
         self.use_thread = options.get('use_thread')
+        self.workers = max(1, min(options.get('workers') or self.WORKERS, self.county_conf['max_concurrency']))
+        self._lock = threading.Lock()
         self.round_wait_seconds = options.get('round_wait_seconds')
         self.export_file = options.get('export_file')
         self.check_report_interval = options.get('check_report_interval')
+        self.plan_drift_threshold = options.get('plan_drift_threshold')
+        self.replan = options.get('replan')
+        self.discovery_strategy = options.get('discovery_strategy') or self.DISCOVERY_BISECT
+        self.record_density = None
+        self.discovery_probe_counts = []
         self.download_path = os.path.join(options.get('download_path') or settings.BASE_DIR,
                                           options.get('download_dir') or self.DOWNLOAD_DIR)
         self.init_url = urljoin(self.base_url, self.county_conf['init_url'])
@@ -135,16 +172,94 @@ class Command(BaseCommand):
             prev_n = n
         return gaps
 
+    def add_failed_part(self, start_value, end_value):
+        with self._lock:
+            self.failed_parts.append((start_value, end_value))
+
+    def pop_failed_parts(self):
+        with self._lock:
+            failed_parts, self.failed_parts = self.failed_parts, []
+        return failed_parts
+
+    def new_plan(self):
+        return {
+            'county': self.county,
+            'parts': self.parts,
+            'pages_delta': self.pages_delta,
+            'pages_per_part': self.pages_per_part,
+            'records_per_page': self.records_per_page,
+            'total_pages': self.total_page,
+            'total_records': self.total_records,
+            'ranges': [],
+        }
+
+    def load_plan(self):
+        """
+        load saved parts plan ([start, end, pages] ranges discovered by previous runs).
+        plan is ignored if it was made for other parts settings or site records are drifted.
+        """
+        if self.replan or not os.path.exists(self.plan_file_path):
+            return None
+        with open(self.plan_file_path) as f:
+            plan = json.load(f)
+        if (plan.get('parts'), plan.get('pages_delta')) != (self.parts, self.pages_delta):
+            print('!!! Saved parts plan was made for other --parts/--pages-delta! Rediscovering parts ...')
+            return None
+        if self.total_records is not None and plan.get('total_records') is not None:
+            old_total, new_total = plan['total_records'], self.total_records
+        else:
+            old_total, new_total = plan.get('total_pages') or 0, self.total_page
+        drift = abs(new_total - old_total) / max(old_total, 1)
+        if drift > self.plan_drift_threshold:
+            print('!!! Site records drifted from [{}] to [{}]! Rediscovering parts ...'.format(old_total, new_total))
+            return None
+        print('++ Reusing saved parts plan with [{}] ranges: {}'.format(len(plan['ranges']), self.plan_file_path))
+        return plan
+
+    def save_plan(self):
+        tmp_path = '{}.tmp'.format(self.plan_file_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(self.plan, f, indent=2)
+        os.replace(tmp_path, self.plan_file_path)
+
+    def add_plan_range(self, start_value, end_value, pages):
+        ranges = [r for r in self.plan['ranges'] if r[0] != start_value]
+        ranges.append([start_value, end_value, pages])
+        ranges.sort(key=lambda r: r[0])
+        self.plan['ranges'] = ranges
+        self.save_plan()
+
+    def get_downloaded_parts(self):
+        if not os.path.exists(self.download_parts_dir):
+            return []
+        files = glob.glob1(self.download_parts_dir, '*[0-9]-*[0-9].csv')
+        return sorted(tuple(map(int, f[:-4].split('-'))) for f in files)
+
+    def init_resume_vars_from_plan(self, parts):
+        downloaded = set(parts)
+        for start_value, end_value, _ in self.plan['ranges']:
+            if (start_value, end_value or 0) not in downloaded:
+                self.planned_parts.append((start_value, end_value))
+        last_start, last_end, _ = self.plan['ranges'][-1]
+        if last_end is None:
+            self.is_finished_parts = True
+        else:
+            self.start_value = last_end + 1
+        print('++ [{}] planned parts are not downloaded yet.'.format(len(self.planned_parts)))
+
     def init_resume_vars(self):
         self.start_value = 0
         self.is_finished_parts = False
         self.failed_parts = []
-        if not os.path.exists(self.download_parts_dir):
-            return
-        parts = [tuple(map(int, f[:-4].split('-'))) for f in glob.glob1(self.download_parts_dir, '*[0-9]-*[0-9].csv')]
+        self.planned_parts = []
+        self.plan = self.load_plan() or self.new_plan()
+        parts = self.get_downloaded_parts()
+        if self.plan['ranges']:
+            return self.init_resume_vars_from_plan(parts)
         if not parts:
             return
-        parts.sort()
+        for s, n in parts:
+            self.add_plan_range(s, n or None, None)
         last_start, last_next = parts[-1]
         if last_next == 0 and last_start != 0:
             self.is_finished_parts = True
@@ -156,14 +271,16 @@ class Command(BaseCommand):
         for s, e in failed_gaps:
             p = self._scrap_total_page(s, e)
             if p <= self.pages_per_part + self.pages_delta:
-                self.failed_parts.append((s, e))
+                self.add_plan_range(s, e, p)
+                self.add_failed_part(s, e)
             else:
                 while s < e:
                     n = self.discover_best_actual_value(s)
                     if n is None or n > e:
                         n = e
                     print('!!! Discovered failed part: [{} - {}]'.format(s, n))
-                    self.failed_parts.append((s, n))
+                    self.add_plan_range(s, n, None)
+                    self.add_failed_part(s, n)
                     s = n + 1
 
     def _handle(self, *args, **options):
@@ -188,6 +305,7 @@ class Command(BaseCommand):
         pages_info = self._scrap_total_page(0, None, include_extra=True)
         self.total_page = pages_info['pages']
         self.records_per_page = pages_info['records_per_page']
+        self.total_records = pages_info['records']
         print('OK')
         self.pages_per_part = int(math.ceil(self.total_page / self.parts))
         print('++ Distributing [{}] pages between [{}] parts ...'.format(self.total_page, self.parts))
@@ -197,27 +315,54 @@ class Command(BaseCommand):
         if self.failed_parts:
             print('!!! discovered this failed parts from previous: {}'.format(self.failed_parts))
         start_value = self.start_value
+        executor = ThreadPoolExecutor(max_workers=self.workers) if self.use_thread else None
+        if executor:
+            print('++ Downloading parts with [{}] threads ...'.format(self.workers))
+        futures = []
+        for planned_start, planned_end in self.planned_parts:
+            self.start_download(executor, futures, planned_start, planned_end)
+            if not executor:
+                print('!!! waiting for [{}] seconds ...'.format(self.round_wait_seconds))
+                time.sleep(self.round_wait_seconds)
         while not self.is_finished_parts:
             print('++ Discovering best actual value from [{}] ...'.format(start_value))
             t1 = timezone.now()
             next_value = self.discover_best_actual_value(start_value)
             duration = (timezone.now() - t1).total_seconds()
-            print('++ Discovered [{}] for [{}] in [{}] Seconds'.format(next_value, start_value, duration))
-            self.download_range_data(start_value, next_value)
-            print('*********** Finished = {} **************'.format(self._finished_counter))
+            print('++ Discovered [{}] for [{}] in [{}] Seconds with [{}] probe requests'.format(
+                next_value, start_value, duration, self.discovery_probes))
+            self.discovery_probe_counts.append(self.discovery_probes)
+            self.add_plan_range(start_value, next_value, self.discovered_pages)
+            self.start_download(executor, futures, start_value, next_value)
             if next_value is None:
                 break
-            print('!!! waiting for [{}] seconds ...'.format(self.round_wait_seconds))
-            time.sleep(self.round_wait_seconds)
+            if not executor:
+                print('!!! waiting for [{}] seconds ...'.format(self.round_wait_seconds))
+                time.sleep(self.round_wait_seconds)
             start_value = next_value + 1
+        if executor:
+            wait(futures)
+            executor.shutdown()
+            print('*********** Finished = {} **************'.format(self._finished_counter))
 
         print('+++ download parts finished. ')
+        if self.discovery_probe_counts:
+            print('+++ [{}] discovery: [{}] probe requests for [{}] parts ([{:.1f}] per part)'.format(
+                self.discovery_strategy, sum(self.discovery_probe_counts), len(self.discovery_probe_counts),
+                sum(self.discovery_probe_counts) / len(self.discovery_probe_counts)))
         print('+++ Retrying failed parts ....')
         self.retry_failed_parts()
         if self.failed_parts:
             print('!!!!!!! We already failed this parts: {}'.format(self.failed_parts))
         print('########## Finished downloads ###########')
 
+    def start_download(self, executor, futures, start_value, end_value):
+        if executor:
+            futures.append(executor.submit(self.download_range_data, start_value, end_value))
+            return
+        self.download_range_data(start_value, end_value)
+        print('*********** Finished = {} **************'.format(self._finished_counter))
+
     def merge_parts(self):
         if not os.path.exists(self.download_parts_dir):
             print('!!! Cannot merge files! part files not downloaded yet!')
@@ -283,16 +428,94 @@ class Command(BaseCommand):
     def retry_failed_parts(self):
         max_retry = 3
         while self.failed_parts and max_retry > 0:
-            for start_value, end_value in self.failed_parts[:]:
-                self.failed_parts.pop(0)
-                print('++++ retrying failed part {} - {} ...'.format(start_value, end_value))
-                self.download_range_data(start_value, end_value)
-                print('!!! waiting for [{}] seconds ...'.format(self.round_wait_seconds))
-                time.sleep(self.round_wait_seconds)
+            failed_parts = self.pop_failed_parts()
+            if self.use_thread:
+                print('++++ retrying failed parts {} with [{}] threads ...'.format(failed_parts, self.workers))
+                with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                    for start_value, end_value in failed_parts:
+                        executor.submit(self.download_range_data, start_value, end_value)
+            else:
+                for start_value, end_value in failed_parts:
+                    print('++++ retrying failed part {} - {} ...'.format(start_value, end_value))
+                    self.download_range_data(start_value, end_value)
+                    print('!!! waiting for [{}] seconds ...'.format(self.round_wait_seconds))
+                    time.sleep(self.round_wait_seconds)
             max_retry -= 1
 
     @retry(wait_exponential_multiplier=10000, wait_exponential_max=60000, stop_max_attempt_number=10)
     def discover_best_actual_value(self, start_value):
+        """ find end value of a part starting from start_value (None means part contains all remaining records) """
+        probe_counter = self._probe_counter
+        if self.discovery_strategy == self.DISCOVERY_INTERPOLATE and self.total_records is not None:
+            value = self._discover_by_interpolation(start_value)
+        else:
+            value = self._discover_by_bisection(start_value)
+        self.discovery_probes = self._probe_counter - probe_counter
+        return value
+
+    def _discover_by_interpolation(self, start_value):
+        """
+        estimate record density over account value ids and interpolate end value for target records of a part.
+        the first estimate uses density of previous part. if an interpolated value misses (inside a known
+        [lower, upper] bracket), next probe bisects the bracket to guarantee convergence.
+        """
+        rpp = self.records_per_page
+        min_records = (self.pages_per_part - 1) * rpp + 1
+        max_records = (self.pages_per_part + self.pages_delta) * rpp
+        target = (min_records + max_records) // 2
+        lower = (start_value - 1, 0)  # (value, records): records of [start_value, value] are less than target
+        upper = None  # (value, records): records of [start_value, value] are more than target
+        if self.record_density:
+            value = start_value + max(1, int(target / self.record_density))
+        else:
+            value = 2 * start_value + 1
+        interpolated = False
+        rnd = 0
+        while True:
+            records = self._scrap_total_page(start_value, value, include_extra=True)['records']
+            if records is None:
+                print('!!! Cannot scrap total records! Falling back to bisect ...')
+                return self._discover_by_bisection(start_value)
+            rnd += 1
+            print('$$$ Round=[{}]: start_value=[{}], upper_bound=[{}], records=[{}]'.format(rnd, start_value,
+                                                                                            value, records))
+            if upper is None and records == lower[1]:
+                rest = self._scrap_total_page(value, None, include_extra=True)['records'] or 0
+                if records + rest <= max_records:
+                    self.discovered_pages = int(math.ceil((records + rest) / rpp))
+                    return None
+
+            if min_records <= records <= max_records:
+                self.record_density = records / (value - start_value + 1)
+                self.discovered_pages = int(math.ceil(records / rpp))
+                return value
+            if records < min_records:
+                lower = (value, records)
+            else:
+                upper = (value, records)
+
+            if upper is None:
+                # extrapolate from density of [start_value, value]
+                span = value - start_value + 1
+                if records:
+                    next_value = start_value + int(target * span / records)
+                else:
+                    next_value = start_value + 2 * span
+                value = max(value + 1, min(next_value, start_value + self.MAX_EXTRAPOLATION_FACTOR * span))
+                continue
+
+            if upper[0] - lower[0] <= 1:
+                self.discovered_pages = int(math.ceil(upper[1] / rpp))
+                return upper[0]
+            if interpolated:
+                next_value = lower[0] + (upper[0] - lower[0]) // 2
+                interpolated = False
+            else:
+                next_value = lower[0] + int((upper[0] - lower[0]) * (target - lower[1]) / (upper[1] - lower[1]))
+                interpolated = True
+            value = min(max(next_value, lower[0] + 1), upper[0] - 1)
+
+    def _discover_by_bisection(self, start_value):
         lower_bound = start_value
         upper_bound = 2 * start_value + 1
         max_upper_bound = None
@@ -300,6 +523,7 @@ class Command(BaseCommand):
         rnd = 0
         while True:
             if upper_bound == lower_bound:
+                self.discovered_pages = p
                 return max_upper_bound or upper_bound
 
             prev_p = p
@@ -307,11 +531,14 @@ class Command(BaseCommand):
             rnd += 1
             print('$$$ Round=[{}]: start_value=[{}], upper_bound=[{}], pages=[{}]'.format(rnd, start_value,
                                                                                           upper_bound, p))
-            if (max_upper_bound is None) and (p == prev_p) and \
-                (p + self._scrap_total_page(upper_bound, None) <= self.pages_per_part + self.pages_delta):
+            if (max_upper_bound is None) and (p == prev_p):
+                rest_p = self._scrap_total_page(upper_bound, None)
+                if p + rest_p <= self.pages_per_part + self.pages_delta:
+                    self.discovered_pages = p + rest_p
                     return None
 
             if 0 <= p - self.pages_per_part <= self.pages_delta:
+                self.discovered_pages = p
                 return upper_bound
             if p < self.pages_per_part:
                 if max_upper_bound is None:
@@ -330,11 +557,12 @@ class Command(BaseCommand):
             print('Canceled!')
             sys.exit(1)
         except Exception:
-            self.failed_parts.append((start_value, end_value))
+            self.add_failed_part(start_value, end_value)
             print('!!! Unexpected Exception for download range [{} - {}]'.format(start_value, end_value))
             traceback.print_exc()
         finally:
-            self._finished_counter += 1
+            with self._lock:
+                self._finished_counter += 1
 
     def _download_range_data(self, start_value, end_value):
         start_time = timezone.now()
@@ -401,8 +629,11 @@ class Command(BaseCommand):
         if not data:
             raise Exception('Data Cannot be empty in submit form!')
         time.sleep(0.5)
+        self._probe_counter += 1
         search_result = session.post(self.submit_search_url, data=data).text
         if 'No results found for query' in search_result:
+            if include_extra:
+                return dict(pages=0, records_per_page=0, records=0)
             return 0
         bs = BeautifulSoup(search_result, 'html.parser')
         pagination_title = bs.find(id='middle').find(text=re.compile(self.county_conf['pagination_re']))
@@ -418,6 +649,7 @@ class Command(BaseCommand):
         if not pages:
             raise Exception('!!! {}: Cannot scrap total pages'.format(range_str))
         if include_extra:
-            return dict(pages=int(pages[0]), records_per_page=records_per_page)
+            return dict(pages=int(pages[0]), records_per_page=records_per_page,
+                        records=int(total_records[0]) if total_records else None)
         return int(pages[0])
 
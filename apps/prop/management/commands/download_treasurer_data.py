@@ -11,16 +11,17 @@ import requests
 import functools
 from django.conf import settings
 
-from prop.models import LienAuction
+from apps.prop.models import LienAuction
 
 try:
     from urllib.parse import urljoin
 except ImportError:
     from urlparse import urljoin
-from bs4 import BeautifulSoup
 from django.core.management.base import BaseCommand
+from requests.adapters import HTTPAdapter
 
 from . import _treasurer_counties as counties
+from ._treasurer_fetcher import AsyncAccountFetcher, parse_account_tx
 
 print = functools.partial(print, flush=True)
 
@@ -36,6 +37,10 @@ class Command(BaseCommand):
     DOWNLOAD_DIR = 'treasurer-downloads'
     EXPORT_FILE = 'accounts.csv'
     ROUND_WAIT_SECONDS = 0
+    CONCURRENCY = 1
+    SLOW_SECONDS = 5.0
+    MAX_RETRIES = 3
+    CSV_COLUMNS = ['Parcel_ID', 'Amount', 'Tax_Year', 'Tax_Type', 'Effective_Date', 'Balance']
 
     @property
     def county_conf(self):
@@ -48,6 +53,9 @@ class Command(BaseCommand):
     def general_session(self):
         if self._general_session is None:
             session = requests.session()
+            adapter = HTTPAdapter(pool_maxsize=max(self.concurrency, 10))
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
             session.get(self.init_url)
             session.post(self.login_url, data=self.county_conf['public_login_data'], allow_redirects=False)
             self._general_session = session
@@ -75,6 +83,16 @@ class Command(BaseCommand):
         parser.add_argument('--round-wait-seconds', action='store', type=int, default=self.ROUND_WAIT_SECONDS)
         parser.add_argument('--clean', action='store_true')
         parser.add_argument('--merge', action='store_true')
+        parser.add_argument('--account-ids-file', action='store', type=str,
+                            help='file of account ids (one per line) to download instead of lien auction parids')
+        parser.add_argument('--concurrency', action='store', type=int, default=self.CONCURRENCY,
+                            help='concurrent requests per host. more than 1 downloads accounts with asyncio '
+                                 '(limited to max_concurrency of county conf)')
+        parser.add_argument('--slow-seconds', action='store', type=float, default=self.SLOW_SECONDS,
+                            help='responses slower than this increase delay between requests')
+        parser.add_argument('--max-retries', action='store', type=int, default=self.MAX_RETRIES)
+        parser.add_argument('--parse-processes', action='store', type=int, default=0,
+                            help='number of processes to parse account pages (default is a single thread)')
 
     def init_vars(self, *args, **options):
         self.county = options.get('county')
@@ -90,7 +108,11 @@ class Command(BaseCommand):
         self.init_url = urljoin(self.base_url, self.county_conf['init_url'])
         self.login_url = urljoin(self.base_url, self.county_conf['login_url'])
         self.account_tx_url = urljoin(self.base_url, self.ACCOUNT_TX_URL)
-
+        self.account_ids_file = options.get('account_ids_file')
+        self.concurrency = min(options.get('concurrency') or 1, self.county_conf['max_concurrency'])
+        self.slow_seconds = options.get('slow_seconds') or self.SLOW_SECONDS
+        self.max_retries = options.get('max_retries') or 0
+        self.parse_processes = options.get('parse_processes') or 0
 
     def handle(self, *args, **options):
         try:
@@ -116,16 +138,42 @@ class Command(BaseCommand):
         else:
             os.makedirs(self.download_parts_dir)
 
-        account_ids = LienAuction.objects.order_by('property__parid').values_list('property__parid',
-                                                                                  flat=True).distinct()
+        account_ids = self.get_account_ids()
         print('+++ starting download [{}] accounts ...'.format(len(account_ids)))
+        start_time = time.time()
+        if self.concurrency > 1:
+            self.download_accounts_async(account_ids)
+        else:
+            for account_id in account_ids:
+                try:
+                    self.download_account_tx(account_id)
+                except Exception:
+                    print('!!! Failed to download [{}] account.'.format(account_id))
+                time.sleep(self.round_wait_seconds)
+        print('+++ Finished [{}] accounts in [{:.1f}] seconds.'.format(len(account_ids), time.time() - start_time))
+
+    def download_accounts_async(self, account_ids):
+        items = []
         for account_id in account_ids:
-            try:
-                self.download_account_tx(account_id)
-            except Exception:
-                print('!!! Failed to download [{}] account.'.format(account_id))
-            time.sleep(self.round_wait_seconds)
-        print('+++ Finished [{}] accounts.'.format(len(account_ids)))
+            if os.path.exists(self.account_csv_path(account_id)):
+                print('!!! Skipped to download! records for [{}] account already downloaded!'.format(account_id))
+                continue
+            items.append((account_id, self.account_tx_url.format(account_id=account_id)))
+        print('+++ Downloading [{}] accounts with [{}] concurrent requests ...'.format(len(items), self.concurrency))
+
+        def handle_error(account_id, e):
+            print('!!! Failed to download [{}] account: {}'.format(account_id, e))
+
+        fetcher = AsyncAccountFetcher(self.general_session, concurrency=self.concurrency,
+                                      slow_seconds=self.slow_seconds, max_retries=self.max_retries,
+                                      parse_processes=self.parse_processes)
+        fetcher.run(items, self.save_account_tx, handle_error)
+
+    def get_account_ids(self):
+        if self.account_ids_file:
+            with open(self.account_ids_file) as f:
+                return [line.strip() for line in f if line.strip()]
+        return LienAuction.objects.order_by('property__parid').values_list('property__parid', flat=True).distinct()
 
     @staticmethod
     def _standardize_row(row):
@@ -142,39 +190,42 @@ class Command(BaseCommand):
         row['Effective_Date'] = dt
         return row
 
+    def account_csv_path(self, account_id):
+        return os.path.join(self.download_parts_dir, '{}.csv'.format(account_id))
+
     def download_account_tx(self, account_id):
         print('+++ Downloading Account transactions of [{}]'.format(account_id))
-        csv_path = os.path.join(self.download_parts_dir, '{}.csv'.format(account_id))
-        if os.path.exists(csv_path):
+        if os.path.exists(self.account_csv_path(account_id)):
             print('!!! Skipped to download! records for [{}] account already downloaded!'.format(account_id))
             return
 
         tx_url = self.account_tx_url.format(account_id=account_id)
 
         response = self.general_session.get(tx_url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        table = soup.find('table', attrs={'class': 'account stripe'})
-        if not table:
+        self.save_account_tx(account_id, parse_account_tx(response.text))
+
+    def save_account_tx(self, account_id, tx_rows):
+        """ tx_rows is td texts of account transactions table (None if account could not be found) """
+        if tx_rows is None:
             print('!!! The account could not be found for [{}]'.format(account_id))
             return
-        trs = table.find_all('tr')[1:]
         data_temp = StringIO()
-        csv_columns = ['Parcel_ID', 'Amount', 'Tax_Year', 'Tax_Type', 'Effective_Date', 'Balance']
-        writer = csv.DictWriter(data_temp, fieldnames=csv_columns)
+        writer = csv.DictWriter(data_temp, fieldnames=self.CSV_COLUMNS)
         writer.writeheader()
-        for tr in trs:
-            tds = tr.find_all('td')
-            tax_year = tds[0].text
-            tax_type = tds[1].text
-            effective_date = tds[2].text
-            amount = tds[3].text.replace(',', '').replace('$', '')
-            balance = tds[4].text
+        for tds in tx_rows:
+            tax_year = tds[0]
+            tax_type = tds[1]
+            effective_date = tds[2]
+            amount = tds[3].replace(',', '').replace('$', '')
+            balance = tds[4]
             row = self._standardize_row({'Parcel_ID': account_id, 'Amount': amount, 'Tax_Year': tax_year, 'Tax_Type': tax_type,
                                          'Effective_Date': effective_date, 'Balance': balance})
             writer.writerow(row)
         data_temp.seek(0)
-        with open(csv_path, 'w') as csv_file:
+        with open(self.account_csv_path(account_id), 'w') as csv_file:
             csv_file.write(data_temp.read())
+        if self.concurrency > 1:
+            print('+++ Downloaded Account transactions of [{}]'.format(account_id))
 
     def merge_parts(self):
         if not os.path.exists(self.download_parts_dir):
@@ -1,25 +1,47 @@
 import os
 import sys
-import csv
+import json
+from itertools import islice
 from django.core.management.base import BaseCommand
 
-from coprop.helpers.rest_client import RestClient, RestResponseException
+from project.helpers.rest_client import RestClient, RestResponseException
+from ._csv_checkpoint import ImportCheckpoint
 
 
 class Command(BaseCommand):
 
     help = "Import co-database records from csv file."
     client = None
+    direct_importer = None
     API_PREFIX = '/{county}/api/v1'
+    CHUNK_SIZE = 1000
 
     def add_arguments(self, parser):
-        parser.add_argument('--api-url', action='store', type=str, required=True)
-        parser.add_argument('--api-username', action='store', type=str, required=True)
-        parser.add_argument('--api-password', action='store', type=str, required=True)
+        parser.add_argument('--api-url', action='store', type=str)
+        parser.add_argument('--api-username', action='store', type=str)
+        parser.add_argument('--api-password', action='store', type=str)
         parser.add_argument('--county', action='store', type=str, required=True)
         parser.add_argument('--owners-csv-path', action='store', type=str)
         parser.add_argument('--accounts-csv-path', action='store', type=str)
         parser.add_argument('--auction-csv-path', action='store', type=str)
+        parser.add_argument('--direct', action='store_true',
+                            help='import records directly to database (bulk insert) instead of rest api')
+        parser.add_argument('--chunk-size', action='store', type=int, default=self.CHUNK_SIZE,
+                            help='number of csv rows inserted in each transaction of --direct mode '
+                                 '(and rows between two saved checkpoints)')
+        parser.add_argument('--workers', action='store', type=int, default=1,
+                            help='number of concurrent rest api requests')
+        parser.add_argument('--preload-properties', action='store_true',
+                            help='fetch parid=>property index of county once, instead of a lookup request per row')
+        parser.add_argument('--property-index-path', action='store', type=str,
+                            help='json file to load/save preloaded property index between runs '
+                                 '(implies --preload-properties)')
+        parser.add_argument('--refresh-property-index', action='store_true',
+                            help='fetch property index again even if --property-index-path exists')
+        parser.add_argument('--checkpoint-path', action='store', type=str,
+                            help='json file to save position of committed csv rows after every chunk')
+        parser.add_argument('--resume', action='store_true',
+                            help='continue csv files from positions saved in --checkpoint-path')
 
     def handle(self, *args, **options):
         self.county = options.get('county').lower()
@@ -29,7 +51,25 @@ class Command(BaseCommand):
         api_url = options.get('api_url')
         api_username = options.get('api_username')
         api_password = options.get('api_password')
-        self.client = RestClient(api_url, api_username, api_password)
+        self.chunk_size = options.get('chunk_size')
+        self.workers = options.get('workers')
+        self.property_index_path = options.get('property_index_path')
+        self.preload_properties = options.get('preload_properties') or bool(self.property_index_path)
+        self.refresh_property_index = options.get('refresh_property_index')
+        self.resume = options.get('resume')
+        if self.resume and not options.get('checkpoint_path'):
+            print('please specify --checkpoint-path to resume from')
+            sys.exit(1)
+        self.checkpoint = ImportCheckpoint(options.get('checkpoint_path'))
+        if options.get('direct'):
+            from ._direct_import import DirectImporter
+            self.direct_importer = DirectImporter(self.county, batch_size=self.chunk_size)
+        elif not (api_url and api_username and api_password):
+            print('please specify --api-url, --api-username and --api-password arguments (or use --direct)')
+            sys.exit(1)
+        else:
+            self.client = RestClient(api_url, api_username, api_password, workers=self.workers,
+                                     pool_size=max(self.workers, RestClient.POOL_SIZE))
         any_path = False
         for path in (owners_csv_path, accounts_csv_path, auction_csv_path):
             if path and not os.path.exists(path):
@@ -59,11 +99,51 @@ class Command(BaseCommand):
         assert len(v) < 2, '2 keys[{}] exists for {} row'.format(keys, d)
         return v[0] if v else None
 
+    def fetch_property_index(self):
+        """ fetch id and parid of all county properties (page by page) """
+        url = self.api_url('property')
+        params = {'page_size': 0, 'ordering': 'id'}
+
+        def fetch_page(page):
+            print('+++ Fetching Property Index Page #{}'.format(page))
+            return self.client.get(url, dict(params, page=page))
+
+        first_page = fetch_page(1)
+        last_page = first_page['pagination']['last_page']
+        pages = [first_page] + list(self.client.map(fetch_page, range(2, last_page + 1)))
+        return {p['parid']: {'id': p['id'], 'parid': p['parid']} for page in pages for p in page['results']}
+
+    def load_property_index(self):
+        path = self.property_index_path
+        if path and os.path.exists(path) and not self.refresh_property_index:
+            print('+++ Loading Property Index from [{}] ...'.format(path))
+            with open(path) as f:
+                index = json.load(f)
+        else:
+            index = self.fetch_property_index()
+            self.save_property_index(index)
+        print('### {} property loaded in index! ###'.format(len(index)))
+        return index
+
+    def save_property_index(self, index):
+        if not self.property_index_path:
+            return
+        with open(self.property_index_path, 'w') as f:
+            json.dump({parid: {'id': p['id'], 'parid': parid} for parid, p in index.items()}, f)
+
     def get_property(self, parid):
         res = self.client.get(self.api_url('property'), {'parid': parid, 'county': self.county})['results']
         return res[0] if res else None
 
-    def add_property(self, row):
+    @staticmethod
+    def iter_chunks(reader, chunk_size):
+        while True:
+            chunk = list(islice(reader, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def property_data(self, row):
         parid = row.get('ACCOUNTNO')
         if not parid:
             print('invalid record! parid is blank!')
@@ -76,11 +156,16 @@ class Command(BaseCommand):
             'city': row.get('LOCCITY') or None,
             'zipcode': row.get('PROPZIP') or None,
         }
-        data = {
+        return {
             'parid': parid,
             'county': self.county,
             'address': address
         }
+
+    def add_property(self, row):
+        data = self.property_data(row)
+        if not data:
+            return None
         try:
             prop = self.client.post(self.api_url('property'), data)
         except RestResponseException as exc:
@@ -95,7 +180,7 @@ class Command(BaseCommand):
                 raise exc
         return prop
 
-    def add_owners(self, row, property_id):
+    def owner_data(self, row, property_id):
         name = row.get('NAME')
         if not name:
             print('invalid record! name is blank!')
@@ -116,18 +201,28 @@ class Command(BaseCommand):
         }
         if ownico:
             data['other'] = ownico
+        return data
+
+    def add_owners(self, row, property_id):
+        data = self.owner_data(row, property_id)
+        if not data:
+            return None
         return self.client.post(self.api_url('owner'), data)
 
-    def add_account(self, row, property_parids):
-        parid = row.get('Parcel_ID')
+    def find_property(self, parid, property_parids):
         if property_parids is None:
             prop = self.get_property(parid)
         else:
             prop = property_parids.get(parid)
         if not prop:
             print('!!! Unknown parid "{}"!!!'.format(parid))
+        return prop
+
+    def account_data(self, row, property_parids):
+        prop = self.find_property(row.get('Parcel_ID'), property_parids)
+        if not prop:
             return None
-        data = {
+        return {
             'property': prop['id'],
             'tax_year': row.get('Tax_Year') or None,
             'tax_type': row.get('Tax_Type') or None,
@@ -135,6 +230,11 @@ class Command(BaseCommand):
             'amount': row.get('Amount') or None,
             'balance': row.get('Balance') or None,
         }
+
+    def add_account(self, row, property_parids):
+        data = self.account_data(row, property_parids)
+        if not data:
+            return None
         try:
             account = self.client.post(self.api_url('account'), data)
         except RestResponseException as exc:
@@ -148,25 +248,26 @@ class Command(BaseCommand):
                 raise exc
         return account
 
-    def add_lien_auction(self, row, property_parids):
+    def lien_auction_data(self, row, property_parids):
         parid = self.get_one_of_keys(row, 'Parcel_ID','Parcel', 'PARCEL')
-        if property_parids is None:
-            prop = self.get_property(parid)
-        else:
-            prop = property_parids.get(parid)
+        prop = self.find_property(parid, property_parids)
         if not prop:
-            print('!!! Unknown parid "{}"!!!'.format(parid))
             return None
         name = self.get_one_of_keys(row, 'Name', 'Primary Name On Account', 'PRIMARY NAME ON ACCOUNT')
         if None in row:
             name = ' '.join([n.strip() for n in (row[None] + [name]) if (n and n.strip())])
-        data = {
+        return {
             'property': prop['id'],
             'name': name,
             'face_value': self.get_one_of_keys(row, 'Face_Value', 'Face Amount', 'FACE AMOUNT') or None,
             'tax_year': self.get_one_of_keys(row, 'Tax_Year') or None,
             'winning_bid': self.get_one_of_keys(row, 'Winning_Bid', 'WinningBid', 'WINNINGPREMIUM') or None,
         }
+
+    def add_lien_auction(self, row, property_parids):
+        data = self.lien_auction_data(row, property_parids)
+        if not data:
+            return None
         try:
             auction = self.client.post(self.api_url('lien_auction'), data)
         except RestResponseException as exc:
@@ -180,47 +281,120 @@ class Command(BaseCommand):
                 raise exc
         return auction
 
+    def add_property_owners(self, row):
+        prop = self.add_property(row)
+        if not prop:
+            return None, None
+        return prop, self.add_owners(row, prop.get('id'))
+
+    def open_csv(self, path, delimiter):
+        return self.checkpoint.open(path, delimiter=delimiter, resume=self.resume)
+
+    def process_rows(self, reader, label, func, *args):
+        """
+        yields func(row, *args) for every csv row (in order).
+        rows are sent by --workers concurrent requests of rest client.
+        checkpoint is saved after every chunk_size rows are processed by caller.
+        """
+        def process(row):
+            return func(self.strip_dict(row), *args)
+
+        if self.workers <= 1:
+            for i, row in enumerate(reader, 1):
+                print('+++ Processing {} Row #{}'.format(label, reader.line_num - 1))
+                yield process(row)
+                if i % self.chunk_size == 0:
+                    self.checkpoint.save(reader)
+            self.checkpoint.save(reader)
+            return
+        for chunk in self.iter_chunks(reader, self.chunk_size):
+            print('+++ Processing {} Rows until #{}'.format(label, reader.line_num - 1))
+            yield from self.client.map(process, chunk)
+            self.checkpoint.save(reader)
+
     def import_data(self, owners_csv_path, accounts_csv_path, auction_csv_path):
+        if self.direct_importer:
+            return self.import_data_direct(owners_csv_path, accounts_csv_path, auction_csv_path)
         print('+ Insert Responder starting....')
         property_parids = None
+        if owners_csv_path and self.resume and self.checkpoint.get(owners_csv_path)[0]:
+            # properties of previous run are not in property_parids
+            print('+++ Owners file is resumed, property index is preloaded.')
+            self.preload_properties = True
+        if self.preload_properties:
+            property_parids = self.load_property_index()
         if owners_csv_path:
-            property_parids = {}
-            with open(owners_csv_path) as csvfile:
-                reader = csv.DictReader(csvfile, delimiter='\t')
+            property_parids = {} if property_parids is None else property_parids
+            with self.open_csv(owners_csv_path, '\t') as reader:
                 new_props = 0
                 new_owners = 0
-                for row in reader:
-                    print('+++ Processing Property Row #{}'.format(reader.line_num - 1))
-                    row = self.strip_dict(row)
-                    prop = self.add_property(row)
+                for prop, owner in self.process_rows(reader, 'Property', self.add_property_owners):
                     if not prop:
                         continue
                     new_props += 1
                     property_parids[prop.get('parid')] = prop
-                    owner = self.add_owners(row, prop.get('id'))
                     if owner:
                         new_owners += 1
             print('### {} new property added! ###'.format(new_props))
             print('### {} new owner added! ###'.format(new_owners))
+            if self.preload_properties:
+                self.save_property_index(property_parids)
         if accounts_csv_path:
-            with open(accounts_csv_path) as csvfile:
-                reader = csv.DictReader(csvfile, delimiter=',')
+            with self.open_csv(accounts_csv_path, ',') as reader:
                 new_accounts = 0
-                for row in reader:
-                    print('+++ Processing Account Row #{}'.format(reader.line_num - 1))
-                    row = self.strip_dict(row)
-                    account = self.add_account(row, property_parids)
+                for account in self.process_rows(reader, 'Account', self.add_account, property_parids):
                     if account:
                         new_accounts += 1
                 print('### {} new account added! ###'.format(new_accounts))
         if auction_csv_path:
-            with open(auction_csv_path) as csvfile:
-                reader = csv.DictReader(csvfile, delimiter=',')
+            with self.open_csv(auction_csv_path, ',') as reader:
                 new_auctions = 0
-                for row in reader:
-                    print('+++ Processing Auction Row #{}'.format(reader.line_num - 1))
-                    row = self.strip_dict(row)
-                    auction = self.add_lien_auction(row, property_parids)
+                for auction in self.process_rows(reader, 'Auction', self.add_lien_auction, property_parids):
                     if auction:
                         new_auctions += 1
                 print('### {} new auction added! ###'.format(new_auctions))
+
+    def import_data_direct(self, owners_csv_path, accounts_csv_path, auction_csv_path):
+        print('+ Direct Insert starting....')
+        importer = self.direct_importer
+        property_parids = {}
+        if owners_csv_path:
+            with self.open_csv(owners_csv_path, '\t') as reader:
+                new_props = 0
+                new_owners = 0
+                for chunk in self.iter_chunks(reader, self.chunk_size):
+                    print('+++ Processing Property Rows until #{}'.format(reader.line_num - 1))
+                    items = []
+                    for row in chunk:
+                        row = self.strip_dict(row)
+                        data = self.property_data(row)
+                        if data:
+                            items.append((data, self.owner_data(row, None)))
+                    parids, props_count, owners_count = importer.import_properties(items)
+                    self.checkpoint.save(reader)
+                    property_parids.update(parids)
+                    new_props += props_count
+                    new_owners += owners_count
+            print('### {} new property added! ###'.format(new_props))
+            print('### {} new owner added! ###'.format(new_owners))
+        if accounts_csv_path or auction_csv_path:
+            # one query for all county parids instead of one lookup per row
+            property_parids.update(importer.get_property_parids())
+        if accounts_csv_path:
+            with self.open_csv(accounts_csv_path, ',') as reader:
+                new_accounts = 0
+                for chunk in self.iter_chunks(reader, self.chunk_size):
+                    print('+++ Processing Account Rows until #{}'.format(reader.line_num - 1))
+                    items = [self.account_data(self.strip_dict(row), property_parids) for row in chunk]
+                    new_accounts += importer.import_accounts([d for d in items if d])
+                    self.checkpoint.save(reader)
+                print('### {} new account added! ###'.format(new_accounts))
+        if auction_csv_path:
+            with self.open_csv(auction_csv_path, ',') as reader:
+                new_auctions = 0
+                for chunk in self.iter_chunks(reader, self.chunk_size):
+                    print('+++ Processing Auction Rows until #{}'.format(reader.line_num - 1))
+                    items = [self.lien_auction_data(self.strip_dict(row), property_parids) for row in chunk]
+                    new_auctions += importer.import_lien_auctions([d for d in items if d])
+                    self.checkpoint.save(reader)
+                print('### {} new auction added! ###'.format(new_auctions))
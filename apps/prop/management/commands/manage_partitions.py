@@ -0,0 +1,80 @@
+import sys
+import functools
+from django.core.management.base import BaseCommand
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from apps.prop.models import County, Account, AccountTaxTypeSummary, LienAuction
+from apps.prop.middleware import bump_county_generation
+from apps.prop.partitions import is_partitioned, create_partitions, drop_partitions
+
+print = functools.partial(print, flush=True)
+
+
+class Command(BaseCommand):
+
+    help = "create/drop partitions of counties and tax years in partitioned tables (postgresql >= 11). " \
+           "databases without partitioning (i.e. sqlite) skip creating and delete rows instead of dropping. " \
+           "dropped partitions are written to change log as one purge, deleted rows as deleted objects."
+    MODELS = (Account, LienAuction)
+
+    def add_arguments(self, parser):
+        parser.add_argument('--county', action='append', dest='counties',
+                            help='county name (can be repeated). default is all counties')
+        parser.add_argument('--year', action='append', dest='years', type=int,
+                            help='tax year of partitions to create (can be repeated). '
+                                 'default is current and next year (and years of rows in default partitions)')
+        parser.add_argument('--drop', action='store_true',
+                            help='drop all partitions and rows of counties (county purge)')
+        parser.add_argument('--drop-before-year', action='store', type=int,
+                            help='drop partitions and rows of counties for tax years before it')
+        parser.add_argument('--database', action='store', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        counties = County.objects.order_by('name')
+        names = options.get('counties')
+        if names:
+            counties = counties.filter(name__in=names)
+            invalid = set(names) - {c.name for c in counties}
+            if invalid:
+                print('!!! Invalid counties [{}]!'.format(', '.join(sorted(invalid))))
+                sys.exit(1)
+        elif options.get('drop'):
+            print('!!! Counties should be specified (--county) to drop!')
+            sys.exit(1)
+        connection = connections[options['database']]
+        for county in counties:
+            if options.get('drop') or options.get('drop_before_year'):
+                self.drop_county(connection, county, options.get('drop_before_year') if not options['drop'] else None)
+            else:
+                self.create_county(connection, county, options.get('years'))
+
+    def create_county(self, connection, county, years):
+        if not years:
+            year = timezone.now().year
+            years = [year, year + 1]
+        for model in self.MODELS:
+            table = model._meta.db_table
+            if not is_partitioned(connection, table):
+                print('--- [{}] is not partitioned, skipped.'.format(table))
+                continue
+            created = create_partitions(connection, table, county.id, years)
+            print('+++ Created [{}] partitions of [{}] in [{}]: {}'.format(
+                len(created), county.name, table, ', '.join(created)))
+
+    def drop_county(self, connection, county, before_year):
+        for model in self.MODELS:
+            table = model._meta.db_table
+            if is_partitioned(connection, table):
+                dropped = drop_partitions(connection, table, model._meta.model_name, county.id, before_year)
+                print('+++ Dropped [{}] partitions of [{}] in [{}]: {}'.format(
+                    len(dropped), county.name, table, ', '.join(dropped)))
+            else:
+                queryset = model.objects.using(connection.alias).filter(county=county)
+                if before_year is not None:
+                    queryset = queryset.filter(tax_year__lt=before_year)
+                deleted, _ = queryset.delete()
+                print('+++ Deleted [{}] rows of [{}] in [{}].'.format(deleted, county.name, table))
+        # partition drops do not send signals
+        AccountTaxTypeSummary.refresh(county.id)
+        bump_county_generation(county.id)
@@ -0,0 +1,41 @@
+import functools
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from apps.prop.query_usage import get_query_usages, clear_query_usages, get_table_indexes, find_supporting_index
+
+print = functools.partial(print, flush=True)
+
+
+class Command(BaseCommand):
+
+    help = "report filter/ordering combinations of county list requests (recorded if QUERY_USAGE_RECORDER setting " \
+           "is enabled) and their supporting indexes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', help='only combinations without a supporting index')
+        parser.add_argument('--reset', action='store_true', help='clear recorded combinations after report')
+
+    def handle(self, *args, **options):
+        models = {m._meta.db_table: m for m in apps.get_app_config('prop').get_models()}
+        indexes = {}
+        missing = 0
+        usages = get_query_usages()
+        print('{:>8}  {:<22} {:<50} {:<20} {}'.format('count', 'table', 'filters', 'ordering', 'index'))
+        for count, table, filters, ordering in usages:
+            if table not in models:
+                continue
+            if table not in indexes:
+                indexes[table] = get_table_indexes(table)
+            index = find_supporting_index(models[table], filters, ordering, indexes[table])
+            if index is None:
+                missing += 1
+            elif options.get('missing'):
+                continue
+            print('{:>8}  {:<22} {:<50} {:<20} {}'.format(
+                count, table, ', '.join('{}__{}'.format(*f) for f in filters) or '-', ', '.join(ordering) or '-',
+                '({})'.format(', '.join(index)) if index else '!!! MISSING'))
+        print('+++ [{}] combinations, [{}] without a supporting index.'.format(len(usages), missing))
+        if options.get('reset'):
+            clear_query_usages()
+            print('+++ Recorded combinations are cleared.')
@@ -0,0 +1,33 @@
+import sys
+import time
+import functools
+from django.core.management.base import BaseCommand
+
+from apps.prop.models import County, AccountTaxTypeSummary
+
+print = functools.partial(print, flush=True)
+
+
+class Command(BaseCommand):
+
+    help = "rebuild tax type summary (AccountTaxTypeSummary) of counties from accounts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--county', action='append', dest='counties',
+                            help='county name (can be repeated). default is all counties')
+
+    def handle(self, *args, **options):
+        counties = County.objects.order_by('name')
+        names = options.get('counties')
+        if names:
+            counties = counties.filter(name__in=names)
+            invalid = set(names) - {c.name for c in counties}
+            if invalid:
+                print('!!! Invalid counties [{}]!'.format(', '.join(sorted(invalid))))
+                sys.exit(1)
+        for county in counties:
+            print('+++ Rebuilding tax type summary of [{}] ...'.format(county.name))
+            start_time = time.time()
+            AccountTaxTypeSummary.refresh(county.id)
+            print('+++ Rebuilt [{}] summary rows in [{:.1f}] seconds.'.format(
+                AccountTaxTypeSummary.objects.filter(county=county).count(), time.time() - start_time))
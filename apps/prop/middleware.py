@@ -1,46 +1,167 @@
-import types
+import time
+from collections import OrderedDict
 from django.conf import settings
 from django.http import JsonResponse
-from threading import local
+from threading import local, Lock
 from django.core.cache import cache
 
-CURRENT_COUNTY_ATTR_NAME = getattr(settings, 'CURRENT_COUNTY_ATTR_NAME', '_current_county')
-COUNTY_BASE_ENDPOINT_PARAM = getattr(settings, 'COUNTY_BASE_ENDPOINT_PARAM', 'county')
-_thread_locals = local()
+try:
+    from contextvars import ContextVar
+except ImportError:  # python < 3.7, current county is kept per thread
+    class ContextVar(local):
+        def __init__(self, name, default=None):
+            self.name = name
+            self.default = default
+
+        def get(self):
+            return getattr(self, 'value', self.default)
 
+        def set(self, value):
+            token = self.get()
+            self.value = value
+            return token
 
-def _do_set_current_county(county_func):
-    setattr(_thread_locals, CURRENT_COUNTY_ATTR_NAME, types.MethodType(county_func, _thread_locals))
+        def reset(self, token):
+            self.value = token
+
+CURRENT_COUNTY_ATTR_NAME = getattr(settings, 'CURRENT_COUNTY_ATTR_NAME', '_current_county')
+COUNTY_BASE_ENDPOINT_PARAM = getattr(settings, 'COUNTY_BASE_ENDPOINT_PARAM', 'county')
+COUNTY_LOCAL_CACHE_SIZE = getattr(settings, 'COUNTY_LOCAL_CACHE_SIZE', 128)
+COUNTY_LOCAL_CACHE_TIMEOUT = getattr(settings, 'COUNTY_LOCAL_CACHE_TIMEOUT', 5)
+_current_county = ContextVar(CURRENT_COUNTY_ATTR_NAME, default=None)
 
 
 def _set_current_county(county=None):
     """
-    Sets current county in local thread.
+    Sets current county in current context.
 
     Can be used as a hook e.g. for shell jobs (when request object is not available).
     """
-    _do_set_current_county(lambda self: county)
+    return _current_county.set(county)
 
 
 COUNTY_CACHE_KEY = cache_key = 'middleware-county-{county_name}'
+COUNTY_CACHE_GENERATION_KEY = 'middleware-county-generation'
+NOT_EXISTS = object()
+
+
+class LocalCountyCache(object):
+    """
+    in-process LRU cache of counties in front of django cache (redis).
+    clear_county_cached of any process changes shared generation (COUNTY_CACHE_GENERATION_KEY), which
+    drops all entries. generation is read at most once every `timeout` seconds, so changes of
+    counties in other processes are seen after `timeout` seconds at most.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self._generation = None
+        self._checked_at = None
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.timeout:
+            return
+        generation = cache.get(COUNTY_CACHE_GENERATION_KEY)
+        if generation is None:
+            # shared generation is initialized (or lost by eviction), entries are dropped once for it
+            cache.add(COUNTY_CACHE_GENERATION_KEY, int(time.time() * 1000), timeout=None)
+            generation = cache.get(COUNTY_CACHE_GENERATION_KEY)
+        with self._lock:
+            if generation != self._generation:
+                self._data.clear()
+                self._generation = generation
+            self._checked_at = now
+
+    def get(self, key, default=None):
+        self._check_generation()
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+_local_county_cache = LocalCountyCache(COUNTY_LOCAL_CACHE_SIZE, COUNTY_LOCAL_CACHE_TIMEOUT)
 
 
 def get_county_cached(county_name):
     from apps.prop.models import County
-    cache_key = COUNTY_CACHE_KEY.format(county_name=county_name)
-    NOT_EXISTS = object()
-    county = cache.get(cache_key, NOT_EXISTS)
-    if county == NOT_EXISTS:
-        county = County.objects.filter(name=county_name).first()
-        if county:
-            county = {k: v for k, v in county.__dict__.items() if not k.startswith('_')}
-        cache.set(cache_key, county)
-    return county
+    county = _local_county_cache.get(county_name, NOT_EXISTS)
+    if county is NOT_EXISTS:
+        cache_key = COUNTY_CACHE_KEY.format(county_name=county_name)
+        county = cache.get(cache_key, NOT_EXISTS)
+        if county is NOT_EXISTS:
+            county = County.objects.filter(name=county_name).first()
+            if county:
+                county = {k: v for k, v in county.__dict__.items() if not k.startswith('_')}
+            cache.set(cache_key, county)
+        _local_county_cache.set(county_name, county)
+    # entries of local cache are shared by requests
+    return dict(county) if county else county
 
 
 def clear_county_cached(county_name):
     cache_key = COUNTY_CACHE_KEY.format(county_name=county_name)
     cache.delete(cache_key)
+    _local_county_cache.delete(county_name)
+    try:
+        cache.incr(COUNTY_CACHE_GENERATION_KEY)
+    except ValueError:
+        cache.set(COUNTY_CACHE_GENERATION_KEY, int(time.time() * 1000), timeout=None)
+
+
+COUNTY_GENERATION_CACHE_KEY = 'county-generation-{county_id}'
+COUNTY_MODIFIED_CACHE_KEY = 'county-modified-{county_id}'
+
+
+def get_county_generation(county_id):
+    """ generation number of county data. it is changed on every change of county objects. """
+    cache_key = COUNTY_GENERATION_CACHE_KEY.format(county_id=county_id)
+    generation = cache.get(cache_key)
+    if generation is None:
+        # start from current time, so a lost (evicted) generation never gets an old number again
+        generation = int(time.time() * 1000)
+        if not cache.add(cache_key, generation, timeout=None):
+            generation = cache.get(cache_key, generation)
+    return generation
+
+
+def get_county_last_modified(county_id):
+    """
+    timestamp of last change of county objects.
+    if it is not known (i.e. after a cache flush) it starts from current time, so it is never older than a change.
+    """
+    cache_key = COUNTY_MODIFIED_CACHE_KEY.format(county_id=county_id)
+    last_modified = cache.get(cache_key)
+    if last_modified is None:
+        last_modified = int(time.time())
+        if not cache.add(cache_key, last_modified, timeout=None):
+            last_modified = cache.get(cache_key, last_modified)
+    return last_modified
+
+
+def bump_county_generation(county_id):
+    cache.set(COUNTY_MODIFIED_CACHE_KEY.format(county_id=county_id), int(time.time()), timeout=None)
+    cache_key = COUNTY_GENERATION_CACHE_KEY.format(county_id=county_id)
+    try:
+        return cache.incr(cache_key)
+    except ValueError:
+        return get_county_generation(county_id)
 
 
 class CurrentCountyMiddleware:
@@ -48,7 +169,11 @@ class CurrentCountyMiddleware:
         self.get_response = get_response
 
     def __call__(self, request):
-        return self.get_response(request)
+        token = _current_county.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _current_county.reset(token)
 
     def process_view(self, request, view_func, view_args, view_kwargs):
         if COUNTY_BASE_ENDPOINT_PARAM in view_kwargs:
@@ -59,12 +184,11 @@ class CurrentCountyMiddleware:
             if county and not county.get('active'):
                 return JsonResponse({'error': '[{}] county is not active!'.format(county_name)}, status=404)
             setattr(request, COUNTY_BASE_ENDPOINT_PARAM, county)
-        _do_set_current_county(lambda self: getattr(request, COUNTY_BASE_ENDPOINT_PARAM, None))
+            _current_county.set(county)
 
 
 def get_current_county():
-    current_county = getattr(_thread_locals, CURRENT_COUNTY_ATTR_NAME, None)
-    return current_county() if current_county else current_county
+    return _current_county.get()
 
 
 def get_current_county_id():
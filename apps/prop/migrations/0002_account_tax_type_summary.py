@@ -0,0 +1,54 @@
+# Generated by Django 2.0 on 2026-10-18 16:12
+
+import apps.prop.middleware
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_summaries(apps, schema_editor):
+    Account = apps.get_model('prop', 'Account')
+    AccountTaxTypeSummary = apps.get_model('prop', 'AccountTaxTypeSummary')
+    totals = Account.objects.values('county_id', 'property_id', 'tax_year', 'tax_type') \
+        .annotate(sum_amount=models.Sum('amount'), sum_balance=models.Sum('balance'), num=models.Count('id')) \
+        .order_by()
+    rows = []
+    for t in totals.iterator():
+        rows.append(AccountTaxTypeSummary(county_id=t['county_id'], property_id=t['property_id'],
+                                          tax_year=t['tax_year'], tax_type=t['tax_type'],
+                                          amount=t['sum_amount'], balance=t['sum_balance'], count=t['num']))
+        if len(rows) >= 5000:
+            AccountTaxTypeSummary.objects.bulk_create(rows)
+            rows = []
+    AccountTaxTypeSummary.objects.bulk_create(rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prop', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountTaxTypeSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tax_year', models.IntegerField()),
+                ('tax_type', models.CharField(max_length=64)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+                ('count', models.IntegerField(default=0)),
+                ('county', models.ForeignKey(default=apps.prop.middleware.get_current_county_id, on_delete=django.db.models.deletion.CASCADE, to='prop.County')),
+                ('property', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='prop.Property')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='accounttaxtypesummary',
+            unique_together={('property', 'tax_year', 'tax_type')},
+        ),
+        migrations.AlterIndexTogether(
+            name='accounttaxtypesummary',
+            index_together={('county', 'tax_type', 'tax_year')},
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+from apps.prop.search import SEARCH_TABLES, postgresql_index_sql, postgresql_drop_index_sql, sqlite_fts_sql, \
+    sqlite_drop_fts_sql
+
+
+def run_sql(schema_editor, statements):
+    for sql in statements:
+        schema_editor.execute(sql, params=None)
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        run_sql(schema_editor, ['CREATE EXTENSION IF NOT EXISTS pg_trgm'])
+        for table in SEARCH_TABLES:
+            run_sql(schema_editor, postgresql_index_sql(table))
+    elif vendor == 'sqlite':
+        for table in SEARCH_TABLES:
+            run_sql(schema_editor, sqlite_fts_sql(table))
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in SEARCH_TABLES:
+        if vendor == 'postgresql':
+            run_sql(schema_editor, postgresql_drop_index_sql(table))
+        elif vendor == 'sqlite':
+            run_sql(schema_editor, sqlite_drop_fts_sql(table))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prop', '0002_account_tax_type_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
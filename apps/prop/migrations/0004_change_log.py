@@ -0,0 +1,31 @@
+# Generated by Django 2.0 on 2026-10-18 16:19
+
+import apps.prop.middleware
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prop', '0003_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLog',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model_name', models.CharField(max_length=32)),
+                ('object_id', models.IntegerField()),
+                ('action', models.CharField(choices=[('insert', 'Insert'), ('update', 'Update'), ('delete', 'Delete')], max_length=6)),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now)),
+                ('county', models.ForeignKey(default=apps.prop.middleware.get_current_county_id, on_delete=django.db.models.deletion.CASCADE, to='prop.County')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='changelog',
+            index_together={('county', 'id')},
+        ),
+    ]
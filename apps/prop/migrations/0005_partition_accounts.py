@@ -0,0 +1,35 @@
+from django.db import migrations
+
+from apps.prop.partitions import PARTITIONED_TABLES, can_partition, partition_table, unpartition_table
+
+
+def get_model(apps, table):
+    return next(m for m in apps.get_app_config('prop').get_models() if m._meta.db_table == table)
+
+
+def partition_tables(apps, schema_editor):
+    if not can_partition(schema_editor.connection):
+        return
+    for table in PARTITIONED_TABLES:
+        partition_table(schema_editor.connection, table)
+
+
+def unpartition_tables(apps, schema_editor):
+    if not can_partition(schema_editor.connection):
+        return
+    for table in PARTITIONED_TABLES:
+        model = get_model(apps, table)
+        unique_columns = [[model._meta.pk.column]] + [[model._meta.get_field(f).column for f in fields]
+                                                      for fields in model._meta.unique_together]
+        unpartition_table(schema_editor.connection, table, unique_columns)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prop', '0004_change_log'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
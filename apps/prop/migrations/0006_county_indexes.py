@@ -0,0 +1,37 @@
+# Generated by Django 2.0 on 2026-10-18 16:25
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prop', '0005_partition_accounts'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='account',
+            index_together={('county', 'tax_year'), ('county', 'effective_date'), ('county', 'amount'), ('county', 'balance'), ('county', 'id')},
+        ),
+        migrations.AlterIndexTogether(
+            name='lienauction',
+            index_together={('county', 'tax_year'), ('county', 'face_value'), ('county', 'winning_bid'), ('county', 'id')},
+        ),
+        migrations.AlterIndexTogether(
+            name='owner',
+            index_together={('county', 'name'), ('county', 'id')},
+        ),
+        migrations.AlterIndexTogether(
+            name='owneraddress',
+            index_together={('county', 'id')},
+        ),
+        migrations.AlterIndexTogether(
+            name='property',
+            index_together={('county', 'timestamp'), ('county', 'id')},
+        ),
+        migrations.AlterIndexTogether(
+            name='propertyaddress',
+            index_together={('county', 'id')},
+        ),
+    ]
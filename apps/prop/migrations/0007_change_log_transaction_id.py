@@ -0,0 +1,49 @@
+# Generated by Django 2.0 on 2026-10-18 16:36
+
+from django.db import migrations, models
+
+TRANSACTION_ID_SQL = [
+    "CREATE OR REPLACE FUNCTION prop_changelog_transaction_id() RETURNS trigger AS $$ "
+    "BEGIN NEW.transaction_id := txid_current(); RETURN NEW; END; $$ LANGUAGE plpgsql",
+    "CREATE TRIGGER prop_changelog_transaction_id BEFORE INSERT ON prop_changelog "
+    "FOR EACH ROW EXECUTE PROCEDURE prop_changelog_transaction_id()",
+]
+DROP_TRANSACTION_ID_SQL = [
+    "DROP TRIGGER IF EXISTS prop_changelog_transaction_id ON prop_changelog",
+    "DROP FUNCTION IF EXISTS prop_changelog_transaction_id()",
+]
+
+
+def run_sql(schema_editor, statements):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for sql in statements:
+        schema_editor.execute(sql, params=None)
+
+
+def create_transaction_id_trigger(apps, schema_editor):
+    run_sql(schema_editor, TRANSACTION_ID_SQL)
+
+
+def drop_transaction_id_trigger(apps, schema_editor):
+    run_sql(schema_editor, DROP_TRANSACTION_ID_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prop', '0006_county_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='changelog',
+            name='transaction_id',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='changelog',
+            index_together={('county', 'transaction_id', 'id')},
+        ),
+        migrations.RunPython(create_transaction_id_trigger, drop_transaction_id_trigger),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0 on 2026-10-18 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('prop', '0007_change_log_transaction_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='changelog',
+            name='action',
+            field=models.CharField(choices=[('insert', 'Insert'), ('update', 'Update'), ('delete', 'Delete'), ('purge', 'Purge')], max_length=6),
+        ),
+    ]
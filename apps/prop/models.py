@@ -1,16 +1,18 @@
 import os
 import hashlib
+from collections import defaultdict
 
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, connection, connections, models, transaction
+from django.db.models import Count, F, Sum
 from django.utils import timezone
 from reversion import revisions as reversion
 from django.dispatch import receiver
-from django.db.models.signals import post_delete, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.contrib.auth import get_user_model
 
-from .middleware import get_current_county_id, clear_county_cached
-from project.helpers.utils import get_random_upload_path
+from .middleware import get_current_county_id, clear_county_cached, bump_county_generation
+from project.helpers.utils import bulk_create_with_ids, get_random_upload_path
 
 User = get_user_model()
 
@@ -91,6 +93,7 @@ class Property(CountyBaseModel):
 
     class Meta:
         unique_together = ("parid", "county")
+        index_together = (('county', 'id'), ('county', 'timestamp'))
 
 
 @reversion.register()
@@ -116,6 +119,9 @@ class Owner(CountyBaseModel):
     def __str__(self):
         return self.name
 
+    class Meta:
+        index_together = (('county', 'id'), ('county', 'name'))
+
 
 class Address(CountyBaseModel):
     """
@@ -178,6 +184,7 @@ class PropertyAddress(Address):
 
     class Meta:
         unique_together = ('idhash', 'property')
+        index_together = ('county', 'id')
 
 
 @reversion.register()
@@ -191,6 +198,7 @@ class OwnerAddress(Address):
 
     class Meta:
         unique_together = ('idhash', 'owner')
+        index_together = ('county', 'id')
 
 
 class Account(CountyBaseModel):
@@ -202,10 +210,107 @@ class Account(CountyBaseModel):
     balance = models.DecimalField(max_digits=12, decimal_places=2, null=False)
     timestamp = models.DateTimeField(default=timezone.now)
 
+    SUMMARY_FIELDS = ('county_id', 'property_id', 'tax_year', 'tax_type', 'amount', 'balance')
+
     def __str__(self):
         return 'Account(tax_year={0}, amount={1})'.format(self.tax_year,
                                                           self.amount)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Account, cls).from_db(db, field_names, values)
+        # loaded values are subtracted from tax type summary when account is changed or deleted
+        instance._loaded_summary_values = instance.get_summary_values()
+        return instance
+
+    def get_summary_values(self):
+        """
+        values of account in AccountTaxTypeSummary (None if some of them are deferred).
+        they are normalized by their fields (i.e. amount='2.50' of a new account is Decimal('2.50')).
+        """
+        if any(f not in self.__dict__ for f in self.SUMMARY_FIELDS):
+            return None
+        return tuple(self._meta.get_field(f).to_python(self.__dict__[f]) for f in self.SUMMARY_FIELDS)
+
+    class Meta:
+        # county first indexes of common filters/orderings (see query_usage_report command)
+        index_together = (('county', 'id'), ('county', 'tax_year'), ('county', 'amount'), ('county', 'balance'),
+                          ('county', 'effective_date'))
+
+
+class AccountTaxTypeSummary(CountyBaseModel):
+    """
+    sum of amount/balance and number of accounts by property, tax year and tax type.
+    it is updated on every save/delete of an account, and bulk inserts of accounts
+    refresh it for their properties (see refresh_accounts).
+    "rebuild_tax_type_summary" command rebuilds it from accounts.
+    """
+    REFRESH_CHUNK_SIZE = 500
+
+    property = models.ForeignKey(Property, on_delete=models.CASCADE)
+    tax_year = models.IntegerField()
+    tax_type = models.CharField(max_length=64)
+    amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    balance = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('property', 'tax_year', 'tax_type')
+        index_together = ('county', 'tax_type', 'tax_year')
+
+    @classmethod
+    def add(cls, values, sign=1):
+        """ add (or subtract if sign is -1) summary values of an account (see Account.get_summary_values) """
+        county_id, property_id, tax_year, tax_type, amount, balance = values
+        key = {'property_id': property_id, 'tax_year': tax_year, 'tax_type': tax_type}
+        rows = cls.objects.filter(**key)
+        updated = rows.update(amount=F('amount') + sign * amount, balance=F('balance') + sign * balance,
+                              count=F('count') + sign)
+        if sign < 0:
+            if updated:
+                rows.filter(count__lte=0).delete()
+            return
+        if updated:
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(county_id=county_id, amount=amount, balance=balance, count=1, **key)
+        except IntegrityError:
+            # created by a concurrent request
+            cls.add(values, sign)
+
+    @classmethod
+    def refresh(cls, county_id, property_ids=None):
+        """ recalculate rows of properties (or whole county if property_ids is None) from accounts """
+        if property_ids is None:
+            property_ids = set(Account.objects.filter(county_id=county_id).values_list('property_id', flat=True))
+            property_ids.update(cls.objects.filter(county_id=county_id).values_list('property_id', flat=True))
+        property_ids = sorted(property_ids)
+        for i in range(0, len(property_ids), cls.REFRESH_CHUNK_SIZE):
+            cls._refresh_properties(county_id, property_ids[i:i + cls.REFRESH_CHUNK_SIZE])
+
+    @classmethod
+    @transaction.atomic()
+    def _refresh_properties(cls, county_id, property_ids):
+        totals = Account.objects.filter(county_id=county_id, property_id__in=property_ids) \
+            .values('property_id', 'tax_year', 'tax_type') \
+            .annotate(sum_amount=Sum('amount'), sum_balance=Sum('balance'), num=Count('id')).order_by()
+        cls.objects.filter(county_id=county_id, property_id__in=property_ids).delete()
+        cls.objects.bulk_create([
+            cls(county_id=county_id, property_id=t['property_id'], tax_year=t['tax_year'], tax_type=t['tax_type'],
+                amount=t['sum_amount'], balance=t['sum_balance'], count=t['num'])
+            for t in totals
+        ])
+
+    @classmethod
+    def refresh_accounts(cls, accounts):
+        """ refresh rows of properties of accounts (i.e. after a bulk insert which does not send signals) """
+        property_ids = defaultdict(set)
+        for account in accounts:
+            property_ids[account.county_id].add(account.property_id)
+        for county_id, ids in property_ids.items():
+            cls.refresh(county_id, ids)
+
 
 class LienAuction(CountyBaseModel):
     property = models.ForeignKey(Property, on_delete=models.CASCADE)
@@ -221,9 +326,133 @@ class LienAuction(CountyBaseModel):
 
     class Meta:
         unique_together = ('property', 'tax_year')
+        index_together = (('county', 'id'), ('county', 'tax_year'), ('county', 'face_value'),
+                          ('county', 'winning_bid'))
+
+
+class ChangeLog(CountyBaseModel):
+    """
+    inserted, updated and deleted county objects. it is written in transaction of changes (see log_changes).
+    ids of concurrent transactions are not in commit order, so "changes" rest api reads it by
+    (transaction_id, id) and only rows of transactions which are older than all running ones (see committed).
+    on postgresql transaction_id is txid_current() (set by a trigger, see migration 0007). other databases
+    (i.e. sqlite) serialize writing transactions, so ids are in commit order there and transaction_id is 0.
+    a "purge" is a drop of all objects of model in county (object_id is 0) or of its tax years before object_id
+    (see partitions.drop_partitions), their objects are not logged one by one.
+    """
+    ACTION_INSERT = 'insert'
+    ACTION_UPDATE = 'update'
+    ACTION_DELETE = 'delete'
+    ACTION_PURGE = 'purge'
+    ACTION_CHOICES = (
+        (ACTION_INSERT, 'Insert'),
+        (ACTION_UPDATE, 'Update'),
+        (ACTION_DELETE, 'Delete'),
+        (ACTION_PURGE, 'Purge'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    model_name = models.CharField(max_length=32)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=6, choices=ACTION_CHOICES)
+    timestamp = models.DateTimeField(default=timezone.now)
+    transaction_id = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        index_together = ('county', 'transaction_id', 'id')
+
+    @staticmethod
+    def committed(queryset):
+        """ filter rows which cannot be preceded by rows of running transactions """
+        if connections[queryset.db].vendor == 'postgresql':
+            return queryset.extra(where=['transaction_id < txid_snapshot_xmin(txid_current_snapshot())'])
+        return queryset
 
 
 @receiver(post_save, sender=County)
 @receiver(post_delete, sender=County)
 def clear_ip_range_cache(sender, instance, *args, **kwargs):
     clear_county_cached(instance.name)
+
+
+def bump_county_generation_on_commit(county_id):
+    if county_id:
+        transaction.on_commit(lambda: bump_county_generation(county_id))
+
+
+def county_object_changed(sender, instance, *args, **kwargs):
+    bump_county_generation_on_commit(instance.county_id)
+
+
+def log_changes(model, objects, action):
+    """ write change log of objects in current transaction (so it is committed or rolled back with them) """
+    changes = [ChangeLog(county_id=obj.county_id, model_name=model._meta.model_name, object_id=obj.pk, action=action)
+               for obj in objects]
+    if changes:
+        ChangeLog.objects.bulk_create(changes, batch_size=1000)
+
+
+def bulk_create_logged(model, objs, batch_size=None):
+    """
+    bulk_create_with_ids which logs inserted objects.
+    objects which are saved one by one (no ids from bulk inserts) are logged by post_save signal.
+    """
+    bulk_insert = connection.features.can_return_ids_from_bulk_insert
+    objs = bulk_create_with_ids(model, objs, batch_size=batch_size)
+    if bulk_insert:
+        log_changes(model, objs, ChangeLog.ACTION_INSERT)
+    return objs
+
+
+def log_county_object_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        log_changes(sender, [instance], ChangeLog.ACTION_INSERT if created else ChangeLog.ACTION_UPDATE)
+
+
+def log_county_object_deleted(sender, instance, *args, **kwargs):
+    log_changes(sender, [instance], ChangeLog.ACTION_DELETE)
+
+
+def log_owner_properties_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """ properties are a field of owner, so owners are updated by changes of owner properties """
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        owners = [Owner(pk=pk, county_id=instance.county_id) for pk in pk_set or ()]
+    else:
+        owners = [instance]
+    log_changes(Owner, owners, ChangeLog.ACTION_UPDATE)
+
+
+COUNTY_MODELS = (Property, Owner, PropertyAddress, OwnerAddress, Account, LienAuction)
+for county_model in COUNTY_MODELS:
+    post_save.connect(county_object_changed, sender=county_model)
+    post_delete.connect(county_object_changed, sender=county_model)
+    post_save.connect(log_county_object_saved, sender=county_model)
+    post_delete.connect(log_county_object_deleted, sender=county_model)
+m2m_changed.connect(county_object_changed, sender=Owner.properties.through)
+m2m_changed.connect(log_owner_properties_changed, sender=Owner.properties.through)
+
+
+@receiver(post_save, sender=Account)
+def add_account_to_summary(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_values = None if created else getattr(instance, '_loaded_summary_values', None)
+    values = instance.get_summary_values()
+    if values is None or (old_values is None and not created):
+        AccountTaxTypeSummary.refresh(instance.county_id, [instance.property_id])
+    elif old_values != values:
+        if old_values is not None:
+            AccountTaxTypeSummary.add(old_values, -1)
+        AccountTaxTypeSummary.add(values)
+    instance._loaded_summary_values = values
+
+
+@receiver(post_delete, sender=Account)
+def subtract_account_from_summary(sender, instance, *args, **kwargs):
+    values = getattr(instance, '_loaded_summary_values', None) or instance.get_summary_values()
+    if values is None:
+        AccountTaxTypeSummary.refresh(instance.county_id, [instance.property_id])
+    else:
+        AccountTaxTypeSummary.add(values, -1)
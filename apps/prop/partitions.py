@@ -0,0 +1,249 @@
+"""
+postgresql declarative partitioning of append-heavy county tables (see migration 0005).
+every table of PARTITIONED_TABLES is partitioned by list of county_id and every county partition
+by range of tax_year (one partition per year), so scans of a county or tax year are pruned to
+their partitions and purges of a county or old years are partition drops.
+rows of counties/years without a partition are kept in default partitions until "manage_partitions"
+command creates their partitions (and moves their rows).
+dropped partitions are written to change log (ChangeLog) as one "purge" of county (or its old tax years).
+postgresql >= 11 is required, other databases (i.e. sqlite in development) keep plain tables.
+notice: primary key and unique constraints of partitioned tables include PARTITION_KEYS,
+so migrations which change them (i.e. unique_together of LienAuction) should be written by hand.
+"""
+import re
+
+from django.db import transaction
+
+PARTITIONED_TABLES = ('prop_account', 'prop_lienauction')
+PARTITION_KEYS = ('county_id', 'tax_year')
+CHANGE_LOG_TABLE = 'prop_changelog'
+MIN_POSTGRESQL_VERSION = 110000
+
+
+def can_partition(connection):
+    return connection.vendor == 'postgresql' and connection.pg_version >= MIN_POSTGRESQL_VERSION
+
+
+def county_partition(table, county_id):
+    return '{}_c{}'.format(table, county_id)
+
+
+def year_partition(table, county_id, tax_year):
+    return '{}_y{}'.format(county_partition(table, county_id), tax_year)
+
+
+def default_partition(table):
+    return '{}_default'.format(table)
+
+
+def partition_unique_columns(columns):
+    """ columns of a unique constraint in partitioned table (it must include partition keys) """
+    return list(columns) + [k for k in PARTITION_KEYS if k not in columns]
+
+
+def county_partition_sql(table, county_id, parent=None):
+    partition = county_partition(table, county_id)
+    return [
+        'CREATE TABLE {} PARTITION OF {} FOR VALUES IN ({}) PARTITION BY RANGE (tax_year)'.format(
+            partition, parent or table, int(county_id)),
+        'CREATE TABLE {0} PARTITION OF {1} DEFAULT'.format(default_partition(partition), partition),
+    ]
+
+
+def year_partition_sql(table, county_id, tax_year):
+    return ['CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})'.format(
+        year_partition(table, county_id, tax_year), county_partition(table, county_id), int(tax_year),
+        int(tax_year) + 1)]
+
+
+def fetch_column(cursor, sql, params=None):
+    cursor.execute(sql, params)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def table_exists(cursor, table):
+    cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [table])
+    return cursor.fetchone()[0]
+
+
+def is_partitioned(connection, table):
+    if not can_partition(connection):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [table])
+        return cursor.fetchone() is not None
+
+
+def get_partitions(cursor, table):
+    return fetch_column(cursor, 'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                                'WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname', [table])
+
+
+def get_year_partitions(cursor, table, county_id):
+    """ {tax_year: partition} of county partition """
+    pattern = re.compile(r'^{}_y(\d+)$'.format(re.escape(county_partition(table, county_id))))
+    years = {}
+    for partition in get_partitions(cursor, county_partition(table, county_id)):
+        match = pattern.match(partition)
+        if match:
+            years[int(match.group(1))] = partition
+    return years
+
+
+def get_table_schema(cursor, table):
+    """ (unique constraints [(name, type, columns)], foreign keys [(name, definition)], other indexes [sql]) """
+    cursor.execute(
+        "SELECT con.conname, con.contype, array_agg(a.attname ORDER BY k.n) FROM pg_constraint con "
+        "CROSS JOIN unnest(con.conkey) WITH ORDINALITY AS k(attnum, n) "
+        "JOIN pg_attribute a ON a.attrelid = con.conrelid AND a.attnum = k.attnum "
+        "WHERE con.conrelid = to_regclass(%s) AND con.contype IN ('p', 'u') GROUP BY con.conname, con.contype",
+        [table])
+    unique = [(name, contype, list(columns)) for name, contype, columns in cursor.fetchall()]
+    cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                   "WHERE conrelid = to_regclass(%s) AND contype = 'f'", [table])
+    foreign_keys = cursor.fetchall()
+    # indexes of partitioned tables are defined "ON ONLY" table
+    indexes = [sql.replace(' ON ONLY ', ' ON ') for sql in fetch_column(
+        cursor, 'SELECT pg_get_indexdef(indexrelid) FROM pg_index WHERE indrelid = to_regclass(%s) '
+                'AND NOT indisunique', [table])]
+    return unique, foreign_keys, indexes
+
+
+def restore_table_schema(cursor, table, unique, foreign_keys, indexes):
+    for name, contype, columns in unique:
+        cursor.execute('ALTER TABLE {} ADD CONSTRAINT "{}" {} ({})'.format(
+            table, name, 'PRIMARY KEY' if contype == 'p' else 'UNIQUE', ', '.join(columns)))
+    for name, definition in foreign_keys:
+        cursor.execute('ALTER TABLE {} ADD CONSTRAINT "{}" {}'.format(table, name, definition))
+    for sql in indexes:
+        cursor.execute(sql)
+
+
+def replace_table(cursor, table, create_sql, unique):
+    """
+    replace table by a new table (created by create_sql with name of its only format argument)
+    which has same rows, sequence, foreign keys and indexes, and `unique` constraints.
+    """
+    new_table = '{}_new'.format(table)
+    _, foreign_keys, indexes = get_table_schema(cursor, table)
+    for sql in create_sql(new_table):
+        cursor.execute(sql)
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    cursor.execute('ALTER SEQUENCE {} OWNED BY {}.id'.format(sequence, new_table))
+    cursor.execute('INSERT INTO {} SELECT * FROM {}'.format(new_table, table))
+    cursor.execute('DROP TABLE {}'.format(table))
+    cursor.execute('ALTER TABLE {} RENAME TO {}'.format(new_table, table))
+    restore_table_schema(cursor, table, unique, foreign_keys, indexes)
+
+
+def partition_table(connection, table):
+    """ convert table to a partitioned table with partitions of its current counties and tax years """
+    with connection.cursor() as cursor:
+        unique, _, _ = get_table_schema(cursor, table)
+        county_years = {}
+        cursor.execute('SELECT DISTINCT county_id, tax_year FROM {}'.format(table))
+        for county_id, tax_year in cursor.fetchall():
+            county_years.setdefault(county_id, set()).add(tax_year)
+
+        def create_sql(new_table):
+            sql = ['CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+                   'PARTITION BY LIST (county_id)'.format(new_table, table),
+                   'CREATE TABLE {} PARTITION OF {} DEFAULT'.format(default_partition(table), new_table)]
+            for county_id, years in sorted(county_years.items()):
+                sql += county_partition_sql(table, county_id, parent=new_table)
+                for tax_year in sorted(years):
+                    sql += year_partition_sql(table, county_id, tax_year)
+            return sql
+
+        unique = [(name, contype, partition_unique_columns(columns)) for name, contype, columns in unique]
+        replace_table(cursor, table, create_sql, unique)
+
+
+def unpartition_table(connection, table, original_unique_columns):
+    """
+    convert partitioned table back to a plain table.
+    original_unique_columns are columns of unique constraints before partitioning (from model state).
+    """
+    with connection.cursor() as cursor:
+        unique, _, _ = get_table_schema(cursor, table)
+        originals = {tuple(partition_unique_columns(columns)): list(columns) for columns in original_unique_columns}
+        unique = [(name, contype, originals.get(tuple(columns), columns)) for name, contype, columns in unique]
+
+        def create_sql(new_table):
+            return ['CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(new_table, table)]
+
+        replace_table(cursor, table, create_sql, unique)
+
+
+def move_rows(cursor, source, target, where, params, create_sql):
+    """
+    run create_sql of a partition after moving rows of it from default partition (source) to a temporary table,
+    then insert them again to parent table (target).
+    """
+    cursor.execute('CREATE TEMPORARY TABLE moved_rows AS SELECT * FROM {} WHERE {}'.format(
+        source, where), params)
+    cursor.execute('DELETE FROM {} WHERE {}'.format(source, where), params)
+    for sql in create_sql:
+        cursor.execute(sql)
+    cursor.execute('INSERT INTO {} SELECT * FROM moved_rows'.format(target))
+    cursor.execute('DROP TABLE moved_rows')
+
+
+def create_partitions(connection, table, county_id, years=()):
+    """
+    create partition of county and partitions of its tax years (years and years of its rows in default partitions).
+    returns names of created partitions.
+    """
+    created = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        partition = county_partition(table, county_id)
+        if not table_exists(cursor, partition):
+            move_rows(cursor, default_partition(table), table, 'county_id = %s', [county_id],
+                      county_partition_sql(table, county_id))
+            created.append(partition)
+        years = set(years) | set(fetch_column(cursor, 'SELECT DISTINCT tax_year FROM {}'.format(
+            default_partition(partition))))
+        existing = get_year_partitions(cursor, table, county_id)
+        for tax_year in sorted(years - set(existing)):
+            move_rows(cursor, default_partition(partition), table, 'tax_year = %s', [tax_year],
+                      year_partition_sql(table, county_id, tax_year))
+            created.append(year_partition(table, county_id, tax_year))
+    return created
+
+
+def log_purge(cursor, model_name, county_id, before_year=None):
+    """
+    write one "purge" change log of dropped objects of county (or its tax years before before_year),
+    instead of a "delete" per row (see ChangeLog). transaction_id is txid_current() like rows of log_changes.
+    """
+    cursor.execute("INSERT INTO {} (county_id, model_name, object_id, action, timestamp, transaction_id) "
+                   "VALUES (%s, %s, %s, 'purge', now(), txid_current())".format(CHANGE_LOG_TABLE),
+                   [county_id, model_name, before_year or 0])
+
+
+def drop_partitions(connection, table, model_name, county_id, before_year=None):
+    """
+    drop partitions of county (or its tax years before before_year) and delete its rows in default partitions.
+    they are written to change log as one "purge" of model_name (see log_purge).
+    returns names of dropped partitions.
+    """
+    dropped = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        log_purge(cursor, model_name, county_id, before_year)
+        partition = county_partition(table, county_id)
+        if before_year is None:
+            cursor.execute('DELETE FROM {} WHERE county_id = %s'.format(default_partition(table)), [county_id])
+            if table_exists(cursor, partition):
+                cursor.execute('DROP TABLE {}'.format(partition))
+                dropped.append(partition)
+            return dropped
+        for tax_year, year_table in sorted(get_year_partitions(cursor, table, county_id).items()):
+            if tax_year < before_year:
+                cursor.execute('DROP TABLE {}'.format(year_table))
+                dropped.append(year_table)
+        if table_exists(cursor, partition):
+            cursor.execute('DELETE FROM {} WHERE tax_year < %s'.format(default_partition(partition)), [before_year])
+        cursor.execute('DELETE FROM {} WHERE county_id = %s AND tax_year < %s'.format(default_partition(table)),
+                       [county_id, before_year])
+    return dropped
@@ -0,0 +1,115 @@
+"""
+opt-in recorder of filter/ordering combinations of county list requests (QUERY_USAGE_RECORDER setting).
+combinations are counted in django cache (redis) when they are queried (not for cached responses)
+and "query_usage_report" command reports
+which of them lack a supporting county-first index.
+"""
+import hashlib
+import logging
+
+import simplejson as json
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.db import connection
+from django.db.models import ForeignKey
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.filters import OrderingFilter
+
+logger = logging.getLogger(__name__)
+
+QUERY_USAGE_KEY = 'query-usage-{digest}'
+QUERY_USAGE_REGISTRY_KEY = 'query-usage-registry'
+EQUALITY_LOOKUPS = ('exact', 'iexact', 'in', 'isnull')
+
+
+def get_column(model, name):
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+    return getattr(field, 'column', None)
+
+
+def get_query_usage(request, queryset, view):
+    """ ([(column, lookup)] of filters, [column or -column] of ordering) of request """
+    model = queryset.model
+    filters = set()
+    ordering = []
+    for backend_class in view.filter_backends:
+        backend = backend_class()
+        if isinstance(backend, DjangoFilterBackend):
+            filter_class = backend.get_filter_class(view, queryset)
+            for param, filter_ in (filter_class.base_filters.items() if filter_class else ()):
+                column = get_column(model, filter_.name)
+                if column and request.query_params.get(param) not in (None, ''):
+                    filters.add((column, filter_.lookup_expr))
+        elif isinstance(backend, OrderingFilter):
+            for field in backend.get_ordering(request, queryset, view) or ():
+                column = get_column(model, field.lstrip('-'))
+                if column:
+                    ordering.append('-' + column if field.startswith('-') else column)
+    return sorted(filters), ordering
+
+
+def record_query_usage(request, queryset, view):
+    filters, ordering = get_query_usage(request, queryset, view)
+    usage = [queryset.model._meta.db_table, filters, ordering]
+    digest = hashlib.md5(json.dumps(usage).encode()).hexdigest()
+    key = QUERY_USAGE_KEY.format(digest=digest)
+    if cache.add(key, 1, timeout=None):
+        # registry is only changed by new combinations, lost updates of a race are recorded by next requests
+        registry = cache.get(QUERY_USAGE_REGISTRY_KEY) or {}
+        registry[digest] = usage
+        cache.set(QUERY_USAGE_REGISTRY_KEY, registry, timeout=None)
+        logger.info('new query usage of [%s]: filters=%s ordering=%s', *usage)
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_query_usages():
+    """ [(count, table, filters, ordering)] of recorded combinations (most used first) """
+    registry = cache.get(QUERY_USAGE_REGISTRY_KEY) or {}
+    counts = cache.get_many([QUERY_USAGE_KEY.format(digest=digest) for digest in registry])
+    usages = [(counts.get(QUERY_USAGE_KEY.format(digest=digest), 0), table, [tuple(f) for f in filters], ordering)
+              for digest, (table, filters, ordering) in registry.items()]
+    return sorted(usages, key=lambda u: (-u[0], u[1]))
+
+
+def clear_query_usages():
+    registry = cache.get(QUERY_USAGE_REGISTRY_KEY) or {}
+    cache.delete_many([QUERY_USAGE_KEY.format(digest=digest) for digest in registry] + [QUERY_USAGE_REGISTRY_KEY])
+
+
+def get_table_indexes(table):
+    """ [(columns, unique)] of indexes (and unique constraints) of table """
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return [(c['columns'], c['unique'] or c['primary_key']) for c in constraints.values()
+            if c['index'] or c['unique'] or c['primary_key']]
+
+
+def find_supporting_index(model, filters, ordering, indexes):
+    """
+    columns of an index which supports a county filtered query, None if there is not.
+    it should start with county_id and equality filter columns (in any order), then ordering column
+    (or column of a range filter). an index of a filtered foreign key (i.e. property_id) or a unique index
+    of equality filter columns (i.e. parid) supports it too.
+    """
+    prefix = {column for column, lookup in filters if lookup in EQUALITY_LOOKUPS} | {'county_id'}
+    ranges = [column for column, lookup in filters if lookup not in EQUALITY_LOOKUPS]
+    next_column = ordering[0].lstrip('-') if ordering else (ranges[0] if ranges else None)
+    foreign_keys = {f.column for f in model._meta.fields if isinstance(f, ForeignKey) and f.column in prefix} - \
+        {'county_id'}
+    for columns, unique in indexes:
+        if columns and columns[0] in foreign_keys:
+            return columns
+        if set(columns[:len(prefix)]) != prefix:
+            continue
+        if unique and len(columns) == len(prefix):
+            return columns
+        if next_column is None or next_column in prefix or columns[len(prefix):len(prefix) + 1] == [next_column]:
+            return columns
+    return None
@@ -1,7 +1,7 @@
 import django_filters
 from django_filters.rest_framework import FilterSet
 
-from apps.prop.models import Property, Account, LienAuction
+from apps.prop.models import Property, Account, AccountTaxTypeSummary, LienAuction
 
 
 class PropertyFilter(FilterSet):
@@ -34,7 +34,7 @@ class AccountTaxTypeSummaryFilter(FilterSet):
                                                lookup_expr="lte")
 
     class Meta:
-        model = Account
+        model = AccountTaxTypeSummary
         fields = ['tax_year', 'min_tax_year', 'max_tax_year', 'property', ]
 
 
@@ -45,7 +45,7 @@ class PropertyTaxTypeSummaryFilter(FilterSet):
                                                lookup_expr="lte")
 
     class Meta:
-        model = Account
+        model = AccountTaxTypeSummary
         fields = ['tax_year', 'min_tax_year', 'max_tax_year', 'tax_type']
 
 
@@ -4,10 +4,11 @@ from rest_framework import serializers
 from django.conf import settings
 from rest_framework.reverse import reverse
 from django.db import IntegrityError, transaction
+from reversion import revisions as reversion
 
 from apps.prop.models import Property, Owner, PropertyAddress, OwnerAddress, \
-    Account, LienAuction, CountyBaseModel, County, UserProfile, User
-from project.helpers.utils import Base64ImageField
+    Account, AccountTaxTypeSummary, LienAuction, CountyBaseModel, County, UserProfile, User, bulk_create_logged
+from project.helpers.utils import Base64ImageField, DynamicFieldsSerializerMixin
 
 
 class AvatarSerializer(serializers.ModelSerializer):
@@ -52,13 +53,39 @@ class SessionSerializer(serializers.Serializer):
     password = serializers.CharField(max_length=128)
 
 
+class BulkCreateSerializerMixin(object):
+    """
+    add bulk_create to a model serializer. it is used by batch rest apis to insert
+    a list of already validated data with bulk inserts (instead of create per item).
+    """
+
+    def bulk_create(self, validated_data_list):
+        ModelClass = self.Meta.model
+        instances = [ModelClass(**validated_data) for validated_data in validated_data_list]
+        bulk_create_logged(ModelClass, instances)
+        self.add_to_revision(instances)
+        return instances
+
+    @staticmethod
+    def add_to_revision(instances):
+        """
+        add bulk inserted objects to active revision (of RevisionMiddleware), so they have a history
+        on all databases (bulk inserts do not send post_save signals where ids are returned by them).
+        """
+        if not reversion.is_active():
+            return
+        for instance in instances:
+            if reversion.is_registered(type(instance)):
+                reversion.add_to_revision(instance)
+
+
 class CountySerializer(serializers.ModelSerializer):
     class Meta:
         model = County
         fields = '__all__'
 
 
-class OwnerAddressSerializer(serializers.ModelSerializer):
+class OwnerAddressSerializer(DynamicFieldsSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = OwnerAddress
         fields = '__all__'
@@ -73,7 +100,7 @@ class NestedOwnerAddressSerializer(serializers.ModelSerializer):
         exclude = ('owner',)
 
 
-class PropertyAddressSerializer(serializers.ModelSerializer):
+class PropertyAddressSerializer(DynamicFieldsSerializerMixin, serializers.ModelSerializer):
 
     class Meta:
         model = PropertyAddress
@@ -87,7 +114,7 @@ class NestedPropertyAddressSerializer(serializers.ModelSerializer):
         exclude = ('property',)
 
 
-class PropertySerializer(serializers.ModelSerializer):
+class PropertySerializer(DynamicFieldsSerializerMixin, BulkCreateSerializerMixin, serializers.ModelSerializer):
 
     address = NestedPropertyAddressSerializer(required=False, allow_null=True)
 
@@ -95,6 +122,26 @@ class PropertySerializer(serializers.ModelSerializer):
         model = Property
         fields = '__all__'
 
+    def bulk_create(self, validated_data_list):
+        instances = []
+        addresses_data = []
+        for validated_data in validated_data_list:
+            validated_data = dict(validated_data)
+            addresses_data.append(validated_data.pop('address', None))
+            instances.append(Property(**validated_data))
+        bulk_create_logged(Property, instances)
+
+        addresses = []
+        for instance, address_data in zip(instances, addresses_data):
+            if not address_data:
+                continue
+            address = PropertyAddress(property=instance, **address_data)
+            address.idhash = address.addresshasher()
+            addresses.append(address)
+        bulk_create_logged(PropertyAddress, addresses)
+        self.add_to_revision(instances + addresses)
+        return instances
+
     @transaction.atomic()
     def create(self, validated_data):
         address_data = validated_data.pop('address', None)
@@ -147,7 +194,7 @@ class PropertySerializer(serializers.ModelSerializer):
 
 
 
-class OwnerSerializer(serializers.ModelSerializer):
+class OwnerSerializer(DynamicFieldsSerializerMixin, BulkCreateSerializerMixin, serializers.ModelSerializer):
 
     addresses = NestedOwnerAddressSerializer(required=False, allow_null=True,
                                              many=True)
@@ -156,6 +203,40 @@ class OwnerSerializer(serializers.ModelSerializer):
         model = Owner
         fields = '__all__'
 
+    def bulk_create(self, validated_data_list):
+        """ notice: repeated addresses (same idhash) of an owner are inserted once. """
+        instances = []
+        related_data = []
+        for validated_data in validated_data_list:
+            validated_data = dict(validated_data)
+            addresses_data = validated_data.pop('addresses', None) or []
+            properties = validated_data.pop('properties', None) or []
+            related_data.append((addresses_data, properties))
+            instances.append(Owner(**validated_data))
+        bulk_create_logged(Owner, instances)
+
+        addresses = []
+        owner_properties = []
+        OwnerProperty = Owner.properties.through
+        for instance, (addresses_data, properties) in zip(instances, related_data):
+            idhashes = set()
+            for address_data in addresses_data:
+                address_data = dict(address_data)
+                address_data.pop('id', None)
+                address = OwnerAddress(owner=instance, **address_data)
+                address.idhash = address.addresshasher()
+                if address.idhash is not None and address.idhash in idhashes:
+                    continue
+                idhashes.add(address.idhash)
+                addresses.append(address)
+            for prop in properties:
+                owner_properties.append(OwnerProperty(owner_id=instance.pk, property_id=prop.pk))
+        bulk_create_logged(OwnerAddress, addresses)
+        OwnerProperty.objects.bulk_create(owner_properties)
+        # owners are added after their properties are inserted
+        self.add_to_revision(instances + addresses)
+        return instances
+
     @transaction.atomic()
     def create(self, validated_data):
         addresses_data = validated_data.pop('addresses', None) or []
@@ -198,13 +279,18 @@ class OwnerSerializer(serializers.ModelSerializer):
         return super(OwnerSerializer, self).update(instance, validated_data)
 
 
-class AccountSerializer(serializers.ModelSerializer):
+class AccountSerializer(DynamicFieldsSerializerMixin, BulkCreateSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Account
         fields = '__all__'
 
+    def bulk_create(self, validated_data_list):
+        instances = super(AccountSerializer, self).bulk_create(validated_data_list)
+        AccountTaxTypeSummary.refresh_accounts(instances)
+        return instances
+
 
-class LienAuctionSerializer(serializers.ModelSerializer):
+class LienAuctionSerializer(DynamicFieldsSerializerMixin, BulkCreateSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = LienAuction
         fields = '__all__'
@@ -1,25 +1,41 @@
+import csv
+import functools
+import hashlib
 import inspect
 import sys
+from collections import OrderedDict
+from itertools import islice
 import simplejson as json
 from django.conf import settings
 from dateutil import parser
 from django.contrib.auth import authenticate, login, logout
-from rest_framework import viewsets, serializers, permissions
+from rest_framework import viewsets, serializers, permissions, exceptions
 from rest_framework.generics import get_object_or_404
 from rest_framework.parsers import FileUploadParser
 from rest_framework.response import Response
 from rest_framework.decorators import detail_route, list_route
 from djoser.views import SetPasswordView as JoserSetPasswordView
-from django.db.models import Sum
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.http import StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.utils.encoders import JSONEncoder
 from reversion.models import Version
 
 from .serializers import PropertySerializer, OwnerSerializer, \
     OwnerAddressSerializer, PropertyAddressSerializer, AccountSerializer, \
     LienAuctionSerializer, CountySerializer, UserProfileSerializer, UserSerializer, AvatarSerializer, SessionSerializer
 from apps.prop.models import Property, Owner, OwnerAddress, PropertyAddress, \
-    Account, LienAuction, County
+    Account, AccountTaxTypeSummary, LienAuction, County, ChangeLog, bump_county_generation_on_commit
+from apps.prop.middleware import get_county_generation, get_county_last_modified
+from apps.prop.search import search_queryset, search_terms
+from apps.prop.query_usage import record_query_usage
 from .filters import PropertyFilter, AccountFilter, LienAuctionFilter, \
     AccountTaxTypeSummaryFilter, PropertyTaxTypeSummaryFilter
+from project.helpers.utils import is_duplicate_error, optimize_queryset, LookupDjangoModelPermissions, \
+    QuerysetOptimizerMixin
 
 COUNTY_BASE_ENDPOINT_PARAM = getattr(settings, 'COUNTY_BASE_ENDPOINT_PARAM', 'county')
 
@@ -30,6 +46,7 @@ __all__ = (
     "PropertyAddressView",
     "AccountView",
     "LienAuctionView",
+    "ChangeFeedView",
     "CountyView",
     "SessionView",
     "ProfileView",
@@ -134,15 +151,18 @@ class SetPasswordView(JoserSetPasswordView):
         return super(SetPasswordView, self).post(request)
 
 
-class CountyViewSetMixin(object):
+class CountyViewSetMixin(QuerysetOptimizerMixin):
     """
     a base connty modelviewset class for all other viewsets.
+    querysets are optimized for serializer fields (see QuerysetOptimizerMixin).
+    filter/ordering combinations of list requests are recorded if QUERY_USAGE_RECORDER setting is enabled.
     Notice!!! using this class in multi-inheritance as a "first" parent class.
     i.e: class PropertyView(CountyViewSetMixin, viewsets.ModelViewSet, HistoricalViewMixin)
     """
 
     county_object = None
     county_url_kwarg = 'county'
+    query_usage_actions = ('list', 'export')
 
     def county_filter(self, qs):
         county = getattr(self.request, COUNTY_BASE_ENDPOINT_PARAM, None)
@@ -152,9 +172,343 @@ class CountyViewSetMixin(object):
     def get_queryset(self):
         return self.county_filter(super(CountyViewSetMixin, self).get_queryset())
 
+    def get_count_cache_version(self):
+        """ cached counts of pagination are not used after a change of county objects """
+        county = getattr(self.request, COUNTY_BASE_ENDPOINT_PARAM, None) or {}
+        return get_county_generation(county.get('id'))
+
+    def filter_queryset(self, queryset):
+        queryset = super(CountyViewSetMixin, self).filter_queryset(queryset)
+        if self.action in self.query_usage_actions and settings.REST_FRAMEWORK.get('QUERY_USAGE_RECORDER'):
+            record_query_usage(self.request, queryset, self)
+        return queryset
+
+    def get_request_digest(self, request):
+        """ digest of path, query params and user permissions of request """
+        user = request.user
+        perms = sorted(user.get_all_permissions()) if user.is_authenticated else []
+        signature = json.dumps([request.path, sorted(request.query_params.lists()), user.is_superuser, perms])
+        return hashlib.md5(signature.encode()).hexdigest()
+
+
+class CountyResponseCacheMixin(object):
+    """
+    cache GET responses of county resources in django cache (redis).
+    cache key includes path, query params, user permissions and county generation.
+    county generation is changed on every change of county objects (see models.py signals),
+    so cached responses are not used after an import.
+    timeout is RESPONSE_CACHE_TIMEOUT setting (0 or None disables cache).
+    """
+    cache_actions = ('list', 'retrieve', 'history', 'tax_type_summary', 'search')
+    RESPONSE_CACHE_KEY = 'response-{county_id}-{generation}-{digest}'
+
+    def get_response_cache_timeout(self):
+        return settings.REST_FRAMEWORK.get('RESPONSE_CACHE_TIMEOUT')
+
+    def get_response_cache_key(self, request):
+        county = getattr(request, COUNTY_BASE_ENDPOINT_PARAM, None) or {}
+        return self.RESPONSE_CACHE_KEY.format(county_id=county.get('id'),
+                                              generation=get_county_generation(county.get('id')),
+                                              digest=self.get_request_digest(request))
+
+    def initial(self, request, *args, **kwargs):
+        super(CountyResponseCacheMixin, self).initial(request, *args, **kwargs)
+        # handler is looked up after initial, so we wrap it here (after authentication and permission checks)
+        if request.method == 'GET' and self.action in self.cache_actions and self.get_response_cache_timeout():
+            self.get = functools.partial(self.cached_response, self.get)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200 and getattr(response, 'data', None) is not None:
+            cache.set(key, response.data, self.get_response_cache_timeout())
+        return response
+
+
+class CountyConditionalGetMixin(object):
+    """
+    add ETag and Last-Modified headers to GET responses of county resources and
+    return 304 (Not Modified) for If-None-Match/If-Modified-Since requests.
+    ETag is made of county generation and request digest, and Last-Modified is the time of last change
+    of county objects (or the time it was lost from cache), so the response body is not built to check them.
+    """
+    conditional_actions = ('list', 'retrieve', 'history', 'tax_type_summary', 'search')
+
+    def get_etag(self, request):
+        county = getattr(request, COUNTY_BASE_ENDPOINT_PARAM, None) or {}
+        return quote_etag('{}-{}'.format(get_county_generation(county.get('id')), self.get_request_digest(request)))
+
+    def get_last_modified(self, request):
+        county = getattr(request, COUNTY_BASE_ENDPOINT_PARAM, None) or {}
+        return get_county_last_modified(county.get('id'))
+
+    def initial(self, request, *args, **kwargs):
+        super(CountyConditionalGetMixin, self).initial(request, *args, **kwargs)
+        if request.method == 'GET' and self.action in self.conditional_actions:
+            self.get = functools.partial(self.conditional_response, self.get)
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag = self.get_etag(request)
+        last_modified = self.get_last_modified(request)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class BatchCreateViewMixin(object):
+    """
+    add a "batch" rest api to create a list of objects in one request.
+    all items are validated, then valid ones are inserted with bulk inserts in one transaction.
+    response has a status (created / duplicate / invalid) for every item of the request.
+    serializer_class should have a bulk_create method (see BulkCreateSerializerMixin).
+    """
+    BATCH_STATUS_CREATED = 'created'
+    BATCH_STATUS_DUPLICATE = 'duplicate'
+    BATCH_STATUS_INVALID = 'invalid'
+
+    max_batch_size = None
+
+    def get_max_batch_size(self):
+        if self.max_batch_size is not None:
+            return self.max_batch_size
+        return settings.REST_FRAMEWORK.get('MAX_BATCH_SIZE_DEFAULT', 5000)
+
+    def get_unique_key(self, data, fields):
+        county = getattr(self.request, COUNTY_BASE_ENDPOINT_PARAM, None)
+        key = []
+        for f in fields:
+            v = (county and county.get('id')) if f == 'county' else data.get(f)
+            key.append(getattr(v, 'pk', v))
+        return tuple(key)
+
+    def get_existing_keys(self, fields, keys):
+        """
+        find already existing keys of a unique_together set which includes county.
+        (serializers cannot validate them because county is not a serializer field)
+        """
+        lookup_field = next(f for f in fields if f != 'county')
+        lookup_values = {k[fields.index(lookup_field)] for k in keys}
+        queryset = self.county_filter(self.get_serializer_class().Meta.model.objects.all())
+        queryset = queryset.filter(**{'{}__in'.format(lookup_field): lookup_values})
+        return set(queryset.values_list(*fields))
+
+    def find_batch_duplicates(self, valid_items):
+        """ returns indexes of items which are duplicated in database or in the batch itself """
+        duplicates = set()
+        for fields in self.get_serializer_class().Meta.model._meta.unique_together:
+            keys = {i: self.get_unique_key(s.validated_data, fields) for i, s in valid_items}
+            existing = self.get_existing_keys(fields, keys.values()) if keys and 'county' in fields else set()
+            for i, key in keys.items():
+                if key in existing:
+                    duplicates.add(i)
+                existing.add(key)
+        return duplicates
+
+    @list_route(methods=['post'])
+    def batch(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list):
+            raise serializers.ValidationError({'detail': 'Expected a list of objects.'})
+        max_batch_size = self.get_max_batch_size()
+        if len(items) > max_batch_size:
+            raise serializers.ValidationError({'detail': 'Maximum {} objects are allowed.'.format(max_batch_size)})
+
+        results = [None] * len(items)
+        valid_items = []
+        for i, item in enumerate(items):
+            serializer = self.get_serializer(data=item)
+            if serializer.is_valid():
+                valid_items.append((i, serializer))
+                continue
+            status = self.BATCH_STATUS_DUPLICATE if is_duplicate_error(serializer.errors) else self.BATCH_STATUS_INVALID
+            results[i] = {'status': status, 'errors': serializer.errors}
+
+        duplicates = self.find_batch_duplicates(valid_items)
+        for i in duplicates:
+            results[i] = {'status': self.BATCH_STATUS_DUPLICATE, 'errors': {'detail': 'duplicate unique key'}}
+        valid_items = [(i, s) for i, s in valid_items if i not in duplicates]
+
+        with transaction.atomic():
+            instances = self.get_serializer().bulk_create([s.validated_data for _, s in valid_items])
+            county = getattr(self.request, COUNTY_BASE_ENDPOINT_PARAM, None)
+            bump_county_generation_on_commit(county and county.get('id'))
+        for (i, _), instance in zip(valid_items, instances):
+            results[i] = {'status': self.BATCH_STATUS_CREATED, 'id': instance.pk}
+
+        summary = {status: 0 for status in (self.BATCH_STATUS_CREATED, self.BATCH_STATUS_DUPLICATE,
+                                            self.BATCH_STATUS_INVALID)}
+        for r in results:
+            summary[r['status']] += 1
+        return Response({'summary': summary, 'results': results})
+
+
+class BatchLookupViewMixin(object):
+    """
+    add a "lookup" rest api which returns objects of a list of batch_lookup_field values in one query.
+    i.e: POST /api/v1/<county>/property/lookup ["R000123", "R000124"]
+    response has found objects as "results" and values which are not found as "missing".
+    """
+    batch_lookup_field = None
+    max_lookup_size = None
+
+    def get_max_lookup_size(self):
+        if self.max_lookup_size is not None:
+            return self.max_lookup_size
+        return settings.REST_FRAMEWORK.get('MAX_BATCH_SIZE_DEFAULT', 5000)
+
+    @list_route(methods=['post'], permission_classes=[LookupDjangoModelPermissions])
+    def lookup(self, request, *args, **kwargs):
+        values = request.data
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise serializers.ValidationError(
+                {'detail': 'Expected a list of {} values.'.format(self.batch_lookup_field)})
+        max_lookup_size = self.get_max_lookup_size()
+        if len(values) > max_lookup_size:
+            raise serializers.ValidationError({'detail': 'Maximum {} values are allowed.'.format(max_lookup_size)})
+
+        values = list(OrderedDict.fromkeys(values))
+        queryset = self.get_queryset().filter(**{'{}__in'.format(self.batch_lookup_field): values}).order_by('pk')
+        objects = list(queryset)
+        found = {getattr(obj, self.batch_lookup_field) for obj in objects}
+        return Response({
+            'results': self.get_serializer(objects, many=True).data,
+            'missing': [v for v in values if v not in found],
+        })
+
+
+class SearchViewMixin(object):
+    """
+    add a "search" rest api which returns objects matching all terms of "q" ordered by rank.
+    i.e: /api/v1/<county>/owner/search?q=smith john
+    searched fields and their indexes are defined in apps/prop/search.py.
+    results are ordered by rank, so only page pagination is supported.
+    """
+    search_query_param = 'q'
+
+    @list_route(methods=['get'])
+    def search(self, request, *args, **kwargs):
+        query = request.query_params.get(self.search_query_param)
+        if not search_terms(query):
+            raise serializers.ValidationError({self.search_query_param: 'This parameter is required.'})
+        paginator = self.paginator
+        if paginator and paginator.get_mode(request, self) == paginator.CURSOR_MODE:
+            raise serializers.ValidationError(
+                {paginator.mode_query_param: 'search results are ordered by rank, cursor pagination is not supported.'})
+        queryset = search_queryset(self.filter_queryset(self.get_queryset()), query)
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(queryset, many=True).data)
+
+
+class Echo(object):
+    """ file like object which returns written value (to be used by csv writer in streaming responses) """
+
+    def write(self, value):
+        return value
+
+
+def flatten_dict(data, prefix=''):
+    """ flatten nested dicts to "parent.child" keys. lists are encoded as json. """
+    result = {}
+    for k, v in data.items():
+        key = '{}{}'.format(prefix, k)
+        if isinstance(v, dict):
+            result.update(flatten_dict(v, prefix=key + '.'))
+        elif isinstance(v, (list, tuple)):
+            result[key] = JSONEncoder().encode(v)
+        else:
+            result[key] = v
+    return result
+
+
+class ExportViewMixin(object):
+    """
+    add an "export" rest api which streams all (filtered) objects of county as ndjson or csv.
+    i.e: /api/v1/<county>/account/export?export_format=csv&min_tax_year=2015
+    objects are read in chunks (server side cursor or keyset chunks if queryset has prefetch lookups)
+    and serialized chunk by chunk, so memory is flat regardless of number of objects.
+    """
+    EXPORT_FORMATS = ('ndjson', 'csv')
+    EXPORT_CHUNK_SIZE = 2000
+    export_format_query_param = 'export_format'
+
+    def iter_export_chunks(self, queryset):
+        queryset = queryset.order_by('pk')
+        if not queryset._prefetch_related_lookups:
+            objects = queryset.iterator(chunk_size=self.EXPORT_CHUNK_SIZE)
+            while True:
+                chunk = list(islice(objects, self.EXPORT_CHUNK_SIZE))
+                if not chunk:
+                    return
+                yield chunk
+        # iterator() ignores prefetch_related, so we read keyset chunks
+        last_pk = None
+        while True:
+            qs = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            chunk = list(qs[:self.EXPORT_CHUNK_SIZE])
+            if not chunk:
+                return
+            yield chunk
+            last_pk = chunk[-1].pk
+
+    def iter_export_rows(self, queryset):
+        for chunk in self.iter_export_chunks(queryset):
+            for row in self.get_serializer(chunk, many=True).data:
+                yield row
+
+    def iter_ndjson(self, rows):
+        encoder = JSONEncoder()
+        for row in rows:
+            yield encoder.encode(row) + '\n'
+
+    def iter_csv(self, rows):
+        writer = None
+        for row in rows:
+            row = flatten_dict(row)
+            if writer is None:
+                writer = csv.DictWriter(Echo(), fieldnames=list(row.keys()), extrasaction='ignore')
+                # writeheader does not return written value before python 3.8
+                yield writer.writerow({f: f for f in writer.fieldnames})
+            yield writer.writerow(row)
+
+    @list_route(methods=['get'])
+    def export(self, request, *args, **kwargs):
+        export_format = request.query_params.get(self.export_format_query_param) or self.EXPORT_FORMATS[0]
+        if export_format not in self.EXPORT_FORMATS:
+            raise serializers.ValidationError(
+                {self.export_format_query_param: 'valid values are: {}'.format(', '.join(self.EXPORT_FORMATS))})
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = self.iter_export_rows(queryset)
+        if export_format == 'csv':
+            response = StreamingHttpResponse(self.iter_csv(rows), content_type='text/csv')
+        else:
+            response = StreamingHttpResponse(self.iter_ndjson(rows), content_type='application/x-ndjson')
+        county = getattr(request, COUNTY_BASE_ENDPOINT_PARAM, None) or {}
+        response['Content-Disposition'] = 'attachment; filename="{}-{}.{}"'.format(
+            county.get('name'), queryset.model._meta.model_name, export_format)
+        return response
+
 
 class HistoricalViewMixin(object):
+    """
+    add a "history" rest api which returns versions of an object (newest first).
+    it is cursor paginated by version id (see CustomPagination) and "diff=true" returns changed fields
+    of every version (compared to its previous version) instead of whole object.
+    versions never change, so decoded versions are cached by version id.
+    """
     MAX_HISTORY_RECORDS_NUM = 100
+    HISTORY_CACHE_KEY = 'version-fields-{}'
+    HISTORY_CACHE_TIMEOUT = 7 * 24 * 3600
+    diff_query_param = 'diff'
 
     def get_history_filters_by_params(self, request, queryset):
         params = request.query_params
@@ -169,22 +523,50 @@ class HistoricalViewMixin(object):
 
         return queryset.filter(**query_args)
 
+    def get_version_fields(self, versions):
+        """ {version id: fields} of versions. serialized data is loaded and decoded only for versions not in cache. """
+        keys = {v.pk: self.HISTORY_CACHE_KEY.format(v.pk) for v in versions}
+        cached = cache.get_many(list(keys.values()))
+        result = {pk: cached[key] for pk, key in keys.items() if key in cached}
+        missing = [pk for pk in keys if pk not in result]
+        if missing:
+            decoded = {pk: json.loads(data)[0]['fields']
+                       for pk, data in Version.objects.filter(pk__in=missing).values_list('pk', 'serialized_data')}
+            cache.set_many({keys[pk]: fields for pk, fields in decoded.items()}, self.HISTORY_CACHE_TIMEOUT)
+            result.update(decoded)
+        return result
+
+    @staticmethod
+    def diff_fields(old, new):
+        old = old or {}
+        return {k: {'old': old.get(k), 'new': new.get(k)}
+                for k in sorted(set(old) | set(new)) if old.get(k) != new.get(k)}
+
     @detail_route(methods=['get'])
     def history(self, request, *args, **kwargs):
         instance = self.get_object()
-        queryset = Version.objects.get_for_object(instance)
-        queryset = self.get_history_filters_by_params(request, queryset)
+        queryset = Version.objects.get_for_object(instance).select_related('revision').defer('serialized_data')
+        queryset = self.get_history_filters_by_params(request, queryset).order_by('-id')
+        diff = request.query_params.get(self.diff_query_param, '').lower() in ('true', '1', 'yes')
+
+        paginator = self.paginator
+        paginator.page_size = paginator.max_page_size = self.MAX_HISTORY_RECORDS_NUM
+        paginator.mode = paginator.CURSOR_MODE
+        versions = paginator.paginate_queryset_by_cursor(queryset, request, view=self)
+        # previous version of last one is needed for its diff
+        previous = queryset.filter(id__lt=versions[-1].id).first() if diff and versions else None
+        fields = self.get_version_fields(versions + ([previous] if previous else []))
 
         result = []
-        for h in queryset[:self.MAX_HISTORY_RECORDS_NUM]:
-            json_data = h.serialized_data
-            obj = json.loads(json_data)[0]["fields"]
-            result.append({
-                'object': obj,
-                'id': h.pk,
-                'date': h.revision.date_created
-            })
-        return Response(result)
+        for i, h in enumerate(versions):
+            item = {'id': h.pk, 'date': h.revision.date_created}
+            if diff:
+                older = versions[i + 1] if i + 1 < len(versions) else previous
+                item['changes'] = self.diff_fields(older and fields[older.pk], fields[h.pk])
+            else:
+                item['object'] = fields[h.pk]
+            result.append(item)
+        return paginator.get_paginated_response(result)
 
 
 class CountyView(viewsets.ReadOnlyModelViewSet):
@@ -207,29 +589,33 @@ def get_ordering_fields(model):
     return [f.name for f in model._meta.fields if f.name != 'county']
 
 
-class PropertyView(CountyViewSetMixin, viewsets.ModelViewSet, HistoricalViewMixin):
+class PropertyView(CountyViewSetMixin, CountyConditionalGetMixin, CountyResponseCacheMixin,
+                   BatchCreateViewMixin, BatchLookupViewMixin, ExportViewMixin, viewsets.ModelViewSet,
+                   HistoricalViewMixin):
     """ rest api Property resource. """
 
     queryset = Property.objects.all()
     serializer_class = PropertySerializer
+    batch_lookup_field = 'parid'
     ordering_fields = get_ordering_fields(Property)
     ordering = 'id'
     filter_class = PropertyFilter
 
-    @list_route(filter_class=PropertyTaxTypeSummaryFilter, queryset=Account.objects,
+    @list_route(filter_class=PropertyTaxTypeSummaryFilter, queryset=AccountTaxTypeSummary.objects,
                 url_path='(?P<pk>[0-9]+)/tax_type_summary', ordering_fields=['tax_year', 'amounts', 'tax_type'])
     def tax_type_summary(self, request, *args, **kwargs):
         prop_queryset = self.county_filter(Property.objects.all())
         prop = get_object_or_404(prop_queryset, pk=self.kwargs['pk'])
         self.check_object_permissions(self.request, prop)
 
-        qs = prop.account_set.values('tax_type', 'tax_year').annotate(amounts=Sum('amount'))
+        qs = prop.accounttaxtypesummary_set.values('tax_type', 'tax_year').annotate(amounts=Sum('amount'))
         filtered_qs = self.filter_queryset(qs)
         results = [r for r in filtered_qs]
         return Response(results)
 
 
-class OwnerView(CountyViewSetMixin, viewsets.ModelViewSet, HistoricalViewMixin):
+class OwnerView(CountyViewSetMixin, CountyConditionalGetMixin, CountyResponseCacheMixin,
+                BatchCreateViewMixin, SearchViewMixin, ExportViewMixin, viewsets.ModelViewSet, HistoricalViewMixin):
     """ rest api Owner resource. """
 
     queryset = Owner.objects.all()
@@ -239,7 +625,8 @@ class OwnerView(CountyViewSetMixin, viewsets.ModelViewSet, HistoricalViewMixin):
     ordering_fields = get_ordering_fields(Owner)
 
 
-class OwnerAddressView(CountyViewSetMixin, viewsets.ModelViewSet, HistoricalViewMixin):
+class OwnerAddressView(CountyViewSetMixin, CountyConditionalGetMixin, CountyResponseCacheMixin,
+                       SearchViewMixin, ExportViewMixin, viewsets.ModelViewSet, HistoricalViewMixin):
     """ rest api OwnerAddress resource. """
 
     queryset = OwnerAddress.objects.all()
@@ -250,7 +637,8 @@ class OwnerAddressView(CountyViewSetMixin, viewsets.ModelViewSet, HistoricalView
     ordering = 'id'
 
 
-class PropertyAddressView(CountyViewSetMixin, viewsets.ModelViewSet, HistoricalViewMixin):
+class PropertyAddressView(CountyViewSetMixin, CountyConditionalGetMixin, CountyResponseCacheMixin,
+                          SearchViewMixin, ExportViewMixin, viewsets.ModelViewSet, HistoricalViewMixin):
     """ rest api PropertyAddress resource. """
 
     queryset = PropertyAddress.objects.all()
@@ -261,7 +649,8 @@ class PropertyAddressView(CountyViewSetMixin, viewsets.ModelViewSet, HistoricalV
     ordering = 'id'
 
 
-class AccountView(CountyViewSetMixin, viewsets.ModelViewSet):
+class AccountView(CountyViewSetMixin, CountyConditionalGetMixin, CountyResponseCacheMixin,
+                  BatchCreateViewMixin, ExportViewMixin, viewsets.ModelViewSet):
     """ rest api Account resource. """
 
     queryset = Account.objects.all()
@@ -269,16 +658,20 @@ class AccountView(CountyViewSetMixin, viewsets.ModelViewSet):
     ordering_fields = get_ordering_fields(Account)
     filter_class = AccountFilter
     ordering = 'id'
+    count_strategy = 'estimated'
 
-    @list_route(filter_class=AccountTaxTypeSummaryFilter, ordering_fields=['amounts', 'tax_type'])
+    @list_route(filter_class=AccountTaxTypeSummaryFilter, queryset=AccountTaxTypeSummary.objects,
+                ordering_fields=['amounts', 'tax_type'], ordering='tax_type')
     def tax_type_summary(self, request, *args, **kwargs):
+        # summary rows are maintained on account changes (see AccountTaxTypeSummary)
         qs = self.get_queryset().values('tax_type').annotate(amounts=Sum('amount'))
         filtered_qs = self.filter_queryset(qs)
         results = [r for r in filtered_qs]
         return Response(results)
 
 
-class LienAuctionView(CountyViewSetMixin, viewsets.ModelViewSet):
+class LienAuctionView(CountyViewSetMixin, CountyConditionalGetMixin, CountyResponseCacheMixin,
+                      BatchCreateViewMixin, ExportViewMixin, viewsets.ModelViewSet):
     """ rest api LienAuction resource. """
 
     queryset = LienAuction.objects.all()
@@ -286,3 +679,116 @@ class LienAuctionView(CountyViewSetMixin, viewsets.ModelViewSet):
     ordering_fields = get_ordering_fields(LienAuction)
     filter_class = LienAuctionFilter
     ordering = 'id'
+
+
+class ChangeFeedView(CountyViewSetMixin, viewsets.GenericViewSet):
+    """
+    rest api of inserted, updated and deleted county objects in commit order.
+    i.e: /<county>/api/v1/changes?since=<next_since of previous response>&models=property,owner
+    every change has current data of its object (null if object is deleted).
+    a "purge" change has no object, consumers should drop objects of its model and county
+    (of tax years before its object_id if it is not 0) and read them again (see ChangeLog).
+    "since" is a "<transaction_id>.<id>" cursor of change logs (see ChangeLog), changes of running
+    transactions are returned after they are finished, so a cursor never skips a change.
+    changes of models which user has not view permission of are not returned.
+    """
+
+    queryset = ChangeLog.objects.all()
+    pagination_class = None
+    filter_backends = ()
+    # change logs are not serialized, objects of changes are optimized in get_objects_data
+    optimize_actions = ()
+    since_query_param = 'since'
+    models_query_param = 'models'
+    page_size_query_param = 'page_size'
+    PAGE_SIZE = 500
+    MAX_PAGE_SIZE = 5000
+    model_serializers = {
+        'property': PropertySerializer,
+        'owner': OwnerSerializer,
+        'propertyaddress': PropertyAddressSerializer,
+        'owneraddress': OwnerAddressSerializer,
+        'account': AccountSerializer,
+        'lienauction': LienAuctionSerializer,
+    }
+
+    def get_int_param(self, name, default, max_value=None):
+        try:
+            value = int(self.request.query_params.get(name, default))
+        except ValueError:
+            raise serializers.ValidationError({name: 'A valid integer is required.'})
+        if value < 0:
+            raise serializers.ValidationError({name: 'Ensure this value is greater than or equal to 0.'})
+        return min(value, max_value) if max_value else value
+
+    def get_since(self):
+        """ (transaction_id, id) of since cursor """
+        since = self.request.query_params.get(self.since_query_param) or '0'
+        if since == '0':
+            return 0, 0
+        try:
+            transaction_id, change_id = (int(v) for v in since.split('.'))
+        except ValueError:
+            raise serializers.ValidationError({self.since_query_param: 'A valid cursor is required.'})
+        if transaction_id < 0 or change_id < 0:
+            raise serializers.ValidationError({self.since_query_param: 'A valid cursor is required.'})
+        return transaction_id, change_id
+
+    def get_allowed_models(self):
+        """ models which user can view (changes have data of objects) """
+        user = self.request.user
+        return [m for m in self.model_serializers if user.has_perm('prop.view_{}'.format(m))]
+
+    def get_objects_data(self, changes):
+        """ {(model_name, object_id): data} of current objects of changes """
+        ids = {}
+        for change in changes:
+            if change.action != ChangeLog.ACTION_PURGE:
+                ids.setdefault(change.model_name, set()).add(change.object_id)
+        result = {}
+        for model_name, object_ids in ids.items():
+            serializer_class = self.model_serializers[model_name]
+            context = self.get_serializer_context()
+            queryset = self.county_filter(serializer_class.Meta.model.objects.filter(pk__in=object_ids))
+            objects = list(optimize_queryset(queryset, serializer_class(context=context)))
+            data = serializer_class(objects, many=True, context=context).data
+            result.update({(model_name, obj.pk): d for obj, d in zip(objects, data)})
+        return result
+
+    def list(self, request, *args, **kwargs):
+        transaction_id, change_id = self.get_since()
+        page_size = self.get_int_param(self.page_size_query_param, self.PAGE_SIZE, self.MAX_PAGE_SIZE) or \
+            self.PAGE_SIZE
+        queryset = ChangeLog.committed(self.get_queryset()).filter(
+            Q(transaction_id__gt=transaction_id) | Q(transaction_id=transaction_id, id__gt=change_id))
+        queryset = queryset.order_by('transaction_id', 'id')
+        allowed = self.get_allowed_models()
+        models = request.query_params.get(self.models_query_param)
+        if models:
+            models = models.split(',')
+            invalid = set(models) - set(self.model_serializers)
+            if invalid:
+                raise serializers.ValidationError({self.models_query_param: 'valid values are: {}'.format(
+                    ', '.join(sorted(self.model_serializers)))})
+            if set(models) - set(allowed):
+                raise exceptions.PermissionDenied()
+        queryset = queryset.filter(model_name__in=models or allowed)
+
+        changes = list(queryset[:page_size + 1])
+        has_more = len(changes) > page_size
+        changes = changes[:page_size]
+        objects_data = self.get_objects_data(changes)
+        return Response({
+            'next_since': '{}.{}'.format(*((changes[-1].transaction_id, changes[-1].id) if changes else
+                                           (transaction_id, change_id))),
+            'has_more': has_more,
+            'results': [{
+                'id': change.id,
+                'model': change.model_name,
+                'object_id': change.object_id,
+                'action': change.action,
+                'timestamp': change.timestamp,
+                'data': objects_data.get((change.model_name, change.object_id))
+                if change.action != ChangeLog.ACTION_PURGE else None,
+            } for change in changes]
+        })
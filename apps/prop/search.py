@@ -0,0 +1,125 @@
+"""
+full-text/trigram search of county objects.
+postgresql uses GIN indexes of a "simple" tsvector and pg_trgm (see migration 0003),
+sqlite uses FTS5 tables which are kept in sync by triggers, other databases fall back to icontains.
+notice: sqlite migrations which remake one of SEARCH_TABLES (i.e. AlterField) drop its triggers,
+so they should run sqlite_drop_fts_sql/sqlite_fts_sql of the table again.
+"""
+import re
+from functools import reduce
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# table: (searched fields, trigram field)
+SEARCH_TABLES = {
+    'prop_owner': (('name', 'other'), 'name'),
+    'prop_owneraddress': (('street1', 'street2'), 'street1'),
+    'prop_propertyaddress': (('street1', 'street2'), 'street1'),
+}
+MAX_SEARCH_TERMS = 8
+
+
+def search_terms(query):
+    return re.findall(r'\w+', query or '')[:MAX_SEARCH_TERMS]
+
+
+def search_vector_sql(fields, table=None):
+    """ tsvector expression of fields. it must be same in index and queries to use the index. """
+    columns = ['"{}"."{}"'.format(table, f) if table else f for f in fields]
+    return "to_tsvector('simple'::regconfig, {})".format(
+        " || ' ' || ".join("coalesce({}, '')".format(c) for c in columns))
+
+
+def fts_table(table):
+    return '{}_fts'.format(table)
+
+
+def postgresql_index_sql(table):
+    fields, trigram_field = SEARCH_TABLES[table]
+    return [
+        'CREATE INDEX IF NOT EXISTS {0}_search_tsv ON {0} USING gin (({1}))'.format(table, search_vector_sql(fields)),
+        'CREATE INDEX IF NOT EXISTS {0}_{1}_trgm ON {0} USING gin ({1} gin_trgm_ops)'.format(table, trigram_field),
+    ]
+
+
+def postgresql_drop_index_sql(table):
+    _, trigram_field = SEARCH_TABLES[table]
+    return [
+        'DROP INDEX IF EXISTS {}_search_tsv'.format(table),
+        'DROP INDEX IF EXISTS {}_{}_trgm'.format(table, trigram_field),
+    ]
+
+
+def sqlite_fts_sql(table):
+    """ external content FTS5 table of fields and triggers which keep it in sync with table """
+    fields, _ = SEARCH_TABLES[table]
+    fts = fts_table(table)
+    columns = ', '.join(fields)
+    new_values = ', '.join('new.{}'.format(f) for f in fields)
+    old_values = ', '.join('old.{}'.format(f) for f in fields)
+    insert = 'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values});'
+    delete = "INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values});"
+    sql = [
+        "CREATE VIRTUAL TABLE {fts} USING fts5({columns}, content='{table}', content_rowid='id')",
+        'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN ' + insert + ' END',
+        'CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN ' + delete + ' END',
+        'CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN ' + delete + ' ' + insert + ' END',
+        "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ]
+    return [s.format(fts=fts, table=table, columns=columns, new_values=new_values, old_values=old_values)
+            for s in sql]
+
+
+def sqlite_drop_fts_sql(table):
+    fts = fts_table(table)
+    return ['DROP TRIGGER IF EXISTS {}_{}'.format(fts, t) for t in ('ai', 'ad', 'au')] + \
+           ['DROP TABLE IF EXISTS {}'.format(fts)]
+
+
+def has_fts_table(connection, table):
+    cache = connection.__dict__.setdefault('_fts_tables', {})
+    if table not in cache:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [fts_table(table)])
+            cache[table] = cursor.fetchone() is not None
+    return cache[table]
+
+
+def search_queryset(queryset, query):
+    """
+    filter queryset by search query and order it by rank (as "search_rank" annotation).
+    all terms of query should be matched (last term as prefix).
+    """
+    terms = search_terms(query)
+    table = queryset.model._meta.db_table
+    fields, trigram_field = SEARCH_TABLES[table]
+    connection = connections[queryset.db]
+    if not terms:
+        return queryset.none()
+
+    if connection.vendor == 'postgresql':
+        vector = search_vector_sql(fields, table)
+        tsquery = ' & '.join(terms) + ':*'
+        trigram_column = '"{}"."{}"'.format(table, trigram_field)
+        text = ' '.join(terms)
+        queryset = queryset.extra(
+            where=["({} @@ to_tsquery('simple', %s) OR {} %% %s)".format(vector, trigram_column)],
+            params=[tsquery, text])
+        rank = RawSQL("ts_rank({}, to_tsquery('simple', %s)) + similarity({}, %s)".format(vector, trigram_column),
+                      [tsquery, text], output_field=FloatField())
+    elif connection.vendor == 'sqlite' and has_fts_table(connection, table):
+        fts = fts_table(table)
+        match = ' '.join('"{}"'.format(t) for t in terms) + '*'
+        queryset = queryset.extra(where=['"{1}"."id" IN (SELECT rowid FROM {0} WHERE {0} MATCH %s)'.format(fts, table)],
+                                  params=[match])
+        # fts5 rank is bm25 (lower is better)
+        rank = RawSQL('SELECT -rank FROM {0} WHERE {0} MATCH %s AND rowid = "{1}"."id"'.format(fts, table), [match],
+                      output_field=FloatField())
+    else:
+        conditions = [reduce(lambda a, b: a | b, (Q(**{'{}__icontains'.format(f): t}) for f in fields))
+                      for t in terms]
+        queryset = queryset.filter(*conditions)
+        rank = Value(0, output_field=FloatField())
+    return queryset.annotate(search_rank=rank).order_by('-search_rank', 'pk')
@@ -1,3 +1,803 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import time
+from contextlib import redirect_stdout
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils.http import http_date
+from rest_framework.request import Request
+from reversion import revisions as reversion
+from reversion.models import Version
+from rest_framework.test import APIClient, APIRequestFactory
+
+from apps.prop.middleware import COUNTY_CACHE_GENERATION_KEY, COUNTY_MODIFIED_CACHE_KEY, LocalCountyCache, \
+    bump_county_generation, clear_county_cached, get_county_generation
+from apps.prop.models import Account, AccountTaxTypeSummary, ChangeLog, County, Owner, OwnerAddress, Property, \
+    PropertyAddress
+from apps.prop import partitions, search
+from apps.prop.rest_api.views import ExportViewMixin, PropertyView
+from project.helpers.utils import CustomPagination
+
+
+class CountyApiTestCase(TransactionTestCase):
+    """
+    base of rest api tests of a county (requests of a superuser).
+    county generation is changed on commit (see bump_county_generation_on_commit),
+    so tests are not run in a transaction.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.county = County.objects.create(name='test')
+        self.user = User.objects.create_superuser('test', 'test@example.com', 'test')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def url(self, path):
+        return '/{}/api/v1/{}'.format(self.county.name, path)
+
+    def get(self, path, **params):
+        return self.client.get(self.url(path), params)
+
+    def create_properties(self, count):
+        return [Property.objects.create(county=self.county, parid='P{:03d}'.format(i)) for i in range(count)]
+
+    def account_data(self, prop, **data):
+        return dict({'property': prop.id, 'tax_year': 2016, 'tax_type': 'Tax', 'effective_date': '2016-01-01',
+                     'amount': '10.00', 'balance': '5.00'}, **data)
+
+    def create_account(self, prop, **data):
+        data = dict(self.account_data(prop, **data), property=prop, county=self.county)
+        return Account.objects.create(**data)
+
+    def create_owners(self, props):
+        """ an owner of every property with two addresses """
+        owners = []
+        for i, prop in enumerate(props):
+            PropertyAddress.objects.create(county=self.county, property=prop, street1='{} main'.format(i))
+            owner = Owner.objects.create(county=self.county, name='owner {}'.format(i))
+            owner.properties.add(prop)
+            for street in ('elm', 'oak'):
+                OwnerAddress.objects.create(county=self.county, owner=owner, street1='{} {}'.format(i, street))
+            owners.append(owner)
+        return owners
+
+
+class CursorPaginationTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(CursorPaginationTest, self).setUp()
+        self.ids = [p.id for p in self.create_properties(5)]
+
+    def get_page(self, **params):
+        response = self.get('property', pagination='cursor', page_size=2, **params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['pagination'], [r['id'] for r in response.data['results']]
+
+    def test_next_and_previous(self):
+        pagination, ids = self.get_page()
+        self.assertEqual(ids, self.ids[:2])
+        self.assertIsNone(pagination['previous_cursor'])
+        pagination, ids = self.get_page(cursor=pagination['next_cursor'])
+        self.assertEqual(ids, self.ids[2:4])
+        previous_cursor = pagination['previous_cursor']
+        pagination, ids = self.get_page(cursor=pagination['next_cursor'])
+        self.assertEqual(ids, self.ids[4:])
+        self.assertIsNone(pagination['next_cursor'])
+        pagination, ids = self.get_page(cursor=previous_cursor)
+        self.assertEqual(ids, self.ids[:2])
+
+    def test_descending_ordering(self):
+        pagination, ids = self.get_page(ordering='-id')
+        self.assertEqual(ids, self.ids[::-1][:2])
+        pagination, ids = self.get_page(ordering='-id', cursor=pagination['next_cursor'])
+        self.assertEqual(ids, self.ids[::-1][2:4])
+
+    def test_rejected_ordering(self):
+        response = self.get('property', pagination='cursor', ordering='parid')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.data)
+
+    def test_invalid_cursor(self):
+        response = self.get('property', cursor='invalid')
+        self.assertEqual(response.status_code, 404)
+
+    def test_direct_page_size(self):
+        """ paginate_queryset_by_cursor validates page size without paginate_queryset """
+        request = Request(APIRequestFactory().get('/', {'page_size': 0}))
+        paginator = CustomPagination()
+        paginator.page_size = None
+        rows = paginator.paginate_queryset_by_cursor(Property.objects.order_by('id'), request)
+        self.assertEqual([p.id for p in rows], self.ids)
+        paginator.max_page_size = 3
+        request = Request(APIRequestFactory().get('/', {'page_size': 1000}))
+        rows = paginator.paginate_queryset_by_cursor(Property.objects.order_by('id'), request)
+        self.assertEqual([p.id for p in rows], self.ids[:3])
+        self.assertIsNotNone(paginator.next_cursor)
+
+
+class CountStrategyTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(CountStrategyTest, self).setUp()
+        self.prop = self.create_properties(1)[0]
+        for _ in range(3):
+            self.create_account(self.prop)
+
+    def get_pagination(self, **params):
+        response = self.get('account', **params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['pagination'], len(response.data['results'])
+
+    def test_count_false(self):
+        pagination, results = self.get_pagination(count='false')
+        self.assertIsNone(pagination['count'])
+        self.assertIsNone(pagination['last_page'])
+        self.assertEqual(results, 3)
+
+    def test_cached_count_after_insert(self):
+        pagination, _ = self.get_pagination()
+        self.assertEqual(pagination['count'], 3)
+        self.assertFalse(pagination['count_estimated'])
+        response = self.client.post(self.url('account/batch'), [self.account_data(self.prop)], format='json')
+        self.assertEqual(response.data['summary']['created'], 1)
+        pagination, results = self.get_pagination()
+        self.assertEqual(pagination['count'], 4)
+        self.assertEqual(results, 4)
+
+    def test_stale_count_does_not_truncate_page(self):
+        pagination, _ = self.get_pagination(page_size=50)
+        self.assertEqual(pagination['count'], 3)
+        # bulk_create does not send signals, so the county generation (and the cached count) is not changed
+        Account.objects.bulk_create([Account(county=self.county, property=self.prop, tax_year=2016, tax_type='Tax',
+                                             effective_date=datetime.date(2016, 1, 1), amount=Decimal('1.00'),
+                                             balance=Decimal('0.00'))])
+        _, results = self.get_pagination(page_size=40)
+        self.assertEqual(results, 4)
+
+
+class TaxTypeSummaryTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(TaxTypeSummaryTest, self).setUp()
+        self.prop = self.create_properties(1)[0]
+
+    def get_summary(self):
+        """ {(tax_year, tax_type): (amount, balance, count)} of property """
+        return {(s.tax_year, s.tax_type): (s.amount, s.balance, s.count)
+                for s in AccountTaxTypeSummary.objects.filter(property=self.prop)}
+
+    def test_create_update_delete(self):
+        response = self.client.post(self.url('account'), self.account_data(self.prop), format='json')
+        self.assertEqual(response.status_code, 201)
+        account_url = self.url('account/{}'.format(response.data['id']))
+        self.client.post(self.url('account'), self.account_data(self.prop, amount='2.50', balance='0'), format='json')
+        self.assertEqual(self.get_summary(), {(2016, 'Tax'): (Decimal('12.50'), Decimal('5.00'), 2)})
+
+        response = self.client.patch(account_url, {'amount': '20.00'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_summary(), {(2016, 'Tax'): (Decimal('22.50'), Decimal('5.00'), 2)})
+
+        self.client.patch(account_url, {'tax_type': 'Interest'}, format='json')
+        self.assertEqual(self.get_summary(), {(2016, 'Tax'): (Decimal('2.50'), Decimal('0.00'), 1),
+                                              (2016, 'Interest'): (Decimal('20.00'), Decimal('5.00'), 1)})
+
+        response = self.client.delete(account_url)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_summary(), {(2016, 'Tax'): (Decimal('2.50'), Decimal('0.00'), 1)})
+
+    def test_unchanged_string_amount(self):
+        account = self.create_account(self.prop, amount='2.50')
+        account.amount = '2.50'
+        account.save()
+        self.assertEqual(self.get_summary(), {(2016, 'Tax'): (Decimal('2.50'), Decimal('5.00'), 1)})
+
+    def test_batch(self):
+        self.create_account(self.prop)
+        data = [self.account_data(self.prop, amount='1.00'), self.account_data(self.prop, tax_year=2017)]
+        response = self.client.post(self.url('account/batch'), data, format='json')
+        self.assertEqual(response.data['summary']['created'], 2)
+        self.assertEqual(self.get_summary(), {(2016, 'Tax'): (Decimal('11.00'), Decimal('10.00'), 2),
+                                              (2017, 'Tax'): (Decimal('10.00'), Decimal('5.00'), 1)})
+
+
+class ChangeFeedTest(CountyApiTestCase):
+
+    def get_changes(self, **params):
+        response = self.get('changes', **params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_since_and_has_more(self):
+        props = self.create_properties(3)
+        data = self.get_changes(page_size=2)
+        self.assertTrue(data['has_more'])
+        self.assertEqual([(c['model'], c['object_id'], c['action']) for c in data['results']],
+                         [('property', p.id, 'insert') for p in props[:2]])
+        self.assertEqual(data['results'][0]['data']['parid'], 'P000')
+        data = self.get_changes(page_size=2, since=data['next_since'])
+        self.assertFalse(data['has_more'])
+        self.assertEqual([c['object_id'] for c in data['results']], [props[2].id])
+        since = data['next_since']
+        data = self.get_changes(since=since)
+        self.assertEqual((data['results'], data['has_more'], data['next_since']), ([], False, since))
+
+        deleted_id = props[1].id
+        props[0].parid = 'P100'
+        props[0].save()
+        props[1].delete()
+        data = self.get_changes(since=since)
+        self.assertEqual([(c['object_id'], c['action']) for c in data['results']],
+                         [(props[0].id, 'update'), (deleted_id, 'delete')])
+        self.assertEqual(data['results'][0]['data']['parid'], 'P100')
+        self.assertIsNone(data['results'][1]['data'])
+
+    def test_rolled_back_changes(self):
+        try:
+            with transaction.atomic():
+                self.create_properties(1)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self.get_changes()['results'], [])
+
+    def test_models(self):
+        prop = self.create_properties(1)[0]
+        self.create_account(prop)
+        data = self.get_changes(models='account')
+        self.assertEqual([c['model'] for c in data['results']], ['account'])
+        response = self.get('changes', models='account,unknown')
+        self.assertEqual(response.status_code, 400)
+
+    def test_view_permissions(self):
+        prop = self.create_properties(1)[0]
+        self.create_account(prop)
+        self.user.is_superuser = False
+        self.user.save()
+        perms = ('prop.view_changelog', 'prop.view_property')
+        with mock.patch.object(User, 'has_perm', lambda user, perm, obj=None: perm in perms):
+            data = self.get_changes()
+            self.assertEqual([c['model'] for c in data['results']], ['property'])
+            response = self.get('changes', models='account')
+            self.assertEqual(response.status_code, 403)
+
+    def test_invalid_since(self):
+        for since in ('x', '1', '1.x', '-1.0'):
+            response = self.get('changes', since=since)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('since', response.data)
+
+
+class HistoryTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(HistoryTest, self).setUp()
+        self.prop = self.create_properties(1)[0]
+        self.url_path = 'property/{}/history'.format(self.prop.id)
+
+    def save_versions(self, parids):
+        for parid in parids:
+            with reversion.create_revision():
+                self.prop.parid = parid
+                self.prop.save()
+
+    def get_history(self, **params):
+        response = self.get(self.url_path, **params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['pagination'], response.data['results']
+
+    def test_page_size_limit(self):
+        limit = PropertyView.MAX_HISTORY_RECORDS_NUM
+        self.save_versions('V{}'.format(i) for i in range(limit + 2))
+        for page_size in (0, limit + 1000):
+            pagination, results = self.get_history(page_size=page_size)
+            self.assertEqual(len(results), limit)
+            self.assertEqual(pagination['page_size'], limit)
+            self.assertEqual(results[0]['object']['parid'], 'V{}'.format(limit + 1))
+        pagination, results = self.get_history(cursor=pagination['next_cursor'])
+        self.assertEqual([r['object']['parid'] for r in results], ['V1', 'V0'])
+        self.assertIsNone(pagination['next_cursor'])
+
+    def test_diff_and_cursor(self):
+        self.save_versions(['A', 'B', 'C'])
+        pagination, results = self.get_history(page_size=2, diff='true')
+        self.assertEqual([r['changes']['parid'] for r in results],
+                         [{'old': 'B', 'new': 'C'}, {'old': 'A', 'new': 'B'}])
+        pagination, results = self.get_history(page_size=2, diff='true', cursor=pagination['next_cursor'])
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['changes']['parid'], {'old': None, 'new': 'A'})
+        self.assertIsNone(pagination['next_cursor'])
+        pagination, results = self.get_history(page_size=2, cursor=pagination['previous_cursor'])
+        self.assertEqual([r['object']['parid'] for r in results], ['C', 'B'])
+
+
+class BatchCreateTest(CountyApiTestCase):
+    ADDRESS = {'street1': '1 main', 'city': 'denver', 'state': 'CO', 'zipcode': '80000'}
+
+    def post_batch(self, resource, items):
+        response = self.client.post(self.url('{}/batch'.format(resource)), items, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def assertLogged(self, model, objects):
+        """ every object has a version and an insert change log """
+        for obj in objects:
+            self.assertEqual(Version.objects.get_for_object(obj).count(), 1)
+        ids = [o.pk for o in objects]
+        changes = ChangeLog.objects.filter(model_name=model._meta.model_name, object_id__in=ids)
+        self.assertEqual(sorted(changes.values_list('object_id', 'action')),
+                         sorted((pk, ChangeLog.ACTION_INSERT) for pk in ids))
+
+    def test_statuses(self):
+        self.create_properties(1)
+        data = self.post_batch('property', [
+            {'parid': 'P100', 'address': self.ADDRESS},
+            {'parid': 'P000'},
+            {'parid': 'P101'},
+            {'parid': 'P100'},
+            {'address': self.ADDRESS},
+        ])
+        self.assertEqual(data['summary'], {'created': 2, 'duplicate': 2, 'invalid': 1})
+        self.assertEqual([r['status'] for r in data['results']],
+                         ['created', 'duplicate', 'created', 'duplicate', 'invalid'])
+        created = Property.objects.filter(parid__in=['P100', 'P101']).order_by('parid')
+        self.assertEqual([r['id'] for r in data['results'] if r['status'] == 'created'], [p.pk for p in created])
+        self.assertEqual(PropertyAddress.objects.get().property_id, created[0].pk)
+        self.assertLogged(Property, created)
+        self.assertLogged(PropertyAddress, PropertyAddress.objects.all())
+
+    def test_too_many_items(self):
+        with self.settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, MAX_BATCH_SIZE_DEFAULT=1)):
+            response = self.client.post(self.url('property/batch'), [{'parid': 'A'}, {'parid': 'B'}], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Property.objects.exists())
+
+    def test_owners(self):
+        props = self.create_properties(2)
+        data = self.post_batch('owner', [
+            {'name': 'owner 1', 'properties': [p.id for p in props],
+             'addresses': [self.ADDRESS, self.ADDRESS, dict(self.ADDRESS, street1='2 main')]},
+            {'name': 'owner 2', 'properties': [props[0].id]},
+        ])
+        self.assertEqual(data['summary'], {'created': 2, 'duplicate': 0, 'invalid': 0})
+        owners = list(Owner.objects.order_by('id'))
+        self.assertEqual([o.pk for o in owners], [r['id'] for r in data['results']])
+        self.assertEqual(sorted(owners[0].properties.values_list('id', flat=True)), [p.id for p in props])
+        self.assertEqual(list(owners[1].properties.values_list('id', flat=True)), [props[0].id])
+        self.assertEqual(sorted(owners[0].addresses.values_list('street1', flat=True)), ['1 main', '2 main'])
+        self.assertLogged(Owner, owners)
+        self.assertLogged(OwnerAddress, OwnerAddress.objects.all())
+
+    def test_county_generation(self):
+        generation = get_county_generation(self.county.id)
+        self.post_batch('property', [{'parid': 'P100'}])
+        self.assertGreater(get_county_generation(self.county.id), generation)
+
+
+class ExportTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.props = self.create_properties(5)
+        for i, prop in enumerate(self.props):
+            owner = Owner.objects.create(county=self.county, name='owner {}'.format(i))
+            owner.properties.add(prop)
+            OwnerAddress.objects.create(county=self.county, owner=owner, street1='{} main'.format(i), city='denver')
+        other = County.objects.create(name='other')
+        Property.objects.create(county=other, parid='P000')
+
+    def export(self, resource, **params):
+        response = self.get('{}/export'.format(resource), **params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def get_list(self, resource, **params):
+        response = self.get(resource, page_size=0, **params)
+        return json.loads(response.content.decode())['results']
+
+    def test_ndjson(self):
+        content = self.export('property', parid='P001')
+        self.assertEqual([json.loads(line) for line in content.splitlines()], self.get_list('property', parid='P001'))
+        content = self.export('property')
+        self.assertEqual([json.loads(line) for line in content.splitlines()], self.get_list('property'))
+
+    def test_keyset_chunks(self):
+        """ owners have prefetched addresses and properties, so they are read in keyset chunks """
+        with mock.patch.object(ExportViewMixin, 'EXPORT_CHUNK_SIZE', 2):
+            content = self.export('owner')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(rows, self.get_list('owner'))
+        self.assertEqual([r['addresses'][0]['street1'] for r in rows], ['{} main'.format(i) for i in range(5)])
+
+    def test_csv(self):
+        with mock.patch.object(ExportViewMixin, 'EXPORT_CHUNK_SIZE', 2):
+            content = self.export('owner', export_format='csv')
+        rows = list(csv.DictReader(content.splitlines()))
+        expected = self.get_list('owner')
+        self.assertEqual([r['name'] for r in rows], [o['name'] for o in expected])
+        self.assertEqual([json.loads(r['properties']) for r in rows], [o['properties'] for o in expected])
+        self.assertEqual(json.loads(rows[0]['addresses'])[0]['street1'], '0 main')
+
+    def test_invalid_format(self):
+        response = self.get('property/export', export_format='xml')
+        self.assertEqual(response.status_code, 400)
+
+    def test_permissions(self):
+        self.user.is_superuser = False
+        self.user.save()
+        with mock.patch.object(User, 'has_perm', lambda user, perm, obj=None: perm == 'prop.view_owner'):
+            self.assertEqual(self.get('property/export').status_code, 403)
+            self.assertEqual(self.get('owner/export').status_code, 200)
+
+
+class ResponseCacheTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(ResponseCacheTest, self).setUp()
+        self.prop = self.create_properties(1)[0]
+
+    def get_parid(self):
+        response = self.get('property/{}'.format(self.prop.id))
+        self.assertEqual(response.status_code, 200)
+        return response.data['parid']
+
+    def test_cached_until_generation_bump(self):
+        self.assertEqual(self.get_parid(), 'P000')
+        # queryset update does not send signals, so the county generation is not changed
+        Property.objects.filter(pk=self.prop.pk).update(parid='P100')
+        self.assertEqual(self.get_parid(), 'P000')
+        bump_county_generation(self.county.id)
+        self.assertEqual(self.get_parid(), 'P100')
+
+    def test_not_shared_by_permissions(self):
+        """ users with different permissions have different cached responses """
+        users_perms = {
+            'viewer': {'prop.view_property'},
+            'editor': {'prop.view_property', 'prop.change_property'},
+        }
+        users = [User.objects.create_user(username) for username in users_perms]
+
+        def get_all_permissions(user, obj=None):
+            return users_perms[user.username]
+
+        def has_perm(user, perm, obj=None):
+            return perm in users_perms[user.username]
+
+        with mock.patch.object(User, 'get_all_permissions', get_all_permissions), \
+                mock.patch.object(User, 'has_perm', has_perm):
+            self.client.force_authenticate(users[0])
+            self.assertEqual(self.get_parid(), 'P000')
+            Property.objects.filter(pk=self.prop.pk).update(parid='P100')
+            self.assertEqual(self.get_parid(), 'P000')
+            self.client.force_authenticate(users[1])
+            self.assertEqual(self.get_parid(), 'P100')
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.get_parid(), 'P100')
+
+
+class ConditionalGetTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(ConditionalGetTest, self).setUp()
+        self.prop = self.create_properties(1)[0]
+        self.url_path = 'property/{}'.format(self.prop.id)
+
+    def test_etag(self):
+        response = self.get(self.url_path)
+        etag = response['ETag']
+        response = self.client.get(self.url(self.url_path), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertNotEqual(self.get(self.url_path, fields='id')['ETag'], etag)
+
+        response = self.client.patch(self.url(self.url_path), {'parid': 'P100'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.url(self.url_path), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['parid'], 'P100')
+
+    def test_last_modified(self):
+        response = self.get(self.url_path)
+        last_modified = response['Last-Modified']
+        response = self.client.get(self.url(self.url_path), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get(self.url(self.url_path), HTTP_IF_MODIFIED_SINCE=http_date(time.time() - 3600))
+        self.assertEqual(response.status_code, 200)
+
+    def test_last_modified_after_cache_flush(self):
+        """ a lost timestamp starts from current time (it is never older than the last change) """
+        cache.delete(COUNTY_MODIFIED_CACHE_KEY.format(county_id=self.county.id))
+        before = http_date(time.time() - 1)
+        response = self.client.get(self.url(self.url_path), HTTP_IF_MODIFIED_SINCE=before)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+
+class BatchLookupTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(BatchLookupTest, self).setUp()
+        self.props = self.create_properties(3)
+        Property.objects.create(county=County.objects.create(name='other'), parid='P999')
+
+    def lookup(self, values):
+        return self.client.post(self.url('property/lookup'), values, format='json')
+
+    def test_results_and_missing(self):
+        response = self.lookup(['P002', 'P999', 'P000', 'X', 'P002'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([r['id'] for r in response.data['results']], [self.props[0].id, self.props[2].id])
+        self.assertEqual(response.data['missing'], ['P999', 'X'])
+
+    def test_invalid_input(self):
+        self.assertEqual(self.lookup({'parid': 'P000'}).status_code, 400)
+        self.assertEqual(self.lookup([1, 2]).status_code, 400)
+        with self.settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, MAX_BATCH_SIZE_DEFAULT=2)):
+            self.assertEqual(self.lookup(['P000', 'P001', 'P002']).status_code, 400)
+            self.assertEqual(self.lookup(['P000', 'P001']).status_code, 200)
+
+    def test_view_permission(self):
+        """ lookup reads objects, so it needs view (not add) permission """
+        self.user.is_superuser = False
+        self.user.save()
+        with mock.patch.object(User, 'has_perm', lambda user, perm, obj=None: perm == 'prop.add_property'):
+            self.assertEqual(self.lookup(['P000']).status_code, 403)
+        with mock.patch.object(User, 'has_perm', lambda user, perm, obj=None: perm == 'prop.view_property'):
+            self.assertEqual(self.lookup(['P000']).status_code, 200)
+
+
+class SearchTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        self.owners = {name: Owner.objects.create(county=self.county, name=name)
+                       for name in ('john smith', 'smith smithson', 'jane doe')}
+        Owner.objects.create(county=County.objects.create(name='other'), name='john smith')
+
+    def search(self, query, **params):
+        response = self.get('owner/search', q=query, **params)
+        self.assertEqual(response.status_code, 200)
+        return [r['name'] for r in response.data['results']]
+
+    def test_sqlite_fts(self):
+        self.assertTrue(search.has_fts_table(connection, 'prop_owner'))
+        self.assertEqual(self.search('john smi'), ['john smith'])
+        self.assertEqual(self.search('doe'), ['jane doe'])
+        # matched more (bm25) is ranked first
+        self.assertEqual(self.search('smith'), ['smith smithson', 'john smith'])
+
+    def test_sqlite_fts_triggers(self):
+        owner = self.owners['jane doe']
+        owner.name = 'jane roe'
+        owner.save()
+        self.assertEqual(self.search('doe'), [])
+        self.assertEqual(self.search('roe'), ['jane roe'])
+        owner.delete()
+        self.assertEqual(self.search('roe'), [])
+        Owner.objects.create(county=self.county, name='richard roe')
+        self.assertEqual(self.search('roe'), ['richard roe'])
+
+    def test_icontains_fallback(self):
+        with mock.patch.object(search, 'has_fts_table', lambda connection, table: False):
+            self.assertEqual(self.search('smith john'), ['john smith'])
+            self.assertEqual(sorted(self.search('smith')), ['john smith', 'smith smithson'])
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.get('owner/search').status_code, 400)
+        response = self.get('owner/search', q='smith', pagination='cursor')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('pagination', response.data)
+
+
+class LocalCountyCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.now = 100.0
+        patcher = mock.patch('time.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_lru_eviction(self):
+        local_cache = LocalCountyCache(maxsize=2, timeout=5)
+        local_cache.get('a')
+        local_cache.set('a', 1)
+        local_cache.set('b', 2)
+        self.assertEqual(local_cache.get('a'), 1)
+        local_cache.set('c', 3)
+        self.assertEqual([local_cache.get(k) for k in ('a', 'b', 'c')], [1, None, 3])
+
+    def test_clear_county_cached(self):
+        """ clear_county_cached of a process drops entries of other processes after timeout """
+        local_cache = LocalCountyCache(maxsize=10, timeout=5)
+        self.assertIsNone(local_cache.get('test'))
+        local_cache.set('test', {'id': 1})
+        generation = cache.get(COUNTY_CACHE_GENERATION_KEY)
+        self.assertIsNotNone(generation)
+
+        clear_county_cached('test')
+        self.assertEqual(cache.get(COUNTY_CACHE_GENERATION_KEY), generation + 1)
+        # generation is not read again in timeout window
+        self.now += 4
+        self.assertEqual(local_cache.get('test'), {'id': 1})
+        self.now += 2
+        self.assertIsNone(local_cache.get('test'))
+
+    def test_unchanged_generation(self):
+        cache.set(COUNTY_CACHE_GENERATION_KEY, 1)
+        local_cache = LocalCountyCache(maxsize=10, timeout=5)
+        local_cache.get('test')
+        local_cache.set('test', {'id': 1})
+        self.now += 10
+        self.assertEqual(local_cache.get('test'), {'id': 1})
+        # a lost generation is initialized again (entries are dropped once)
+        cache.delete(COUNTY_CACHE_GENERATION_KEY)
+        self.now += 10
+        self.assertIsNone(local_cache.get('test'))
+
+
+class DynamicFieldsTest(CountyApiTestCase):
+
+    def setUp(self):
+        super(DynamicFieldsTest, self).setUp()
+        self.owner = self.create_owners(self.create_properties(2))[0]
+
+    def test_fields_pushdown(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get('owner', fields='id,name')
+        self.assertEqual(response.data['results'][0], {'id': self.owner.id, 'name': 'owner 0'})
+        sqls = [q['sql'] for q in queries.captured_queries]
+        selects = [sql for sql in sqls if sql.startswith('SELECT "prop_owner"."id"')]
+        self.assertEqual(len(selects), 1)
+        self.assertTrue(selects[0].startswith('SELECT "prop_owner"."id", "prop_owner"."name" FROM'))
+        self.assertFalse([sql for sql in sqls if 'prop_owneraddress' in sql or 'prop_owner_properties' in sql])
+
+    def test_unknown_fields(self):
+        response = self.get('owner/{}'.format(self.owner.id), fields='id,unknown')
+        self.assertEqual(response.data, {'id': self.owner.id})
+        response = self.get('owner/{}'.format(self.owner.id), xfields='unknown,addresses')
+        self.assertNotIn('addresses', response.data)
+        self.assertEqual(response.data['name'], 'owner 0')
+
+    def test_write_requests_ignore_fields(self):
+        response = self.client.patch(self.url('owner/{}?fields=id'.format(self.owner.id)), {'name': 'owner 100'},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['name'], 'owner 100')
+        self.assertEqual(len(response.data['addresses']), 2)
+        response = self.client.post(self.url('property?fields=id'), {'parid': 'P100'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['parid'], 'P100')
+
+
+class QueryCountTest(CountyApiTestCase):
+    """ number of queries of list/retrieve/export does not depend on number of objects (no n+1 queries) """
+
+    def setUp(self):
+        super(QueryCountTest, self).setUp()
+        self.props = self.create_properties(5)
+        self.owners = self.create_owners(self.props)
+        # county and permissions of user are cached by first request
+        self.get('property', fields='id', page_size=1)
+
+    def assertQueries(self, num, path, **params):
+        with self.assertNumQueries(num):
+            response = self.get(path, **params)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+
+    def test_property(self):
+        self.assertQueries(2, 'property')
+        self.assertQueries(1, 'property/{}'.format(self.props[0].id))
+        self.assertQueries(1, 'property/export')
+        self.assertQueries(2, 'property', fields='id,parid')
+
+    def test_owner(self):
+        self.assertQueries(4, 'owner')
+        self.assertQueries(3, 'owner/{}'.format(self.owners[0].id))
+        # keyset chunks (last one is empty)
+        self.assertQueries(4, 'owner/export')
+        self.assertQueries(2, 'owner', fields='id,name')
+        self.assertQueries(3, 'owner', fields='id,name,addresses')
+        self.assertQueries(1, 'owner/{}'.format(self.owners[0].id), fields='id,name')
+
+
+class RecordingCursor(object):
+    """ cursor of postgresql catalog queries which records executed sql """
+
+    def __init__(self, partitions, tables):
+        self.partitions = partitions
+        self.tables = tables
+        self.executed = []
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, list(params or ())))
+        if 'pg_inherits' in sql:
+            self.result = [(p,) for p in self.partitions.get(params[0], [])]
+        elif 'to_regclass(%s) IS NOT NULL' in sql:
+            self.result = [(params[0] in self.tables,)]
+
+    def fetchall(self):
+        return self.result
+
+    def fetchone(self):
+        return self.result[0]
+
+
+class PartitionsTest(CountyApiTestCase):
+
+    def test_partition_sql(self):
+        self.assertFalse(partitions.can_partition(connection))
+        self.assertFalse(partitions.is_partitioned(connection, 'prop_account'))
+        self.assertEqual(partitions.partition_unique_columns(['id']), ['id', 'county_id', 'tax_year'])
+        self.assertEqual(partitions.partition_unique_columns(['property_id', 'tax_year']),
+                         ['property_id', 'tax_year', 'county_id'])
+        self.assertEqual(partitions.county_partition_sql('prop_account', 3), [
+            'CREATE TABLE prop_account_c3 PARTITION OF prop_account FOR VALUES IN (3) PARTITION BY RANGE (tax_year)',
+            'CREATE TABLE prop_account_c3_default PARTITION OF prop_account_c3 DEFAULT',
+        ])
+        self.assertEqual(partitions.year_partition_sql('prop_account', 3, 2016), [
+            'CREATE TABLE prop_account_c3_y2016 PARTITION OF prop_account_c3 FOR VALUES FROM (2016) TO (2017)'])
+
+    def drop_partitions(self, before_year):
+        cursor = RecordingCursor(
+            {'prop_account_c3': ['prop_account_c3_default', 'prop_account_c3_y2015', 'prop_account_c3_y2016']},
+            {'prop_account_c3'})
+        db = mock.Mock(alias=connection.alias, cursor=lambda: cursor)
+        dropped = partitions.drop_partitions(db, 'prop_account', 'account', 3, before_year)
+        return dropped, cursor.executed
+
+    def test_drop_partitions_log_purge(self):
+        """ dropped partitions are logged with one purge (not a change log per row) """
+        dropped, executed = self.drop_partitions(2016)
+        self.assertEqual(dropped, ['prop_account_c3_y2015'])
+        logs = [(sql, params) for sql, params in executed if 'prop_changelog' in sql]
+        self.assertEqual(len(logs), 1)
+        self.assertIn("'purge', now(), txid_current()", logs[0][0])
+        self.assertEqual(logs[0][1], [3, 'account', 2016])
+        self.assertIn(('DROP TABLE prop_account_c3_y2015', []), executed)
+        self.assertNotIn(('DROP TABLE prop_account_c3_y2016', []), executed)
+
+        dropped, executed = self.drop_partitions(None)
+        self.assertEqual(dropped, ['prop_account_c3'])
+        self.assertEqual([params for sql, params in executed if 'prop_changelog' in sql], [[3, 'account', 0]])
+
+    def test_sqlite_fallback(self):
+        """ databases without partitioning delete rows (which are logged one by one) """
+        prop = self.create_properties(1)[0]
+        old, new = self.create_account(prop, tax_year=2015), self.create_account(prop, tax_year=2016)
+        generation = get_county_generation(self.county.id)
+        with redirect_stdout(io.StringIO()):
+            call_command('manage_partitions', counties=['test'], drop_before_year=2016)
+        self.assertEqual(list(Account.objects.values_list('id', flat=True)), [new.id])
+        self.assertEqual(list(AccountTaxTypeSummary.objects.values_list('tax_year', flat=True)), [2016])
+        self.assertTrue(ChangeLog.objects.filter(model_name='account', object_id=old.id,
+                                                 action=ChangeLog.ACTION_DELETE).exists())
+        self.assertGreater(get_county_generation(self.county.id), generation)
+
+    def test_change_feed_purge(self):
+        ChangeLog.objects.create(county=self.county, model_name='account', object_id=2016,
+                                 action=ChangeLog.ACTION_PURGE)
+        response = self.get('changes', models='account')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(c['action'], c['object_id'], c['data']) for c in response.data['results']],
+                         [('purge', 2016, None)])
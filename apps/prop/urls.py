@@ -20,6 +20,7 @@ county_base_rest_router.register(r'owner_address', OwnerAddressView)
 county_base_rest_router.register(r'property_address', PropertyAddressView)
 county_base_rest_router.register(r'account', AccountView)
 county_base_rest_router.register(r'lien_auction', LienAuctionView)
+county_base_rest_router.register(r'changes', ChangeFeedView)
 
 general_rest_router = routers.DefaultRouter()
 general_rest_router.trailing_slash = "/?"  # added to support both / and slashless
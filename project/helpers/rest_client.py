@@ -1,5 +1,9 @@
 import json
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from urllib.parse import urlparse, parse_qsl, urlencode
 
 
@@ -12,15 +16,74 @@ class RestResponseException(Exception):
 
 
 class RestClient(object):
+    """
+    rest api client. all requests share one keep-alive session (connection pool), failed
+    connections and gateway errors are retried with backoff, and submit/map methods
+    run requests concurrently in a thread pool of "workers" threads.
+    """
 
     headers = {'content-type': 'application/json'}
     auth_token_endpoint = '/token/auth/'
+    POOL_SIZE = 10
+    MAX_RETRIES = 3
+    BACKOFF_FACTOR = 0.5
+    RETRY_STATUS_CODES = (502, 503, 504)
 
-    def __init__(self, server_url, username=None, password=None):
+    def __init__(self, server_url, username=None, password=None, pool_size=None, max_retries=None,
+                 backoff_factor=None, workers=None):
         self.server_url = server_url.rstrip()
         self._api_key = None
+        self._api_key_lock = threading.Lock()
+        self._executor = None
         self.username = username
         self.password = password
+        self.pool_size = pool_size or self.POOL_SIZE
+        self.max_retries = self.MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_factor = self.BACKOFF_FACTOR if backoff_factor is None else backoff_factor
+        self.workers = workers or self.pool_size
+        self.session = self.make_session()
+
+    def make_session(self):
+        retry = Retry(total=self.max_retries, backoff_factor=self.backoff_factor,
+                      status_forcelist=self.RETRY_STATUS_CODES, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        run fn in a worker thread and return a Future.
+        fn can be a callable or name of a client method, i.e: client.submit('get', 'grand/api/v1/property')
+        """
+        if isinstance(fn, str):
+            fn = getattr(self, fn)
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def map(self, fn, *iterables):
+        """ like builtin map, but calls run concurrently. results are yielded in order. """
+        if isinstance(fn, str):
+            fn = getattr(self, fn)
+        return self.executor.map(fn, *iterables)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
 
     @staticmethod
     def get_json(response):
@@ -32,9 +95,11 @@ class RestClient(object):
     @property
     def api_key(self):
         if not self._api_key:
-            data = {'username': self.username, 'password': self.password}
-            r = self.post(self.auth_token_endpoint, data=data, auth=False)
-            self._api_key = r['token']
+            with self._api_key_lock:
+                if not self._api_key:
+                    data = {'username': self.username, 'password': self.password}
+                    r = self.post(self.auth_token_endpoint, data=data, auth=False)
+                    self._api_key = r['token']
         return self._api_key
 
     def abs_url(self, endpoint):
@@ -54,8 +119,8 @@ class RestClient(object):
         headers = self.make_headers(extra_headers=headers, auth=auth)
         is_json = 'application/json' in (headers.get('content-type') or '')
         data = json.dumps(data) if is_json else (data or {})
-        res = requests.post(self.abs_url(path), data=data, files=files,
-                            headers=headers, **kwargs)
+        res = self.session.post(self.abs_url(path), data=data, files=files,
+                                headers=headers, **kwargs)
         if not raw_response:
             res = self.get_json(res)
         return res
@@ -65,8 +130,8 @@ class RestClient(object):
         headers = self.make_headers(extra_headers=headers, auth=auth)
         is_json = 'application/json' in (headers.get('content-type') or '')
         data = json.dumps(data) if is_json else (data or '')
-        res = requests.delete(self.abs_url(path), data=data,
-                              headers=headers, **kwargs)
+        res = self.session.delete(self.abs_url(path), data=data,
+                                  headers=headers, **kwargs)
         if not raw_response:
             res = self.get_json(res)
         return res
@@ -76,8 +141,8 @@ class RestClient(object):
         headers = self.make_headers(extra_headers=headers, auth=auth)
         is_json = 'application/json' in (headers.get('content-type') or '')
         data = json.dumps(data) if is_json else (data or '')
-        res = requests.put(self.abs_url(path), data=data, files=files,
-                           headers=headers, **kwargs)
+        res = self.session.put(self.abs_url(path), data=data, files=files,
+                               headers=headers, **kwargs)
         if not raw_response:
             res = self.get_json(res)
         return res
@@ -92,8 +157,8 @@ class RestClient(object):
         params = urlencode(query)
 
         headers = self.make_headers(extra_headers=headers, auth=auth)
-        res = requests.get(self.abs_url(path), headers=headers,
-                           params=params, **kwargs)
+        res = self.session.get(self.abs_url(path), headers=headers,
+                               params=params, **kwargs)
         if not raw_response:
             res = self.get_json(res)
         return res
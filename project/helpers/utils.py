@@ -1,6 +1,9 @@
 import base64
 import datetime
 import decimal
+import functools
+import hashlib
+import json
 import os
 import random
 import string
@@ -8,20 +11,27 @@ import uuid
 
 from django.conf import settings
 from django.contrib.auth.views import redirect_to_login
-from django.core.exceptions import PermissionDenied
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist, PermissionDenied
 from django.core.files.base import ContentFile
-from django.db import IntegrityError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator as DjangoPaginator
+from django.db import IntegrityError, connection, connections
+from django.db.models import Prefetch
 from django.http import JsonResponse
 from django.shortcuts import render
 from django.urls import reverse
 from django.utils import timezone, six
 from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 from django.utils.timezone import is_aware, make_aware
 from rest_framework.response import Response
-from rest_framework.permissions import DjangoModelPermissions
+from rest_framework.permissions import DjangoModelPermissions, SAFE_METHODS
 from django_filters.filters import EMPTY_VALUES, OrderingFilter
 from rest_framework import status, serializers
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination, _positive_int
+from rest_framework.relations import ManyRelatedField, RelatedField
+from rest_framework.utils.urls import replace_query_param
 
 
 from django.contrib.auth.mixins import PermissionRequiredMixin as \
@@ -100,11 +110,137 @@ def to_dict(obj, fields=None, fields_map=None, extra_fields=None):
     return data
 
 
+class CountStrategyPaginator(DjangoPaginator):
+    """ django paginator which gets count of objects from count_func (if it is given) """
+
+    def __init__(self, object_list, per_page, count_func=None, **kwargs):
+        self.count_func = count_func
+        super(CountStrategyPaginator, self).__init__(object_list, per_page, **kwargs)
+
+    @cached_property
+    def count(self):
+        if self.count_func is not None:
+            return self.count_func(self.object_list)
+        return self.object_list.count()
+
+    def page(self, number):
+        """ count of count_func may be old (i.e. cached), so objects of a page are not cut to it """
+        if self.count_func is None:
+            return super(CountStrategyPaginator, self).page(number)
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+
+class NoCountPage(Page):
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super(NoCountPage, self).__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class NoCountPaginator(DjangoPaginator):
+    """
+    django paginator which never counts objects.
+    it fetches one extra object to know there is a next page or not.
+    num_pages is the number of pages known after calling page() (None before that).
+    """
+    known_pages = None
+
+    @property
+    def count(self):
+        return None
+
+    @property
+    def num_pages(self):
+        return self.known_pages
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage('That page contains no results')
+        has_next = len(rows) > self.per_page
+        self.known_pages = number + 1 if has_next else number
+        return NoCountPage(rows[:self.per_page], number, self, has_next)
+
+
+def estimate_count(queryset):
+    """ return planner estimated rows of queryset (only on postgresql, otherwise None) """
+    conn = connections[queryset.db]
+    if conn.vendor != 'postgresql':
+        return None
+    try:
+        sql, params = queryset.order_by().query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    with conn.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
 class CustomPagination(PageNumberPagination):
-    """ Custom Pagination to be used in rest api"""
+    """
+    Custom Pagination to be used in rest api.
+    it has two modes:
+    page: page number pagination (default)
+    cursor: keyset pagination on ordering field of view (i.e: id). it is selected by "pagination=cursor"
+        query parameter (or a "cursor" parameter), or by "pagination_mode = 'cursor'" attribute of view.
+        it does not use OFFSET and COUNT(*), so it is fast for walking all pages of big tables.
+
+    count of page mode is calculated by a count strategy which is "count_strategy" attribute of view
+    or PAGINATION_COUNT_STRATEGY setting:
+    exact: COUNT(*) on every request
+    cached: COUNT(*) is cached (per query sql and "get_count_cache_version" of view, i.e. county generation)
+        for PAGINATION_COUNT_CACHE_TIMEOUT seconds
+    estimated: planner estimated count for querysets not filtered by query parameters (postgresql only).
+        small estimates and filtered querysets fall back to cached count.
+    "count=false" query parameter skips counting (count and last_page will be null).
+    """
 
     BIG_PAGE_SIZE = 10000000
     page_size_query_param = 'page_size'
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+    PAGE_MODE = 'page'
+    CURSOR_MODE = 'cursor'
+    MODES = (PAGE_MODE, CURSOR_MODE)
+    mode = PAGE_MODE
+    count_query_param = 'count'
+    EXACT_COUNT = 'exact'
+    CACHED_COUNT = 'cached'
+    ESTIMATED_COUNT = 'estimated'
+    COUNT_STRATEGIES = (EXACT_COUNT, CACHED_COUNT, ESTIMATED_COUNT)
+    COUNT_CACHE_KEY = 'pagination-count-{}'
+    # estimates less than this are counted (planner estimates are not accurate for small results)
+    ESTIMATE_MIN_COUNT = 10000
+    # query parameters which do not filter queryset
+    NON_FILTER_PARAMS = ('page', 'page_size', 'ordering', 'fields', 'xfields', 'format', 'count', 'pagination',
+                         'cursor')
+    count_estimated = False
+    view = None
 
     def paginate_queryset(self, queryset, request, view=None):
         if view:
@@ -113,8 +249,66 @@ class CustomPagination(PageNumberPagination):
                 from django.conf import settings
                 max_page_size = settings.REST_FRAMEWORK.get('MAX_PAGE_SIZE_DEFAULT', 100)
             self.max_page_size = self.BIG_PAGE_SIZE if max_page_size == 0 else max_page_size
+        self.mode = self.get_mode(request, view)
+        if self.mode == self.CURSOR_MODE:
+            return self.paginate_queryset_by_cursor(queryset, request, view=view)
+        # request and view are used by count strategies before rest framework sets them
+        self.request = request
+        self.view = view
+        self.count_estimated = False
+        self.django_paginator_class = self.get_django_paginator_class(request, view)
         return super(CustomPagination, self).paginate_queryset(queryset, request, view=view)
 
+    def get_count_strategy(self, view=None):
+        from django.conf import settings
+        strategy = getattr(view, 'count_strategy', None) or \
+            settings.REST_FRAMEWORK.get('PAGINATION_COUNT_STRATEGY', self.EXACT_COUNT)
+        if strategy not in self.COUNT_STRATEGIES:
+            raise ValueError('invalid count strategy: {}'.format(strategy))
+        return strategy
+
+    def get_django_paginator_class(self, request, view=None):
+        if request.query_params.get(self.count_query_param, '').lower() in ('false', '0', 'no'):
+            return NoCountPaginator
+        count_func = {
+            self.EXACT_COUNT: None,
+            self.CACHED_COUNT: self.cached_count,
+            self.ESTIMATED_COUNT: self.estimated_count,
+        }[self.get_count_strategy(view)]
+        return functools.partial(CountStrategyPaginator, count_func=count_func)
+
+    def cached_count(self, queryset):
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        from django.conf import settings
+        get_version = getattr(self.view, 'get_count_cache_version', None)
+        version = get_version() if get_version else None
+        key = self.COUNT_CACHE_KEY.format(hashlib.md5('{}{}{}'.format(version, sql, params).encode()).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.REST_FRAMEWORK.get('PAGINATION_COUNT_CACHE_TIMEOUT', 60))
+        return count
+
+    def estimated_count(self, queryset):
+        filtered = any(p not in self.NON_FILTER_PARAMS for p in self.request.query_params)
+        count = None if filtered else estimate_count(queryset)
+        if count is None or count < self.ESTIMATE_MIN_COUNT:
+            return self.cached_count(queryset)
+        self.count_estimated = True
+        return count
+
+    def get_mode(self, request, view=None):
+        mode = request.query_params.get(self.mode_query_param)
+        if not mode and self.cursor_query_param in request.query_params:
+            mode = self.CURSOR_MODE
+        mode = mode or getattr(view, 'pagination_mode', None) or self.PAGE_MODE
+        if mode not in self.MODES:
+            raise ValidationError({self.mode_query_param: 'valid values are: {}'.format(', '.join(self.MODES))})
+        return mode
+
     def get_page_size(self, request):
         """
         this is overrided to allow 0 as a page_size.
@@ -134,8 +328,85 @@ class CustomPagination(PageNumberPagination):
             page_size = self.max_page_size
         return page_size
 
+    @staticmethod
+    def get_cursor_fields(view):
+        fields = getattr(view, 'cursor_ordering_fields', None)
+        if fields is None:
+            ordering = getattr(view, 'ordering', None) or 'id'
+            fields = [ordering.lstrip('-')] if isinstance(ordering, str) else []
+        return fields
+
+    def get_cursor_ordering(self, queryset, view):
+        """ cursor ordering should be a single unique field (or its reverse) """
+        ordering = list(queryset.query.order_by) or [getattr(view, 'ordering', None) or 'id']
+        fields = self.get_cursor_fields(view)
+        if len(ordering) != 1 or not isinstance(ordering[0], str) or ordering[0].lstrip('-') not in fields:
+            raise ValidationError({'ordering': 'cursor pagination only supports ordering by: {}'.format(
+                ', '.join(fields))})
+        return ordering[0]
+
+    def encode_cursor(self, value, reverse=False):
+        data = json.dumps({'v': value, 'r': int(reverse)}, default=str, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        """ return (value, reverse) of cursor parameter or None """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            data = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode())
+            return data['v'], bool(data.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+
+    def get_cursor_page_size(self, request):
+        """
+        page size of cursor mode limited by max_page_size.
+        it does not trust callers (views may call paginate_queryset_by_cursor without paginate_queryset),
+        so a missing page_size/max_page_size falls back to settings.
+        """
+        from django.conf import settings
+        max_page_size = self.max_page_size or settings.REST_FRAMEWORK.get('MAX_PAGE_SIZE_DEFAULT', 100)
+        if self.max_page_size is None:
+            self.max_page_size = max_page_size
+        page_size = self.get_page_size(request) or self.page_size or max_page_size
+        return min(page_size, max_page_size)
+
+    def paginate_queryset_by_cursor(self, queryset, request, view=None):
+        self.request = request
+        self.page_size_value = self.get_cursor_page_size(request)
+        ordering = self.get_cursor_ordering(queryset, view)
+        field = ordering.lstrip('-')
+        descending = ordering.startswith('-')
+        cursor = self.decode_cursor(request)
+        reverse = cursor[1] if cursor else False
+        # we walk backward (reverse) to find previous page
+        forward = descending == reverse
+        if cursor:
+            queryset = queryset.filter(**{'{}__{}'.format(field, 'gt' if forward else 'lt'): cursor[0]})
+        rows = list(queryset.order_by(field if forward else '-' + field)[:self.page_size_value + 1])
+        has_more = len(rows) > self.page_size_value
+        rows = rows[:self.page_size_value]
+        if reverse:
+            rows.reverse()
+        self.has_next = cursor is not None if reverse else has_more
+        self.has_previous = has_more if reverse else cursor is not None
+        self.next_cursor = self.encode_cursor(getattr(rows[-1], field)) if rows and self.has_next else None
+        self.previous_cursor = self.encode_cursor(getattr(rows[0], field), reverse=True) \
+            if rows and self.has_previous else None
+        return rows
+
+    def get_cursor_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
     def get_paginated_response(self, data):
         """ override pagination structure in list rest api """
+        if self.mode == self.CURSOR_MODE:
+            return self.get_cursor_paginated_response(data)
 
         next_page = self.page.next_page_number() if \
             self.page.has_next() else None
@@ -149,28 +420,46 @@ class CustomPagination(PageNumberPagination):
                 'next_page': next_page,
                 'previous_page': previous_page,
                 'first_page': 1,
-                'last_page': self.page.paginator.num_pages,
+                'last_page': self.page.paginator.num_pages if self.page.paginator.count is not None else None,
                 'page_size': self.get_page_size(self.request),
                 'count': self.page.paginator.count,
+                'count_estimated': self.count_estimated,
+            },
+            'results': data
+        })
+
+    def get_cursor_paginated_response(self, data):
+        return Response({
+            'pagination': {
+                'next_url': self.get_cursor_link(self.next_cursor),
+                'previous_url': self.get_cursor_link(self.previous_cursor),
+                'next_cursor': self.next_cursor,
+                'previous_cursor': self.previous_cursor,
+                'page_size': self.page_size_value,
             },
             'results': data
         })
 
 
+def is_duplicate_error(error):
+    """ check an IntegrityError/ValidationError (or serializer errors) is about a unique key """
+    msg = str(error)
+    return 'already exists' in msg or 'must make a unique set' in msg
+
+
 def custom_rest_exception_handler(exc, context):
     """ Custom rest api exception handler """
     from rest_framework import exceptions
     from rest_framework.compat import set_rollback
     from rest_framework.views import exception_handler
     response = exception_handler(exc, context)
-    if isinstance(exc, IntegrityError) and ('already exists' in str(exc) or 'must make a unique set' in str(exc)):
+    if isinstance(exc, IntegrityError) and is_duplicate_error(exc):
         data = {'detail': 'duplicate unique key'}
         set_rollback()
         return Response(data, status=status.HTTP_409_CONFLICT)
     if isinstance(exc, exceptions.NotAuthenticated):
         response.status_code = status.HTTP_401_UNAUTHORIZED
-    if isinstance(exc, exceptions.ValidationError) and (
-            'already exists' in str(exc) or 'must make a unique set' in str(exc)):
+    if isinstance(exc, exceptions.ValidationError) and is_duplicate_error(exc):
         response.status_code = status.HTTP_409_CONFLICT
 
     return response
@@ -186,13 +475,16 @@ class DynamicFieldsSerializerMixin(object):
     fields=id,name
     or
     xfields=name1,name2
+    fields are dropped on serializer instance (not write requests), so QuerysetOptimizerMixin
+    only loads columns of selected fields.
     """
     def __init__(self, *args, **kwargs):
         super(DynamicFieldsSerializerMixin, self).__init__(*args, **kwargs)
-        if not self.context:
+        request = self.context.get('request') if self.context else None
+        if request is None or request.method not in SAFE_METHODS:
             return
 
-        params = self.context['request'].query_params
+        params = request.query_params
         fields = params.get('fields')
         xfields = params.get('xfields')
         if fields:
@@ -207,6 +499,95 @@ class DynamicFieldsSerializerMixin(object):
                 self.fields.pop(field_name, None)
 
 
+def get_serializer_lookups(serializer, model, prefix=''):
+    """
+    return (select_related, prefetch_related, only) lookups which are needed to serialize objects of model.
+    only is None if serializer reads attributes which are not model fields (methods, properties, source='*').
+    """
+    select_related, prefetch_related, only = [], [], [prefix + model._meta.pk.name]
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+        if field.source == '*' or '.' in field.source:
+            only = None
+            continue
+        try:
+            model_field = model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            only = None
+            continue
+        lookup = prefix + field.source
+        if not model_field.is_relation:
+            if only is not None:
+                only.append(lookup)
+            continue
+
+        related_model = model_field.related_model
+        many = model_field.many_to_many or model_field.one_to_many
+        if many:
+            if isinstance(field, serializers.BaseSerializer):
+                queryset = optimize_queryset(related_model._default_manager.all(), field.child,
+                                             extra_only=get_remote_fields(model_field))
+            elif isinstance(field, ManyRelatedField) and field.child_relation.use_pk_only_optimization():
+                queryset = related_model._default_manager.only(
+                    related_model._meta.pk.name, *get_remote_fields(model_field))
+            else:
+                queryset = None
+            prefetch_related.append(Prefetch(lookup, queryset=queryset))
+            continue
+
+        if model_field.concrete:
+            if only is not None:
+                only.append(lookup)
+            if isinstance(field, RelatedField) and field.use_pk_only_optimization():
+                # foreign key value is read from the object itself
+                continue
+        select_related.append(lookup)
+        if isinstance(field, serializers.BaseSerializer):
+            nested_select, nested_prefetch, nested_only = get_serializer_lookups(field, related_model, lookup + '__')
+        else:
+            nested_select, nested_prefetch, nested_only = [], [], None
+        select_related += nested_select
+        prefetch_related += nested_prefetch
+        if only is not None:
+            only += nested_only or ['{}__{}'.format(lookup, f.name) for f in related_model._meta.concrete_fields]
+    return select_related, prefetch_related, only
+
+
+def get_remote_fields(model_field):
+    """ fields of related objects which are needed to match prefetched objects (foreign key of reverse relations) """
+    if model_field.one_to_many:
+        return [model_field.field.name]
+    return []
+
+
+def optimize_queryset(queryset, serializer, extra_only=None):
+    """ apply minimal select_related/prefetch_related/only of serializer fields to queryset """
+    select_related, prefetch_related, only = get_serializer_lookups(serializer, queryset.model)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetch_related:
+        queryset = queryset.prefetch_related(*prefetch_related)
+    if only is not None:
+        queryset = queryset.only(*(only + (extra_only or [])))
+    return queryset
+
+
+class QuerysetOptimizerMixin(object):
+    """
+    optimize queryset of a viewset for its serializer fields (after "fields"/"xfields" are applied).
+    nested serializers are select_related (single objects) or prefetched (many objects) and only
+    serialized columns are loaded, so a page of objects does not run a query per object.
+    """
+    optimize_actions = ('list', 'retrieve', 'export', 'lookup', 'search')
+
+    def get_queryset(self):
+        queryset = super(QuerysetOptimizerMixin, self).get_queryset()
+        if self.action in self.optimize_actions:
+            queryset = optimize_queryset(queryset, self.get_serializer())
+        return queryset
+
+
 class ExtendedOrderingFilter(OrderingFilter):
     def __init__(self, *args, **kwargs):
         self.ordering_map = kwargs.pop('ordering_map', {})
@@ -244,6 +625,25 @@ class CustomDjangoModelPermissions(DjangoModelPermissions):
     }
 
 
+class LookupDjangoModelPermissions(CustomDjangoModelPermissions):
+    """ permissions of apis which read objects with POST requests (i.e. batch lookups) """
+    perms_map = dict(CustomDjangoModelPermissions.perms_map, POST=['%(app_label)s.view_%(model_name)s'])
+
+
+def bulk_create_with_ids(model, objs, batch_size=None):
+    """
+    bulk insert objs and make sure every object has its pk afterwards.
+    if database could not return ids from bulk insert (i.e: sqlite), objects are saved one by one.
+    """
+    if not objs:
+        return objs
+    if connection.features.can_return_ids_from_bulk_insert:
+        return model.objects.bulk_create(objs, batch_size=batch_size)
+    for obj in objs:
+        obj.save()
+    return objs
+
+
 def random_id(n=8, no_upper=False, no_lower=False, no_digit=False):
     rand = random.SystemRandom()
     chars = ''
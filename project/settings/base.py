@@ -86,6 +86,11 @@ REST_FRAMEWORK = {
                                 'rest_framework.filters.OrderingFilter'),
     'PAGE_SIZE': 25,
     'MAX_PAGE_SIZE_DEFAULT': 200,
+    'MAX_BATCH_SIZE_DEFAULT': 5000,
+    'PAGINATION_COUNT_STRATEGY': 'exact',
+    'PAGINATION_COUNT_CACHE_TIMEOUT': 60,
+    'RESPONSE_CACHE_TIMEOUT': 3600,
+    'QUERY_USAGE_RECORDER': False,
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',